@@ -0,0 +1,404 @@
+"""Benchmarks for the detectors and database paths of AnalysisService
+
+Runs each case over synthetic traffic events at several dataset sizes
+and records wall time, throughput and peak RSS as JSON:
+
+    python benchmark.py --sizes 10k,100k,1m --output results.json
+    python benchmark.py --sizes 10k,100k,1m --baseline baseline.json --tolerance 0.25
+    python benchmark.py --cases zscore,iqr,fetch_traffic_events,insert_anomalies --db
+
+Every (case, size) runs in a fresh process, so peak RSS belongs to that
+case alone: ``setup_peak_rss_mb`` is the peak after generating its data
+and ``peak_rss_mb`` the peak after running it. Detector cases work on
+in-memory data (IQR quartiles come from an in-memory stand-in for the
+metric_sketches table; models are fitted into a temporary registry).
+Database cases need ``--db`` and a reachable Postgres (DB_* variables);
+they work in a throwaway ``benchmark`` schema, which is dropped afterwards.
+
+With ``--baseline`` the results are compared against an earlier run;
+the exit status is 1 when a case got slower (fastest wall time) or
+bigger (peak RSS) by more than ``--tolerance``. Only compare runs made
+on the same machine.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from io import StringIO
+from typing import Optional, List, Dict, Any, Tuple
+
+import numpy as np
+import pandas as pd
+import sklearn
+from dotenv import load_dotenv
+
+from services.analysis import AnalysisService, METRICS
+from services.anomalies import AnomalyBatch
+from services.db import Database
+from services.models import ModelRegistry
+from services.quantiles import QuantileStore
+
+load_dotenv()
+
+DETECTOR_CASES = ['zscore', 'iqr', 'isolation_forest', 'lof', 'deduplicate']
+DB_CASES = ['fetch_traffic_events', 'insert_anomalies']
+CASES = DETECTOR_CASES + DB_CASES
+
+BENCHMARK_SCHEMA = 'benchmark'
+
+# Slowdowns smaller than this many seconds are timer noise, whatever the ratio
+MIN_REGRESSION_SECONDS = 0.005
+
+
+def parse_size(value: str) -> int:
+    """'10k' -> 10000, '1m' -> 1000000"""
+    value = value.strip().lower()
+    multiplier = {'k': 1000, 'm': 1000000}.get(value[-1:], 1)
+    return int(float(value.rstrip('km')) * multiplier)
+
+
+def synthetic_events(n: int, num_locations: int, seed: int = 42) -> pd.DataFrame:
+    """Events shaped like Database.fetch_traffic_events output, about 2% outliers"""
+    rng = np.random.default_rng(seed)
+
+    timestamp = np.sort(rng.integers(0, 30 * 86400, n)) + 1704067200
+    location_id = rng.integers(1, num_locations + 1, n)
+    # Give each location its own level so per-location detectors have work to do
+    level = rng.uniform(0.7, 1.3, num_locations + 1)[location_id]
+
+    vehicle_count = np.round(rng.normal(45, 12, n) * level).clip(1)
+    avg_speed = rng.normal(40, 8, n) * level
+    density = rng.uniform(0.2, 0.8, n) * level
+
+    outliers = rng.random(n) < 0.02
+    vehicle_count[outliers] *= rng.choice([0.2, 3.0], outliers.sum())
+    avg_speed[outliers] *= rng.choice([0.3, 2.0], outliers.sum())
+
+    return pd.DataFrame({
+        'id': np.arange(1, n + 1, dtype=np.int32),
+        'timestamp': timestamp,
+        'location_id': pd.Categorical(location_id.astype(np.int32)),
+        'vehicle_count': np.round(vehicle_count).astype(np.float32),
+        'avg_speed': avg_speed.round(2).astype(np.float32),
+        'min_speed': (avg_speed - 10).clip(5).round(2).astype(np.float32),
+        'max_speed': (avg_speed + 15).round(2).astype(np.float32),
+        'traffic_density_score': density.round(3).astype(np.float32)
+    })
+
+
+class MemoryDatabase(Database):
+    """In-memory stand-in for the parts of Database the detectors read
+
+    Serves metric_sketches rows sketched from the benchmark data and a
+    fixed watermark, so IQR runs without Postgres.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        super().__init__()
+        chunk = {name: df[name].to_numpy() for name in ['id', 'location_id'] + METRICS}
+        chunk = {name: values.astype(np.float64) if name in METRICS else values for name, values in chunk.items()}
+        sketches = QuantileStore(self).build(chunk, METRICS)
+        self._sketch_rows = [
+            (location_id, metric, sketch.count, sketch.quantile(0.25), sketch.quantile(0.75), None)
+            for (location_id, metric), sketch in sketches.items()
+        ]
+
+    def get_watermark(self, name: str) -> int:
+        return 0
+
+    def fetch_metric_sketches(self, include_sketches: bool = True, location_ids: Optional[List[int]] = None) -> List[Tuple]:
+        if location_ids is None:
+            return self._sketch_rows
+        return [row for row in self._sketch_rows if row[0] in location_ids]
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (2 ** 20 if sys.platform == 'darwin' else 1024)
+
+
+def _load_events(db: Database, df: pd.DataFrame) -> None:
+    """Create the benchmark schema and COPY the events into it"""
+    with db.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"DROP SCHEMA IF EXISTS {BENCHMARK_SCHEMA} CASCADE")
+        cursor.execute(f"CREATE SCHEMA {BENCHMARK_SCHEMA}")
+        # LIKE copies columns, defaults and indexes but not triggers, so the
+        # realtime NOTIFY trigger does not fire; own sequences keep public ids untouched
+        for table in ('traffic_events', 'anomalies'):
+            cursor.execute(f"CREATE TABLE {BENCHMARK_SCHEMA}.{table} (LIKE public.{table} INCLUDING ALL)")
+            cursor.execute(f"CREATE SEQUENCE {BENCHMARK_SCHEMA}.{table}_id_seq")
+            cursor.execute(
+                f"ALTER TABLE {BENCHMARK_SCHEMA}.{table} "
+                f"ALTER COLUMN id SET DEFAULT nextval('{BENCHMARK_SCHEMA}.{table}_id_seq')"
+            )
+
+        columns = ['id', 'timestamp', 'location_id', 'vehicle_count', 'avg_speed',
+                   'min_speed', 'max_speed', 'traffic_density_score']
+        rows = df[columns].assign(
+            timestamp=pd.to_datetime(df['timestamp'], unit='s', utc=True),
+            vehicle_count=df['vehicle_count'].astype(np.int64)
+        )
+        buffer = StringIO()
+        rows.to_csv(buffer, index=False, header=False, date_format='%Y-%m-%d %H:%M:%S+00')
+        buffer.seek(0)
+        cursor.copy_expert(
+            f"COPY {BENCHMARK_SCHEMA}.traffic_events ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+            buffer
+        )
+        cursor.execute(f"ANALYZE {BENCHMARK_SCHEMA}.traffic_events")
+        conn.commit()
+
+
+def _drop_schema(db: Database) -> None:
+    with db.connection() as conn:
+        conn.cursor().execute(f"DROP SCHEMA IF EXISTS {BENCHMARK_SCHEMA} CASCADE")
+        conn.commit()
+
+
+def _benchmark_db() -> Database:
+    db = Database()
+    # Unqualified table names resolve to the benchmark schema first
+    db.connection_params['options'] = f'-c search_path={BENCHMARK_SCHEMA},public'
+    return db
+
+
+def run_case(case: str, size: int, num_locations: int, repeat: int) -> Dict[str, Any]:
+    """Run one benchmark case ``repeat`` times (meant for a fresh process)"""
+    df = synthetic_events(size, num_locations)
+    db: Optional[Database] = None
+    model_dir = None
+    items = size
+    reset = None
+
+    try:
+        if case in DB_CASES:
+            db = _benchmark_db()
+            _load_events(db, df)
+            service = AnalysisService(db)
+        else:
+            service = AnalysisService(MemoryDatabase(df))
+
+        if case == 'zscore':
+            operation = lambda: service._detect_zscore(df)
+        elif case == 'iqr':
+            operation = lambda: service._detect_iqr(df)
+        elif case in ('isolation_forest', 'lof'):
+            model_dir = tempfile.TemporaryDirectory()
+
+            # A cold registry every time, so each run fits and scores
+            def reset():
+                service.models = ModelRegistry(root=tempfile.mkdtemp(dir=model_dir.name))
+
+            detect = service._detect_isolation_forest if case == 'isolation_forest' else service._detect_lof
+            operation = lambda: detect(df)
+        elif case == 'deduplicate':
+            batches = [service._detect_zscore(df, threshold=1.5), service._detect_iqr(df)]
+            items = sum(len(batch) for batch in batches)
+            operation = lambda: service._deduplicate_anomalies(batches)
+        elif case == 'fetch_traffic_events':
+            operation = lambda: db.fetch_traffic_events()
+        elif case == 'insert_anomalies':
+            # One anomaly for every tenth event
+            mask = np.zeros(size, dtype=bool)
+            mask[::10] = True
+            anomalies = AnomalyBatch.from_mask(
+                df['id'].to_numpy(), mask, 'zscore', np.full(size, 0.9), 'vehicle_count', scores=4.0
+            )
+            items = len(anomalies)
+
+            def reset():
+                with db.connection() as conn:
+                    conn.cursor().execute("TRUNCATE anomalies")
+                    conn.commit()
+
+            operation = lambda: db.insert_anomalies(anomalies)
+        else:
+            raise ValueError(f'Unknown benchmark case: {case}')
+
+        setup_peak = _peak_rss_mb()
+        timings = []
+
+        for _ in range(repeat):
+            if reset is not None:
+                reset()
+            started = time.perf_counter()
+            operation()
+            timings.append(time.perf_counter() - started)
+    finally:
+        if db is not None:
+            _drop_schema(db)
+        if model_dir is not None:
+            model_dir.cleanup()
+
+    median = statistics.median(timings)
+    return {
+        'case': case,
+        'size': size,
+        'items': items,
+        'repeat': repeat,
+        'wall_seconds': {
+            'min': round(min(timings), 6),
+            'median': round(median, 6),
+            'max': round(max(timings), 6)
+        },
+        'throughput_per_second': round(items / median) if median > 0 else None,
+        'setup_peak_rss_mb': round(setup_peak, 1),
+        'peak_rss_mb': round(_peak_rss_mb(), 1)
+    }
+
+
+def _run_case(args: Tuple[str, int, int, int]) -> Dict[str, Any]:
+    return run_case(*args)
+
+
+def run_suite(
+    cases: List[str],
+    sizes: List[int],
+    num_locations: int,
+    repeat: int,
+    timeout: Optional[float] = None
+) -> Dict[str, Any]:
+    """Run every case at every size, each in its own process"""
+    results = []
+    context = multiprocessing.get_context('spawn')
+
+    for size in sizes:
+        for case in cases:
+            print(f"{case} @ {size:,} rows ...", end=' ', flush=True)
+            with context.Pool(1) as pool:
+                pending = pool.apply_async(_run_case, ((case, size, num_locations, repeat),))
+                try:
+                    result = pending.get(timeout)
+                except multiprocessing.TimeoutError:
+                    result = {'case': case, 'size': size, 'error': f'timed out after {timeout}s'}
+                except Exception as e:
+                    result = {'case': case, 'size': size, 'error': f'{type(e).__name__}: {e}'}
+
+            if 'error' in result:
+                print(f"failed ({result['error']})")
+            else:
+                print(f"{result['wall_seconds']['median']:.3f}s, "
+                      f"{result['throughput_per_second']:,}/s, peak {result['peak_rss_mb']:.0f} MB")
+            results.append(result)
+
+    return {
+        'meta': {
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'sklearn': sklearn.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'locations': num_locations,
+            'repeat': repeat
+        },
+        'results': results
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> Dict[str, Any]:
+    """Compare wall time and peak RSS per (case, size) against a baseline run
+
+    Wall time is compared on the fastest repetition, which is the least
+    sensitive to noise from other processes, and only counts as regressed
+    when it also grew by MIN_REGRESSION_SECONDS.
+    """
+    previous = {
+        (result['case'], result['size']): result
+        for result in baseline.get('results', []) if 'error' not in result
+    }
+
+    comparisons = []
+    regressions = []
+
+    for result in current['results']:
+        before = previous.get((result['case'], result['size']))
+        if before is None or 'error' in result:
+            continue
+
+        time_ratio = result['wall_seconds']['min'] / before['wall_seconds']['min'] \
+            if before['wall_seconds']['min'] > 0 else None
+        rss_ratio = result['peak_rss_mb'] / before['peak_rss_mb'] if before['peak_rss_mb'] > 0 else None
+
+        entry = {
+            'case': result['case'],
+            'size': result['size'],
+            'time_ratio': None if time_ratio is None else round(time_ratio, 3),
+            'rss_ratio': None if rss_ratio is None else round(rss_ratio, 3),
+            'regressed': []
+        }
+        slowdown = result['wall_seconds']['min'] - before['wall_seconds']['min']
+        if time_ratio is not None and time_ratio > 1 + tolerance and slowdown > MIN_REGRESSION_SECONDS:
+            entry['regressed'].append('wall_time')
+        if rss_ratio is not None and rss_ratio > 1 + tolerance:
+            entry['regressed'].append('peak_rss')
+
+        comparisons.append(entry)
+        if entry['regressed']:
+            regressions.append(entry)
+
+    return {'tolerance': tolerance, 'cases': comparisons, 'regressions': regressions}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Benchmark AnalysisService detectors and database paths')
+    parser.add_argument('--cases', default=','.join(DETECTOR_CASES),
+                        help=f'comma-separated subset of: {", ".join(CASES)}')
+    parser.add_argument('--sizes', default=os.getenv('BENCHMARK_SIZES', '10k,100k,1m'),
+                        help='comma-separated row counts, e.g. 10k,100k,1m,10m')
+    parser.add_argument('--locations', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--timeout', type=float, default=None, help='seconds allowed per case and size')
+    parser.add_argument('--db', action='store_true', help='also run the database cases')
+    parser.add_argument('--output', help='write the results JSON to this file')
+    parser.add_argument('--baseline', help='results JSON of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=float(os.getenv('BENCHMARK_TOLERANCE', '0.2')),
+                        help='allowed relative slowdown / memory growth before a case counts as regressed')
+    args = parser.parse_args()
+
+    cases = [case.strip() for case in args.cases.split(',') if case.strip()]
+    unknown = [case for case in cases if case not in CASES]
+    if unknown:
+        parser.error(f'unknown cases: {", ".join(unknown)}')
+    if args.db:
+        cases += [case for case in DB_CASES if case not in cases]
+    elif any(case in DB_CASES for case in cases):
+        parser.error('database cases need --db')
+
+    sizes = [parse_size(size) for size in args.sizes.split(',') if size.strip()]
+    report = run_suite(cases, sizes, args.locations, args.repeat, args.timeout)
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['comparison'] = compare(report, json.load(f), args.tolerance)
+
+        for entry in report['comparison']['regressions']:
+            print(f"REGRESSION {entry['case']} @ {entry['size']:,}: "
+                  f"time x{entry['time_ratio']}, peak RSS x{entry['rss_ratio']}")
+        if report['comparison']['regressions']:
+            status = 1
+        else:
+            print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,13 +1,25 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 from datetime import datetime
 import uvicorn
+import asyncio
+import base64
+import json
 import os
-from typing import Optional
+from typing import Optional, Tuple
 
-from services.analysis import AnalysisService
+from services.analysis import DETAIL_MODES, METRICS, MemoryBudgetError, run_analysis_job
+from services.db import Database, ConcurrentRunError
+from services.jobs import Job, JobManager, JobNotFoundError, JobQueueFullError, JobStateError
 from services.llm_client import OllamaClient
+from services.metrics import PROFILERS, registry
+from services.partitions import PartitionMaintainer
+from services.realtime import RealtimeConsumer
+from services.results import AnalysisResultCache
+from services.scheduler import WindowScheduler
+from services.suggestions import SuggestionQueue, SuggestionNotFoundError
 
 app = FastAPI(title="PatternScope Analysis Service")
 
@@ -20,18 +32,214 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize services
-analysis_service = AnalysisService()
+# Initialize services (sharing one pooled database handle)
+db = Database()
 llm_client = OllamaClient(
     url=os.getenv('OLLAMA_URL', 'http://ollama:11434'),
-    model=os.getenv('OLLAMA_MODEL', 'llama2')
+    model=os.getenv('OLLAMA_MODEL', 'llama2'),
+    db=db
 )
 
+# LLM generation runs in the background; overlapping queued windows are merged
+suggestion_queue = SuggestionQueue(
+    llm_client,
+    max_concurrency=int(os.getenv('SUGGESTION_MAX_CONCURRENCY', '1')),
+    retention_seconds=float(os.getenv('SUGGESTION_RETENTION_SECONDS', '3600'))
+)
+
+
+def parse_event_time(value: Optional[str], like: Optional[datetime]) -> Optional[datetime]:
+    """Parse an event time from a result, naive (UTC) when the other bound ``like`` is naive"""
+    if value is None:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if like is not None and like.tzinfo is None:
+        parsed = parsed.replace(tzinfo=None)
+    return parsed
+
+
+async def add_trend_suggestions(job: Job):
+    """Queue trend suggestions if anomalies were found and reference them in the result"""
+    result = job.result
+    if result['anomalies_detected'] > 0:
+        # Open-ended runs are described by the span of the events they analyzed
+        period = result['period']
+        start = job.params['start'] or parse_event_time(period.get('first_event_at'), job.params['end'])
+        end = job.params['end'] or parse_event_time(period.get('last_event_at'), job.params['start'])
+        request = suggestion_queue.submit(
+            summary=result['anomaly_summary'],
+            start=start,
+            end=end
+        )
+        result['suggestion'] = request.to_dict()
+
+
+analysis_runs = registry.counter(
+    'analysis_runs_total', 'Finished analysis jobs by mode and status', ('mode', 'status')
+)
+analysis_run_seconds = registry.histogram(
+    'analysis_run_seconds', 'Analysis job run time, excluding time queued', ('mode',)
+)
+
+
+def observe_analysis(job: Job):
+    """Record a finished job's run time and stage timings (measured in the worker)"""
+    params = job.params
+    if params['incremental']:
+        mode = 'incremental'
+    elif params['streaming']:
+        mode = 'streaming'
+    elif params['partition_by']:
+        mode = 'partitioned'
+    else:
+        mode = 'window'
+
+    analysis_runs.inc(mode, job.status)
+    if job.started_at is not None and job.status != 'cancelled':
+        analysis_run_seconds.observe(job.finished_at - job.started_at, mode)
+
+    if job.result is not None:
+        timings = job.result.get('timings') if params.get('timings') else job.result.pop('timings', None)
+    else:
+        timings = getattr(job.error, 'timings', None)
+
+    if timings:
+        registry.observe_timings(timings)
+
+
+# Results of identical windows over unchanged data are served without a rerun
+result_cache = AnalysisResultCache(db)
+
+
+def finish_analysis(job: Job):
+    """Record a finished job and cache its result if it ran under a cache key
+
+    The suggestion reference is left out of the cached copy: it points at
+    this run's suggestion request, which may fail or be pruned long before
+    the cache entry expires.
+    """
+    observe_analysis(job)
+    if job.status == 'succeeded' and job.key is not None:
+        result_cache.put(job.key, {key: value for key, value in job.result.items() if key != 'suggestion'})
+
+
+# Analysis runs in worker processes so the event loop stays responsive
+job_manager = JobManager(
+    run_analysis_job,
+    max_workers=int(os.getenv('ANALYSIS_MAX_WORKERS', '2')),
+    executor=os.getenv('ANALYSIS_EXECUTOR', 'process'),
+    retention_seconds=float(os.getenv('ANALYSIS_JOB_RETENTION_SECONDS', '3600')),
+    on_result=add_trend_suggestions,
+    on_finish=finish_analysis,
+    max_queued=int(os.getenv('ANALYSIS_MAX_QUEUED_JOBS', '32')) or None
+)
+
+# Runs analysis over fixed windows on a cadence, catching up missed ones
+window_scheduler = WindowScheduler(db, job_manager)
+
+# Scores each traffic event as it is ingested (LISTEN/NOTIFY on traffic_events)
+realtime_consumer = RealtimeConsumer(db, METRICS)
+
+# Creates upcoming daily traffic_events partitions and drops expired ones
+partition_maintainer = PartitionMaintainer(db)
+
+# Profilers are opt-in: they slow the run down and expose code locations
+profiling_enabled = os.getenv('ANALYSIS_PROFILING_ENABLED', 'false').lower() == 'true'
+
+
+def collect_service_metrics():
+    """Gauges and counters read from the pool, job manager, caches, scheduler, LLM client and realtime consumer"""
+    pool = db.pool.stats()
+    jobs = job_manager.stats()
+    results = result_cache.stats()
+    cache = llm_client.cache.stats()
+    realtime = realtime_consumer.stats()
+    scheduler = window_scheduler.stats()
+    pool_events = ['checkouts', 'waits', 'timeouts', 'connects', 'connect_failures',
+                   'health_check_failures', 'discarded']
+
+    families = [
+        ('db_pool_connections', 'gauge', 'Pooled database connections of the API process',
+         [({'state': 'in_use'}, pool['in_use']), ({'state': 'idle'}, pool['idle'])]),
+        ('db_pool_events_total', 'counter', 'Connection pool events of the API process',
+         [({'event': event}, pool[event]) for event in pool_events]),
+        ('db_pool_wait_seconds_total', 'counter', 'Time spent waiting for a pooled connection',
+         [({}, pool['wait_seconds'])]),
+        ('analysis_jobs', 'gauge', 'Retained analysis jobs by status',
+         [({'status': status}, count) for status, count in jobs['jobs'].items()]),
+        ('analysis_submissions_total', 'counter', 'Analysis submissions coalesced onto a running job or rejected',
+         [({'outcome': outcome}, jobs[outcome]) for outcome in ('coalesced', 'rejected')]),
+        ('analysis_cache_entries', 'gauge', 'Cached analysis results', [({}, results['entries'])]),
+        ('analysis_cache_events_total', 'counter', 'Analysis result cache lookups and evictions',
+         [({'event': event}, results[event]) for event in ('hits', 'misses', 'evictions')]),
+        ('suggestion_requests', 'gauge', 'Retained suggestion requests by status',
+         [({'status': status}, count) for status, count in suggestion_queue.stats()['requests'].items()]),
+        ('analysis_scheduler_windows_total', 'counter', 'Scheduled analysis windows by outcome',
+         [({'outcome': outcome}, scheduler[outcome]) for outcome in ('submitted', 'succeeded', 'failed', 'released')]),
+        ('analysis_scheduler_pending_windows', 'gauge', 'Due windows not yet analyzed at the last scheduler tick',
+         [({}, scheduler['pending'])]),
+        ('llm_cache_entries', 'gauge', 'Cached LLM generations', [({}, cache['entries'])]),
+        ('llm_cache_events_total', 'counter', 'LLM response cache lookups and evictions',
+         [({'event': event}, cache[event]) for event in ('hits', 'misses', 'evictions')]),
+        ('llm_inflight', 'gauge', 'LLM generations in progress', [({}, llm_client.stats()['inflight'])]),
+        ('realtime_running', 'gauge', 'Whether the realtime consumer is running', [({}, int(realtime['running']))]),
+        ('realtime_events_total', 'counter', 'Realtime consumer events',
+         [({'event': event}, realtime[event])
+          for event in ('notifications', 'batches', 'events_scored', 'anomalies_detected', 'conflicts', 'errors')])
+    ]
+
+    if realtime['last_event_lag_seconds'] is not None:
+        families.append(('realtime_lag_seconds', 'gauge', 'Ingest-to-score lag of the last realtime batch',
+                         [({}, realtime['last_event_lag_seconds'])]))
+
+    return families
+
+
+registry.add_collector(collect_service_metrics)
+
 
 class AnalysisRequest(BaseModel):
     start: Optional[str] = None
     end: Optional[str] = None
     methods: Optional[list[str]] = None
+    incremental: bool = False
+    streaming: bool = False
+    partition_by: Optional[str] = None
+    # "summary" returns anomaly_summary only; page through /anomalies for the rest
+    details: str = 'full'
+    # Include the per-stage timing breakdown in the result
+    timings: bool = False
+    # Profile the run with tracemalloc or cprofile (needs ANALYSIS_PROFILING_ENABLED)
+    profile: Optional[str] = None
+
+
+@app.on_event("startup")
+async def startup():
+    """Open the minimum number of pooled database connections"""
+    try:
+        db.pool.warm()
+    except Exception as e:
+        print(f"Warning: could not warm database pool: {e}")
+
+    if os.getenv('REALTIME_ENABLED', 'false').lower() == 'true':
+        realtime_consumer.start()
+
+    if os.getenv('TRAFFIC_PARTITION_MAINTENANCE_ENABLED', 'true').lower() == 'true':
+        partition_maintainer.start()
+
+    if os.getenv('ANALYSIS_SCHEDULER_ENABLED', 'false').lower() == 'true':
+        window_scheduler.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    realtime_consumer.stop()
+    partition_maintainer.stop()
+    window_scheduler.stop()
+    job_manager.shutdown()
+    suggestion_queue.shutdown()
+    await llm_client.aclose()
+    db.pool.close()
 
 
 @app.get("/health")
@@ -44,36 +252,266 @@ async def health():
     }
 
 
-@app.post("/run-analysis")
-async def run_analysis(request: AnalysisRequest):
-    """Run anomaly detection analysis on traffic data"""
+@app.get("/db/pool")
+async def db_pool_stats():
+    """Database connection pool utilization"""
+    return db.pool.stats()
+
+
+@app.get("/suggestions")
+async def list_suggestions():
+    """Suggestion request counts per status"""
+    return suggestion_queue.stats()
+
+
+@app.get("/suggestions/{request_id}")
+async def get_suggestion(request_id: str, wait: float = 0):
+    """Suggestion request status and, once generated, the stored suggestions"""
+    try:
+        if wait > 0:
+            request = await suggestion_queue.wait(request_id, timeout=wait)
+        else:
+            request = suggestion_queue.get(request_id)
+    except SuggestionNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    return request.to_dict()
+
+
+@app.get("/suggestions/{request_id}/stream")
+async def stream_suggestion(request_id: str):
+    """Stream a suggestion's tokens as Server-Sent Events
+
+    ``token`` events carry text as it is generated (tokens produced before
+    the client connected are replayed first); a final ``done`` event
+    carries the request with the persisted suggestions.
+    """
+    try:
+        request = suggestion_queue.get(request_id)
+    except SuggestionNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    async def events():
+        async for token in request.stream():
+            yield f"event: token\ndata: {json.dumps({'text': token})}\n\n"
+        yield f"event: done\ndata: {json.dumps(request.to_dict(), default=str)}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.get("/llm/stats")
+async def llm_stats():
+    """LLM client response cache and in-flight generations"""
+    return llm_client.stats()
+
+
+@app.get("/db/partitions")
+async def db_partitions():
+    """traffic_events partition maintenance: last run, partitions created and dropped"""
+    return partition_maintainer.stats()
+
+
+@app.get("/scheduler")
+async def scheduler_stats():
+    """Window scheduler configuration, in-flight windows and recorded windows per status"""
+    windows = await asyncio.to_thread(db.fetch_analysis_window_counts, window_scheduler.name)
+    return {**window_scheduler.stats(), 'windows': windows}
+
+
+@app.get("/realtime")
+async def realtime_stats():
+    """Realtime consumer state, throughput and latency"""
+    return realtime_consumer.stats()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus metrics: pipeline stage timings, job outcomes and component gauges"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+async def submit_analysis(request: AnalysisRequest) -> Job:
+    """Validate the request and queue an analysis job
+
+    A cached result for the same window and data comes back as an already
+    succeeded job, and a request identical to one still queued or running
+    shares that job. A full queue is answered with 429.
+    """
     try:
         # Validate date range
         start_dt = datetime.fromisoformat(request.start) if request.start else None
         end_dt = datetime.fromisoformat(request.end) if request.end else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if request.profile is not None:
+        if not profiling_enabled:
+            raise HTTPException(status_code=403, detail='Profiling is disabled (set ANALYSIS_PROFILING_ENABLED=true)')
+        if request.profile not in PROFILERS:
+            raise HTTPException(status_code=400, detail=f'profile must be one of: {", ".join(PROFILERS)}')
+
+    if request.details not in DETAIL_MODES:
+        raise HTTPException(status_code=400, detail=f'details must be one of: {", ".join(DETAIL_MODES)}')
+
+    params = {
+        'start': start_dt,
+        'end': end_dt,
+        'methods': request.methods or ['zscore', 'iqr', 'isolation_forest'],
+        'incremental': request.incremental,
+        'streaming': request.streaming,
+        'partition_by': request.partition_by,
+        'details': request.details,
+        'timings': request.timings,
+        'profile': request.profile
+    }
+
+    key = None
+    if result_cache.cacheable(params):
+        key = await asyncio.to_thread(result_cache.key, params)
+        cached = result_cache.get(key)
+        if cached is not None:
+            return job_manager.add_finished(params, {**cached, 'cached': True})
+
+    try:
+        return job_manager.submit(params, key=key)
+    except JobQueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={'Retry-After': '5'})
+
+
+def raise_for_job(job: Job):
+    """Map a failed job to the HTTP error run-analysis would have returned"""
+    if job.status == 'cancelled':
+        raise HTTPException(status_code=409, detail=f'Job {job.id} was cancelled')
+    if job.status == 'failed':
+        if isinstance(job.error, ValueError):
+            raise HTTPException(status_code=400, detail=str(job.error))
+        if isinstance(job.error, ConcurrentRunError):
+            raise HTTPException(status_code=409, detail=str(job.error))
+        if isinstance(job.error, MemoryBudgetError):
+            raise HTTPException(status_code=413, detail=str(job.error))
+        raise HTTPException(status_code=500, detail=str(job.error))
+
+
+@app.post("/run-analysis")
+async def run_analysis(request: AnalysisRequest):
+    """Run anomaly detection analysis on traffic data and wait for the result"""
+    job = await submit_analysis(request)
+    job = await job_manager.wait(job.id)
+
+    raise_for_job(job)
+    return job.result
+
+
+@app.post("/jobs", status_code=202)
+async def create_job(request: AnalysisRequest):
+    """Queue an analysis job and return its id immediately"""
+    job = await submit_analysis(request)
+    return job.to_dict()
 
-        # Run analysis
-        result = await analysis_service.run_analysis(
-            start=start_dt,
-            end=end_dt,
-            methods=request.methods or ['zscore', 'iqr', 'isolation_forest']
-        )
 
-        # Generate trend suggestions if anomalies were found
-        if result['anomalies_detected'] > 0:
-            suggestions = await llm_client.generate_trend_suggestions(
-                anomalies=result['anomaly_details'],
-                start=start_dt,
-                end=end_dt
-            )
-            result['suggestions'] = suggestions
+@app.get("/jobs")
+async def list_jobs():
+    """Job counts per status, coalesced and rejected submissions, and the result cache"""
+    return {**job_manager.stats(), 'result_cache': result_cache.stats()}
 
-        return result
 
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0):
+    """Job status and result; ``wait`` blocks up to that many seconds for completion"""
+    try:
+        job = await job_manager.wait(job_id, timeout=wait) if wait > 0 else job_manager.get(job_id)
+    except JobNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    return job.to_dict()
+
+
+# Largest page GET /anomalies returns
+MAX_ANOMALY_PAGE_SIZE = 1000
+
+
+def encode_cursor(anomaly: dict) -> str:
+    """Opaque cursor pointing just past an anomaly in (detected_at, id) order"""
+    key = json.dumps([anomaly['detected_at'].isoformat(), anomaly['id']])
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        detected_at, anomaly_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(detected_at), int(anomaly_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail='Invalid cursor')
+
+
+def validate_period(start: Optional[str], end: Optional[str]):
+    try:
+        for value in (start, end):
+            if value:
+                datetime.fromisoformat(value)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/anomalies")
+async def list_anomalies(
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    anomaly_type: Optional[str] = None,
+    limit: int = 100,
+    cursor: Optional[str] = None
+):
+    """Stored anomalies detected in [start, end], oldest first, one page at a time
+
+    Pages are keyed on (detected_at, id): pass ``next_cursor`` back as
+    ``cursor`` for the next page; it is null on the last one.
+    """
+    validate_period(start, end)
+    if not 1 <= limit <= MAX_ANOMALY_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f'limit must be between 1 and {MAX_ANOMALY_PAGE_SIZE}')
+    after = decode_cursor(cursor) if cursor else None
+
+    # One extra row tells whether another page follows
+    rows = await asyncio.to_thread(db.fetch_anomalies, start, end, anomaly_type, after, limit + 1)
+    anomalies = rows[:limit]
+
+    return {
+        'anomalies': anomalies,
+        'next_cursor': encode_cursor(anomalies[-1]) if len(rows) > limit else None
+    }
+
+
+@app.get("/anomalies/stream")
+async def stream_anomalies(start: Optional[str] = None, end: Optional[str] = None, anomaly_type: Optional[str] = None):
+    """Every stored anomaly detected in [start, end] as NDJSON (one JSON object per line), oldest first
+
+    Rows are read through a server-side cursor and written chunk by chunk,
+    so neither side holds the whole result.
+    """
+    validate_period(start, end)
+
+    def lines():
+        for rows in db.iter_anomalies(start, end, anomaly_type):
+            yield ''.join(json.dumps(row, default=datetime.isoformat) + '\n' for row in rows)
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Cancel a queued job"""
+    try:
+        job = job_manager.cancel(job_id)
+    except JobNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except JobStateError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    return job.to_dict()
 
 
 if __name__ == "__main__":
@@ -2,214 +2,861 @@ import pandas as pd
 import numpy as np
 from sklearn.ensemble import IsolationForest
 from sklearn.neighbors import LocalOutlierFactor
-from datetime import datetime
-from typing import Optional, List, Dict, Any
+import os
+from datetime import datetime, timezone
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, List, Dict, Any, Callable, Tuple
 
-from services.db import Database
+from services.anomalies import AnomalyBatch
+from services.baselines import BaselineStore
+from services.db import Database, frame_bytes_per_row
+from services.metrics import collect_timings, profiled, timed
+from services.models import ModelRegistry
+from services.quantiles import QuantileStore
+from services.stats import RunningStats
 
+METRICS = ['vehicle_count', 'avg_speed', 'traffic_density_score']
+
+# Methods that can score a window chunk by chunk
+STREAMING_METHODS = ['zscore', 'iqr', 'baseline']
+
+# Name of the watermark / running statistics used by incremental runs
+INCREMENTAL_STATE = 'analysis'
+
+# Ways run_analysis can split a window across worker processes
+PARTITION_MODES = ['location', 'time']
+
+# How much of the detected anomalies a result carries: every anomaly, or
+# counts per method and the most confident few (see AnomalyBatch.summary)
+DETAIL_MODES = ['full', 'summary']
+
+# traffic_events columns each detector and partition mode reads, besides id and METRICS
+METHOD_COLUMNS = {
+    'zscore': [],
+    'iqr': ['location_id'],
+    'isolation_forest': ['location_id'],
+    'lof': ['location_id'],
+    'baseline': ['location_id', 'timestamp']
+}
+PARTITION_COLUMNS = {'location': ['location_id'], 'time': ['timestamp']}
+
+# Detector working memory per row and metric on top of the loaded frame
+# (float64 copies of the metrics, feature matrices, scores and masks;
+# measured at 12-33 bytes for zscore, iqr and isolation_forest)
+WORKING_BYTES_PER_ROW_METRIC = 48
+
+
+class MemoryBudgetError(Exception):
+    """Raised when a window will not fit ANALYSIS_MEMORY_BUDGET_MB and cannot be chunked"""
+
+
+_worker_service: Optional['AnalysisService'] = None
+
+
+def _get_worker_service() -> 'AnalysisService':
+    """One AnalysisService (and with it one connection pool) per worker process"""
+    global _worker_service
+
+    if _worker_service is None:
+        _worker_service = AnalysisService()
+
+    return _worker_service
+
+
+def run_analysis_job(params: Dict[str, Any]) -> Dict[str, Any]:
+    """Entry point for JobManager workers
+
+    The per-stage timings of the run are returned in ``result['timings']``
+    (or attached to the raised exception as ``timings``) for the parent
+    process to record, together with the background model refits that
+    finished since the previous run. ``params['profile']`` optionally names a profiler
+    (see metrics.profiled) whose report is returned in ``result['profile']``;
+    ``params['timings']`` is for the API and ignored here.
+    """
+    params = dict(params)
+    profile = params.pop('profile', None)
+    params.pop('timings', None)
+
+    service = _get_worker_service()
+
+    with collect_timings() as timings, profiled(profile) as report:
+        service.models.report_refits(timings)
+        try:
+            result = service.run_analysis(**params)
+        except Exception as e:
+            e.timings = timings.to_dict()
+            raise
+
+    result['timings'] = timings.to_dict()
+    if profile:
+        result['profile'] = report
+    return result
 
-class AnalysisService:
-    def __init__(self):
-        self.db = Database()
 
-    async def run_analysis(
+def detect_partition(
+    df: pd.DataFrame,
+    methods: List[str],
+    stats: Dict[str, RunningStats]
+) -> AnomalyBatch:
+    """Entry point for partition workers (see AnalysisService._detect_partitioned)"""
+    return _get_worker_service()._detect(df, methods, stats=stats)
+
+
+class AnalysisService:
+    def __init__(self, db: Optional[Database] = None):
+        self.db = db or Database()
+        self.baselines = BaselineStore(self.db)
+        self.quantiles = QuantileStore(self.db)
+        self.models = ModelRegistry()
+        self.baseline_threshold = float(os.getenv('BASELINE_ZSCORE_THRESHOLD', '3.0'))
+        self.incremental_batch_size = int(os.getenv('ANALYSIS_INCREMENTAL_BATCH_SIZE', '1000000'))
+        self.stream_chunk_size = int(os.getenv('ANALYSIS_STREAM_CHUNK_SIZE', '50000'))
+        self.partition_workers = int(os.getenv('ANALYSIS_PARTITION_WORKERS', str(os.cpu_count() or 1)))
+        self.sklearn_n_jobs = int(os.getenv('ANALYSIS_SKLEARN_N_JOBS', '1'))
+        self.lof_n_neighbors = int(os.getenv('LOF_N_NEIGHBORS', '20'))
+        self.lof_reference_size = int(os.getenv('LOF_REFERENCE_SIZE', '20000'))
+        self.lof_algorithm = os.getenv('LOF_ALGORITHM', 'kd_tree')
+        self.lof_leaf_size = int(os.getenv('LOF_LEAF_SIZE', '40'))
+        self.lof_memory_mb = float(os.getenv('LOF_SCORE_MEMORY_MB', '256'))
+        self.memory_budget_mb = float(os.getenv('ANALYSIS_MEMORY_BUDGET_MB', '0'))
+        self._partition_executor: Optional[ProcessPoolExecutor] = None
+
+    def run_analysis(
         self,
         start: Optional[datetime] = None,
         end: Optional[datetime] = None,
-        methods: List[str] = None
+        methods: List[str] = None,
+        incremental: bool = False,
+        streaming: bool = False,
+        partition_by: Optional[str] = None,
+        details: str = 'full'
     ) -> Dict[str, Any]:
-        """Run anomaly detection analysis"""
+        """Run anomaly detection analysis
+
+        In incremental mode only events past the stored watermark are read,
+        up to the settled id (see Database.fetch_settled_event_id) so that
+        an event committed late is not skipped.
+        Z-scores are computed against running statistics that cover every
+        event processed so far; the other methods score the new batch.
+
+        IQR bounds always come from the per-location sketches in
+        QuantileStore and baselines from BaselineStore; both are brought up
+        to date (a bounded number of chunks per run) before detection.
+
+        In streaming mode the window is never materialized; see
+        _run_streaming. With ``partition_by`` detection is spread over a
+        process pool; see _detect_partitioned.
+
+        Only the columns the methods need are loaded (see METHOD_COLUMNS).
+        With ANALYSIS_MEMORY_BUDGET_MB set, windows that would not fit are
+        chunked or refused; see _plan_memory.
+
+        The result always carries ``anomaly_summary``; with ``details`` set
+        to 'summary' the per-anomaly ``anomaly_details`` list is left out,
+        which keeps wide windows from producing huge results.
+        """
+
+        if incremental and streaming:
+            raise ValueError('incremental and streaming modes cannot be combined')
+        if partition_by is not None and partition_by not in PARTITION_MODES:
+            raise ValueError(f'partition_by must be one of: {", ".join(PARTITION_MODES)}')
+        if partition_by is not None and streaming:
+            raise ValueError('partitioned and streaming modes cannot be combined')
+        if details not in DETAIL_MODES:
+            raise ValueError(f'details must be one of: {", ".join(DETAIL_MODES)}')
+
+        methods = methods or ['zscore', 'iqr', 'isolation_forest']
 
         # Fetch data
         start_str = start.isoformat() if start else None
         end_str = end.isoformat() if end else None
-        df = self.db.fetch_traffic_events(start_str, end_str)
+        watermark = None
+        settled = None
+
+        if streaming:
+            return self._run_streaming(start_str, end_str, methods, details)
+
+        columns = self._columns(methods, partition_by)
+        if (start is None or end is None) and 'timestamp' not in columns:
+            # Open-ended runs report the span of the events they analyzed
+            columns.insert(0, 'timestamp')
+        limit = None
+        memory = None
+
+        if incremental:
+            watermark = self.db.get_watermark(INCREMENTAL_STATE)
+            settled = self.db.fetch_settled_event_id()
+            limit = self.incremental_batch_size
+
+        if self.memory_budget_mb > 0:
+            memory = self._plan_memory(start_str, end_str, methods, columns, partition_by, watermark, limit, settled)
+            if memory['action'] == 'streaming':
+                result = self._run_streaming(start_str, end_str, methods, details)
+                result['memory_budget'] = memory
+                return result
+            limit = memory.get('limit', limit)
+
+        df = self.db.fetch_traffic_events(
+            start_str, end_str,
+            after_id=watermark,
+            limit=limit,
+            columns=columns,
+            chunk_size=self.stream_chunk_size,
+            until_id=settled
+        )
 
         if df.empty:
-            return {
+            result = {
                 'success': True,
                 'anomalies_detected': 0,
                 'message': 'No traffic events found in the specified period'
             }
+            if incremental:
+                result['watermark'] = {'previous': watermark, 'current': watermark}
+            return result
 
         # Detect anomalies using specified methods
-        anomalies = []
-        methods = methods or ['zscore', 'iqr', 'isolation_forest']
-
-        if 'zscore' in methods:
-            anomalies.extend(self._detect_zscore(df))
+        stats = None
+        quantiles = None
+        baselines = None
 
         if 'iqr' in methods:
-            anomalies.extend(self._detect_iqr(df))
-
-        if 'isolation_forest' in methods:
-            anomalies.extend(self._detect_isolation_forest(df))
-
-        if 'lof' in methods:
-            anomalies.extend(self._detect_lof(df))
-
-        # Remove duplicates (same event detected by multiple methods)
-        unique_anomalies = self._deduplicate_anomalies(anomalies)
+            with timed('quantiles.refresh'):
+                quantiles = self.quantiles.refresh(METRICS, self.stream_chunk_size)
+
+        if 'baseline' in methods:
+            with timed('baselines.refresh'):
+                baselines = self.baselines.refresh(METRICS, self.stream_chunk_size)
+
+        if incremental:
+            stats = self.db.fetch_metric_stats(INCREMENTAL_STATE)
+            for metric in METRICS:
+                if metric in df.columns:
+                    stats.setdefault(metric, RunningStats()).update(df[metric].to_numpy(dtype=np.float64))
+
+        if partition_by is not None:
+            with timed('detect.partitioned') as stage:
+                stage.rows = len(df)
+                unique_anomalies = self._detect_partitioned(df, methods, partition_by, stats)
+        else:
+            unique_anomalies = self._detect(df, methods, stats=stats)
 
         # Store anomalies in database
-        if unique_anomalies:
+        if incremental:
+            last_event_id = int(df['id'].max())
+            self.db.commit_incremental_run(
+                INCREMENTAL_STATE, watermark, last_event_id, stats, unique_anomalies
+            )
+        elif len(unique_anomalies):
             self.db.insert_anomalies(unique_anomalies)
 
-        return {
+        result = {
             'success': True,
-            'anomalies_detected': len(unique_anomalies),
-            'anomaly_details': unique_anomalies,
-            'period': {
-                'start': start_str,
-                'end': end_str
-            },
+            **self._anomaly_result(unique_anomalies, details),
+            'period': self._period(
+                start_str, end_str,
+                (df['timestamp'].min(), df['timestamp'].max()) if 'timestamp' in df.columns else None
+            ),
             'methods_used': methods
         }
 
-    def _detect_zscore(self, df: pd.DataFrame, threshold: float = 3.0) -> List[Dict[str, Any]]:
-        """Detect anomalies using Z-score method"""
-        anomalies = []
-
-        for metric in ['vehicle_count', 'avg_speed', 'traffic_density_score']:
-            if metric not in df.columns or df[metric].isna().all():
-                continue
+        if incremental:
+            result['watermark'] = {'previous': watermark, 'current': last_event_id}
 
-            # Calculate z-scores
-            mean = df[metric].mean()
-            std = df[metric].std()
+        if memory is not None:
+            result['memory_budget'] = memory
 
-            if std == 0:
-                continue
+        if quantiles is not None:
+            result['quantiles'] = quantiles
 
-            z_scores = np.abs((df[metric] - mean) / std)
+        if baselines is not None:
+            result['baselines'] = baselines
 
-            # Find anomalies
-            anomaly_indices = z_scores > threshold
+        return result
 
-            for idx in df[anomaly_indices].index:
-                anomalies.append({
-                    'traffic_event_id': int(df.loc[idx, 'id']),
-                    'anomaly_type': 'zscore',
-                    'confidence_score': min(float(z_scores[idx]) / threshold, 1.0),
-                    'affected_metrics': [metric],
-                    'description': f'{metric} value {df.loc[idx, metric]} is {z_scores[idx]:.2f} standard deviations from mean'
-                })
+    def _anomaly_result(self, anomalies: AnomalyBatch, details: str) -> Dict[str, Any]:
+        """Anomaly count, summary and (with details='full') every anomaly, for the result"""
+        with timed('serialize') as stage:
+            result = {
+                'anomalies_detected': len(anomalies),
+                'anomaly_summary': anomalies.summary()
+            }
+            if details == 'full':
+                stage.rows = len(anomalies)
+                result['anomaly_details'] = anomalies.to_records()
+        return result
 
-        return anomalies
+    def _period(
+        self,
+        start_str: Optional[str],
+        end_str: Optional[str],
+        span: Optional[Tuple[float, float]]
+    ) -> Dict[str, Any]:
+        """The requested window plus, when ``span`` (epoch seconds) is known, the first and last event analyzed"""
+        period = {'start': start_str, 'end': end_str}
+        if span is not None:
+            period['first_event_at'] = datetime.fromtimestamp(float(span[0]), timezone.utc).isoformat()
+            period['last_event_at'] = datetime.fromtimestamp(float(span[1]), timezone.utc).isoformat()
+        return period
+
+    def _columns(self, methods: List[str], partition_by: Optional[str]) -> List[str]:
+        """traffic_events columns to load for these methods (id is always loaded)"""
+        columns = [column for method in methods for column in METHOD_COLUMNS.get(method, [])]
+        columns += PARTITION_COLUMNS.get(partition_by, [])
+        return list(dict.fromkeys(columns)) + METRICS
+
+    def _plan_memory(
+        self,
+        start_str: Optional[str],
+        end_str: Optional[str],
+        methods: List[str],
+        columns: List[str],
+        partition_by: Optional[str],
+        after_id: Optional[int],
+        limit: Optional[int],
+        until_id: Optional[int] = None
+    ) -> Dict[str, Any]:
+        """Check a window against ANALYSIS_MEMORY_BUDGET_MB before loading it
+
+        The estimate is the window's row count times the bytes per row of
+        the compact frame plus detector working memory (partitioned runs
+        also hold the partitions, and LOF scoring adds up to
+        LOF_SCORE_MEMORY_MB). A window over budget is cut to the rows
+        that fit for incremental runs, which carry on from the watermark
+        next time; scored chunk by chunk in streaming mode when every method
+        supports it; and otherwise refused with MemoryBudgetError.
+        """
+        frame_bytes = frame_bytes_per_row(['id'] + columns)
+        bytes_per_row = frame_bytes + WORKING_BYTES_PER_ROW_METRIC * len(METRICS)
+        if partition_by is not None:
+            bytes_per_row += frame_bytes
+
+        fixed_bytes = self.lof_memory_mb * 2 ** 20 if 'lof' in methods else 0
+
+        rows = self.db.count_traffic_events(start_str, end_str, after_id, limit, until_id)
+        budget_bytes = self.memory_budget_mb * 2 ** 20
+        estimated_bytes = rows * bytes_per_row + fixed_bytes
+        plan = {
+            'budget_mb': self.memory_budget_mb,
+            'estimated_mb': round(estimated_bytes / 2 ** 20, 1),
+            'rows': rows,
+            'action': 'in_memory'
+        }
 
-    def _detect_iqr(self, df: pd.DataFrame) -> List[Dict[str, Any]]:
-        """Detect anomalies using Interquartile Range (IQR) method"""
-        anomalies = []
+        if estimated_bytes <= budget_bytes:
+            return plan
 
-        for metric in ['vehicle_count', 'avg_speed', 'traffic_density_score']:
-            if metric not in df.columns or df[metric].isna().all():
-                continue
+        if after_id is not None and budget_bytes > fixed_bytes:
+            plan['limit'] = max(1, int((budget_bytes - fixed_bytes) // bytes_per_row))
+            plan['action'] = 'chunked'
+        elif partition_by is None and all(method in STREAMING_METHODS for method in methods):
+            plan['action'] = 'streaming'
+        else:
+            raise MemoryBudgetError(
+                f'The window has {rows} events and needs about {plan["estimated_mb"]} MB, over the '
+                f'{self.memory_budget_mb:g} MB budget; narrow the window, run it incrementally or use '
+                f'streaming-capable methods only ({", ".join(STREAMING_METHODS)})'
+            )
 
-            Q1 = df[metric].quantile(0.25)
-            Q3 = df[metric].quantile(0.75)
-            IQR = Q3 - Q1
+        return plan
 
-            lower_bound = Q1 - 1.5 * IQR
-            upper_bound = Q3 + 1.5 * IQR
+    def _detect(
+        self,
+        df: pd.DataFrame,
+        methods: List[str],
+        stats: Optional[Dict[str, RunningStats]] = None
+    ) -> AnomalyBatch:
+        """Run the selected detectors over a DataFrame and deduplicate"""
+        detectors = {
+            'zscore': lambda: self._detect_zscore(df, stats=stats),
+            'iqr': lambda: self._detect_iqr(df),
+            'isolation_forest': lambda: self._detect_isolation_forest(df),
+            'lof': lambda: self._detect_lof(df),
+            'baseline': lambda: self._detect_baseline(df)
+        }
 
-            # Find anomalies
-            anomaly_indices = (df[metric] < lower_bound) | (df[metric] > upper_bound)
+        batches = []
+        for method, detect in detectors.items():
+            if method in methods:
+                with timed(f'detect.{method}') as stage:
+                    stage.rows = len(df)
+                    batches.append(detect())
 
-            for idx in df[anomaly_indices].index:
-                value = df.loc[idx, metric]
-                distance = max(abs(value - lower_bound), abs(value - upper_bound))
-                confidence = min(distance / (IQR * 1.5), 1.0) if IQR > 0 else 0.5
+        # Remove duplicates (same event detected by multiple methods)
+        with timed('dedupe') as stage:
+            stage.rows = sum(len(batch) for batch in batches)
+            return self._deduplicate_anomalies(batches)
 
-                anomalies.append({
-                    'traffic_event_id': int(df.loc[idx, 'id']),
-                    'anomaly_type': 'iqr',
-                    'confidence_score': float(confidence),
-                    'affected_metrics': [metric],
-                    'description': f'{metric} value {value} is outside IQR bounds [{lower_bound:.2f}, {upper_bound:.2f}]'
-                })
+    def _detect_partitioned(
+        self,
+        df: pd.DataFrame,
+        methods: List[str],
+        partition_by: str,
+        stats: Optional[Dict[str, RunningStats]] = None
+    ) -> AnomalyBatch:
+        """Run _detect on partitions of the window in a process pool
+
+        Window-wide z-score statistics are computed here once and shipped
+        to every partition, and the IQR, baseline and model-based detectors
+        already work per location, so partitioning by location gives the
+        same anomalies as a serial run. Partitions hold disjoint events;
+        the merged result is deduplicated, which also orders it by event
+        id.
+        """
+        if stats is None:
+            stats = {}
+            for metric in METRICS:
+                if metric in df.columns:
+                    stats[metric] = RunningStats()
+                    stats[metric].update(df[metric].to_numpy(dtype=np.float64))
+
+        partitions = self._partition(df, partition_by)
+
+        if len(partitions) <= 1 or self.partition_workers <= 1:
+            batches = [self._detect(part, methods, stats) for part in partitions]
+        else:
+            executor = self._get_partition_executor()
+            futures = [
+                executor.submit(detect_partition, part, methods, stats)
+                for part in partitions
+            ]
+            batches = [future.result() for future in futures]
+
+        return AnomalyBatch.concat(batches).deduplicate()
+
+    def _partition(self, df: pd.DataFrame, partition_by: str) -> List[pd.DataFrame]:
+        """Split the window into roughly equal partitions (a few per worker)"""
+        target = max(1, self.partition_workers * 4)
+
+        if partition_by == 'time':
+            order = np.argsort(df['timestamp'].to_numpy(), kind='stable')
+            return [df.iloc[rows] for rows in np.array_split(order, min(target, len(df))) if len(rows)]
+
+        # Whole locations only; greedily pack the largest into the emptiest bin
+        sizes = df.groupby('location_id', observed=True).size().sort_values(ascending=False)
+        bins: List[List[Any]] = [[] for _ in range(min(target, len(sizes)))]
+        loads = np.zeros(len(bins))
+
+        for location_id, size in sizes.items():
+            i = int(np.argmin(loads))
+            bins[i].append(location_id)
+            loads[i] += size
+
+        locations = df['location_id'].to_numpy()
+        return [df[np.isin(locations, location_ids)] for location_ids in bins if location_ids]
+
+    def _get_partition_executor(self) -> ProcessPoolExecutor:
+        if self._partition_executor is None:
+            self._partition_executor = ProcessPoolExecutor(
+                max_workers=self.partition_workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return self._partition_executor
+
+    def _run_streaming(
+        self,
+        start_str: Optional[str],
+        end_str: Optional[str],
+        methods: List[str],
+        details: str = 'full'
+    ) -> Dict[str, Any]:
+        """Run chunk-wise detectors over a server-side cursor in two passes
+
+        The first pass (only needed for z-scores) accumulates running
+        mean/variance per metric, the second pass re-reads the window and
+        scores each chunk. IQR bounds come from the per-location sketches,
+        so they need no pass over the window. Memory is bounded by the
+        chunk size and the number of anomalies found.
+        """
+        unsupported = [m for m in methods if m not in STREAMING_METHODS]
+        if unsupported:
+            raise ValueError(
+                f'Methods {", ".join(unsupported)} need the full window and cannot run in streaming mode'
+            )
+
+        # Pass 1: statistics
+        stats = {metric: RunningStats() for metric in METRICS}
+        quantiles = None
 
-        return anomalies
+        if 'zscore' in methods:
+            for chunk in self.db.iter_traffic_events(METRICS, start_str, end_str, self.stream_chunk_size):
+                with timed('stream.statistics') as stage:
+                    stage.rows = len(chunk['id'])
+                    for metric in METRICS:
+                        stats[metric].update(chunk[metric])
 
-    def _detect_isolation_forest(self, df: pd.DataFrame) -> List[Dict[str, Any]]:
-        """Detect anomalies using Isolation Forest"""
-        anomalies = []
+        baselines = None
 
-        # Select numeric features
-        features = ['vehicle_count', 'avg_speed', 'traffic_density_score']
-        feature_cols = [col for col in features if col in df.columns and not df[col].isna().all()]
+        if 'iqr' in methods:
+            with timed('quantiles.refresh'):
+                quantiles = self.quantiles.refresh(METRICS, self.stream_chunk_size)
+            self.quantiles.ensure_current()
+
+        if 'baseline' in methods:
+            with timed('baselines.refresh'):
+                baselines = self.baselines.refresh(METRICS, self.stream_chunk_size)
+
+        # Pass 2: scoring (an event lives in exactly one chunk, so deduplicating
+        # per chunk is exact)
+        batches = []
+        events_processed = 0
+        first_event, last_event = np.inf, -np.inf
+
+        for chunk in self.db.iter_traffic_events(METRICS, start_str, end_str, self.stream_chunk_size):
+            events_processed += len(chunk['id'])
+            first_event = min(first_event, chunk['timestamp'].min())
+            last_event = max(last_event, chunk['timestamp'].max())
+            chunk_batches = []
+
+            with timed('stream.detect') as stage:
+                stage.rows = len(chunk['id'])
+                if 'baseline' in methods:
+                    keys = self.baselines.keys(chunk['location_id'], chunk['timestamp'])
+                    self.baselines.ensure_current()
+
+                for metric in METRICS:
+                    if 'zscore' in methods and stats[metric].count:
+                        chunk_batches.append(self._zscore_batch(
+                            chunk['id'], chunk[metric], metric,
+                            stats[metric].mean, stats[metric].std
+                        ))
+                    if 'iqr' in methods:
+                        chunk_batches.append(self._iqr_batch(
+                            chunk['id'], chunk[metric], metric,
+                            *self.quantiles.quartiles(metric, chunk['location_id'])
+                        ))
+                    if 'baseline' in methods:
+                        chunk_batches.append(self._baseline_batch(
+                            chunk['id'], keys, chunk[metric], metric
+                        ))
+
+            with timed('dedupe') as stage:
+                stage.rows = sum(len(batch) for batch in chunk_batches)
+                batches.append(self._deduplicate_anomalies(chunk_batches))
+
+        if events_processed == 0:
+            return {
+                'success': True,
+                'anomalies_detected': 0,
+                'message': 'No traffic events found in the specified period'
+            }
 
-        if not feature_cols:
-            return anomalies
+        unique_anomalies = AnomalyBatch.concat(batches)
 
-        # Prepare data
-        X = df[feature_cols].fillna(df[feature_cols].mean())
+        if len(unique_anomalies):
+            self.db.insert_anomalies(unique_anomalies)
 
-        if len(X) < 10:  # Need minimum samples
-            return anomalies
+        result = {
+            'success': True,
+            **self._anomaly_result(unique_anomalies, details),
+            'events_processed': events_processed,
+            'period': self._period(start_str, end_str, (first_event, last_event)),
+            'methods_used': methods
+        }
 
-        # Train Isolation Forest
-        clf = IsolationForest(contamination=0.1, random_state=42)
-        predictions = clf.fit_predict(X)
-        scores = clf.score_samples(X)
+        if quantiles is not None:
+            result['quantiles'] = quantiles
 
-        # Find anomalies (prediction == -1)
-        anomaly_indices = predictions == -1
+        if baselines is not None:
+            result['baselines'] = baselines
 
-        for idx in df[anomaly_indices].index:
-            anomalies.append({
-                'traffic_event_id': int(df.loc[idx, 'id']),
-                'anomaly_type': 'isolation_forest',
-                'confidence_score': float(1.0 - (scores[idx] + 0.5)),  # Normalize score
-                'affected_metrics': feature_cols,
-                'description': f'Anomaly detected using Isolation Forest on features: {", ".join(feature_cols)}'
-            })
+        return result
 
-        return anomalies
+    def _detect_zscore(
+        self,
+        df: pd.DataFrame,
+        threshold: float = 3.0,
+        stats: Optional[Dict[str, RunningStats]] = None
+    ) -> AnomalyBatch:
+        """Detect anomalies using Z-score method
+
+        ``stats`` supplies precomputed running statistics per metric; without
+        it mean and std are taken from the DataFrame itself.
+        """
+        batches = []
+        event_ids = df['id'].to_numpy()
+
+        for metric in METRICS:
+            if metric not in df.columns or df[metric].isna().all():
+                continue
 
-    def _detect_lof(self, df: pd.DataFrame) -> List[Dict[str, Any]]:
-        """Detect anomalies using Local Outlier Factor"""
-        anomalies = []
+            # Calculate z-scores (in float64, whatever the column's dtype)
+            values = df[metric].to_numpy(dtype=np.float64)
+            if stats is not None and metric in stats:
+                mean = stats[metric].mean
+                std = stats[metric].std
+            else:
+                mean = np.nanmean(values)
+                std = np.nanstd(values, ddof=1)
 
-        # Select numeric features
-        features = ['vehicle_count', 'avg_speed', 'traffic_density_score']
-        feature_cols = [col for col in features if col in df.columns and not df[col].isna().all()]
+            batches.append(self._zscore_batch(event_ids, values, metric, mean, std, threshold))
 
-        if not feature_cols:
-            return anomalies
+        return AnomalyBatch.concat(batches)
 
-        # Prepare data
-        X = df[feature_cols].fillna(df[feature_cols].mean())
+    def _zscore_batch(
+        self,
+        event_ids: np.ndarray,
+        values: np.ndarray,
+        metric: str,
+        mean: float,
+        std: float,
+        threshold: float = 3.0
+    ) -> AnomalyBatch:
+        """Flag values more than ``threshold`` standard deviations from mean"""
+        if std == 0 or np.isnan(std):
+            return AnomalyBatch.empty()
+
+        z_scores = np.abs((values - mean) / std)
+
+        # Find anomalies (NaN z-scores compare False)
+        anomaly_mask = z_scores > threshold
+
+        return AnomalyBatch.from_mask(
+            event_ids, anomaly_mask, 'zscore',
+            np.minimum(z_scores / threshold, 1.0), metric,
+            values=values, scores=z_scores
+        )
+
+    def _detect_iqr(self, df: pd.DataFrame) -> AnomalyBatch:
+        """Detect anomalies using Interquartile Range (IQR) method
+
+        Q1 and Q3 come from each location's stored quantile sketch, so no
+        column has to be sorted. Locations with fewer than IQR_MIN_COUNT
+        sketched values are not scored.
+        """
+        batches = []
+        event_ids = df['id'].to_numpy()
+        location_ids = df['location_id'].to_numpy()
+        self.quantiles.ensure_current()
+
+        for metric in METRICS:
+            if metric not in df.columns or df[metric].isna().all():
+                continue
 
-        if len(X) < 10:  # Need minimum samples
-            return anomalies
+            batches.append(self._iqr_batch(
+                event_ids, df[metric].to_numpy(dtype=np.float64), metric,
+                *self.quantiles.quartiles(metric, location_ids)
+            ))
 
-        # Train LOF
-        clf = LocalOutlierFactor(n_neighbors=20, contamination=0.1)
-        predictions = clf.fit_predict(X)
-        scores = clf.negative_outlier_factor_
+        return AnomalyBatch.concat(batches)
 
-        # Find anomalies (prediction == -1)
-        anomaly_indices = predictions == -1
+    def _iqr_batch(
+        self,
+        event_ids: np.ndarray,
+        values: np.ndarray,
+        metric: str,
+        Q1: np.ndarray,
+        Q3: np.ndarray
+    ) -> AnomalyBatch:
+        """Flag values outside the 1.5 * IQR fences around [Q1, Q3]
+
+        Q1 and Q3 are scalars or arrays aligned with ``values`` (NaN bounds
+        never flag).
+        """
+        IQR = Q3 - Q1
+
+        lower_bound = Q1 - 1.5 * IQR
+        upper_bound = Q3 + 1.5 * IQR
+
+        # Find anomalies
+        anomaly_mask = (values < lower_bound) | (values > upper_bound)
+
+        distance = np.maximum(np.abs(values - lower_bound), np.abs(values - upper_bound))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            confidence = np.where(IQR > 0, np.minimum(distance / (IQR * 1.5), 1.0), 0.5)
+
+        return AnomalyBatch.from_mask(
+            event_ids, anomaly_mask, 'iqr', confidence, metric,
+            values=values, lower=lower_bound, upper=upper_bound
+        )
+
+    def _detect_baseline(self, df: pd.DataFrame) -> AnomalyBatch:
+        """Detect anomalies against per-location, hour-of-week baselines"""
+        batches = []
+        event_ids = df['id'].to_numpy()
+        keys = self.baselines.keys(df['location_id'].to_numpy(), df['timestamp'])
+        self.baselines.ensure_current()
+
+        for metric in METRICS:
+            if metric not in df.columns:
+                continue
 
-        for idx in df[anomaly_indices].index:
-            anomalies.append({
-                'traffic_event_id': int(df.loc[idx, 'id']),
-                'anomaly_type': 'lof',
-                'confidence_score': float(min(abs(scores[idx]), 1.0)),
-                'affected_metrics': feature_cols,
-                'description': f'Local outlier detected on features: {", ".join(feature_cols)}'
-            })
+            batches.append(self._baseline_batch(
+                event_ids, keys, df[metric].to_numpy(dtype=np.float64), metric
+            ))
 
-        return anomalies
+        return AnomalyBatch.concat(batches)
 
-    def _deduplicate_anomalies(self, anomalies: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """Remove duplicate anomalies for the same traffic event"""
-        seen = {}
+    def _baseline_batch(
+        self,
+        event_ids: np.ndarray,
+        keys: np.ndarray,
+        values: np.ndarray,
+        metric: str
+    ) -> AnomalyBatch:
+        """Flag values outside both the IQR fences and the z-score threshold of their baseline
+
+        Events whose baseline has fewer than BASELINE_MIN_COUNT samples are
+        not scored.
+        """
+        baseline = self.baselines.lookup(metric, keys)
+        count = baseline['count'].to_numpy(dtype=np.float64)
+        mean = baseline['mean'].to_numpy(dtype=np.float64)
+        std = baseline['std'].to_numpy(dtype=np.float64)
+        q1 = baseline['q1'].to_numpy(dtype=np.float64)
+        q3 = baseline['q3'].to_numpy(dtype=np.float64)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z_scores = np.where(std > 0, np.abs(values - mean) / std, np.nan)
+
+        iqr = q3 - q1
+        lower_bound = q1 - 1.5 * iqr
+        upper_bound = q3 + 1.5 * iqr
+
+        anomaly_mask = (
+            (count >= self.baselines.min_count)
+            & (z_scores > self.baseline_threshold)
+            & ((values < lower_bound) | (values > upper_bound))
+        )
+
+        return AnomalyBatch.from_mask(
+            event_ids, anomaly_mask, 'baseline',
+            np.minimum(z_scores / self.baseline_threshold, 1.0), metric,
+            values=values, scores=z_scores, lower=lower_bound, upper=upper_bound
+        )
+
+    def _detect_isolation_forest(self, df: pd.DataFrame) -> AnomalyBatch:
+        """Detect anomalies using Isolation Forest models cached per location"""
+        return self._detect_with_models(
+            df, 'isolation_forest', self._fit_isolation_forest,
+            lambda scores: 1.0 - (scores + 0.5)  # Normalize score
+        )
+
+    def _detect_lof(self, df: pd.DataFrame) -> AnomalyBatch:
+        """Detect anomalies using Local Outlier Factor models cached per location
+
+        Models are fitted on at most LOF_REFERENCE_SIZE rows per location
+        with a tree-based neighbor index; every other row is scored against
+        that reference set in batches, so cost grows linearly with the window.
+        """
+        return self._detect_with_models(
+            df, 'lof', self._fit_lof,
+            lambda scores: np.minimum(np.abs(scores), 1.0)
+        )
+
+    def _fit_isolation_forest(self, X: np.ndarray) -> IsolationForest:
+        return IsolationForest(contamination=0.1, random_state=42, n_jobs=self.sklearn_n_jobs).fit(X)
+
+    def _fit_lof(self, X: np.ndarray) -> LocalOutlierFactor:
+        # novelty=True so the cached model can score new events
+        reference = self._lof_reference(len(X))
+        return LocalOutlierFactor(
+            n_neighbors=self.lof_n_neighbors, contamination=0.1, novelty=True,
+            algorithm=self.lof_algorithm, leaf_size=self.lof_leaf_size, n_jobs=self.sklearn_n_jobs
+        ).fit(X if reference is None else X[reference])
+
+    def _lof_reference(self, n: int) -> Optional[np.ndarray]:
+        """Sorted row indices LOF is fitted on, or None to fit on all ``n`` rows
+
+        The sample is seeded, so fitting and scoring agree on which rows
+        were part of the reference set.
+        """
+        if n <= self.lof_reference_size:
+            return None
+
+        rng = np.random.default_rng(42)
+        return np.sort(rng.choice(n, size=self.lof_reference_size, replace=False))
+
+    def _score_samples(self, model: Any, X: np.ndarray) -> np.ndarray:
+        """score_samples() in batches sized to the LOF_SCORE_MEMORY_MB budget"""
+        if not isinstance(model, LocalOutlierFactor):
+            return model.score_samples(X)
+
+        # Neighbor distances and indices, plus reachability temporaries,
+        # take roughly 48 bytes per (row, neighbor)
+        batch_size = max(1, int(self.lof_memory_mb * 2 ** 20 // (48 * model.n_neighbors_)))
+        if len(X) <= batch_size:
+            return model.score_samples(X)
+
+        scores = np.empty(len(X))
+        for start in range(0, len(X), batch_size):
+            scores[start:start + batch_size] = model.score_samples(X[start:start + batch_size])
+        return scores
+
+    def _detect_with_models(
+        self,
+        df: pd.DataFrame,
+        kind: str,
+        fit: Callable[[np.ndarray], Any],
+        confidence: Callable[[np.ndarray], np.ndarray]
+    ) -> AnomalyBatch:
+        """Score each location's events against its cached model
+
+        A location without a cached model is fitted on the window (if it
+        has enough samples) and the model is stored. Otherwise the window
+        is only scored, and a background refit is scheduled when the cached
+        model is stale or the window has drifted away from its training data.
+        """
 
-        for anomaly in anomalies:
-            event_id = anomaly['traffic_event_id']
+        # Select numeric features
+        feature_cols = [col for col in METRICS if col in df.columns and not df[col].isna().all()]
 
-            if event_id not in seen or anomaly['confidence_score'] > seen[event_id]['confidence_score']:
-                seen[event_id] = anomaly
+        if not feature_cols:
+            return AnomalyBatch.empty()
 
-        return list(seen.values())
+        # Prepare data
+        X_all = df[feature_cols].fillna(df[feature_cols].mean()).to_numpy(dtype=np.float64)
+        event_ids = df['id'].to_numpy()
+        locations = df['location_id'].to_numpy()
+        metric = ','.join(feature_cols)
+
+        # Group rows by location with one sort
+        order = np.argsort(locations, kind='stable')
+        unique_locations, starts = np.unique(locations[order], return_index=True)
+        ends = np.append(starts[1:], len(order))
+
+        batches = []
+        for location_id, lo, hi in zip(unique_locations, starts, ends):
+            rows = order[lo:hi]
+            X = X_all[rows]
+            cached = self.models.get(kind, location_id, feature_cols)
+
+            if cached is None:
+                if len(X) < 10:  # Need minimum samples
+                    continue
+
+                model = fit(X)
+                self.models.put(kind, location_id, feature_cols, model, X)
+
+                if kind == 'lof':
+                    # Scores of the training points themselves (as fit_predict);
+                    # rows outside the reference sample are scored as novelties
+                    reference = self._lof_reference(len(X))
+                    if reference is None:
+                        scores = model.negative_outlier_factor_
+                    else:
+                        novel = np.ones(len(X), dtype=bool)
+                        novel[reference] = False
+                        scores = np.empty(len(X))
+                        scores[reference] = model.negative_outlier_factor_
+                        scores[novel] = self._score_samples(model, X[novel])
+                else:
+                    scores = self._score_samples(model, X)
+            else:
+                if len(X) >= 10 and self.models.refit_reason(cached, X):
+                    self.models.schedule_refit(kind, location_id, feature_cols, X.copy(), fit)
+
+                model = cached.model
+                scores = self._score_samples(model, X)
+
+            # Find anomalies (what predict() returns as -1, without scoring twice)
+            batches.append(AnomalyBatch.from_mask(
+                event_ids[rows], scores < model.offset_, kind, confidence(scores), metric
+            ))
+
+        return AnomalyBatch.concat(batches)
+
+    def _deduplicate_anomalies(self, batches: List[AnomalyBatch]) -> AnomalyBatch:
+        """Remove duplicate anomalies for the same traffic event"""
+        return AnomalyBatch.concat(batches).deduplicate()
@@ -0,0 +1,173 @@
+import numpy as np
+from typing import Iterator, List, Dict, Any, Optional, Tuple
+
+
+class AnomalyBatch:
+    """Columnar set of detected anomalies
+
+    Detectors fill NumPy arrays instead of building one dict per flagged
+    row; descriptions and dicts are only produced when the batch is written
+    to the database or returned from the API.
+
+    Columns:
+        event_ids    traffic_events.id of the flagged row
+        types        detection method (zscore, iqr, ...)
+        confidences  confidence score in [0, 1]
+        metrics      affected metric, or comma-joined feature list
+        values       observed metric value (NaN for multivariate methods)
+        scores       z-score for the zscore, baseline and ewma methods, NaN otherwise
+        lower/upper  IQR bounds for the iqr and baseline methods, EWMA band
+                     for ewma, NaN otherwise
+    """
+
+    COLUMNS = ('event_ids', 'types', 'confidences', 'metrics', 'values', 'scores', 'lower', 'upper')
+
+    def __init__(
+        self,
+        event_ids: np.ndarray,
+        types: np.ndarray,
+        confidences: np.ndarray,
+        metrics: np.ndarray,
+        values: Optional[np.ndarray] = None,
+        scores: Optional[np.ndarray] = None,
+        lower: Optional[np.ndarray] = None,
+        upper: Optional[np.ndarray] = None
+    ):
+        n = len(event_ids)
+        nan = np.full(n, np.nan)
+
+        self.event_ids = np.asarray(event_ids, dtype=np.int64)
+        self.types = np.asarray(types, dtype=object)
+        self.confidences = np.asarray(confidences, dtype=np.float64)
+        self.metrics = np.asarray(metrics, dtype=object)
+        self.values = nan if values is None else np.asarray(values, dtype=np.float64)
+        self.scores = nan if scores is None else np.asarray(scores, dtype=np.float64)
+        self.lower = nan if lower is None else np.asarray(lower, dtype=np.float64)
+        self.upper = nan if upper is None else np.asarray(upper, dtype=np.float64)
+
+    @classmethod
+    def empty(cls) -> 'AnomalyBatch':
+        return cls(np.empty(0, dtype=np.int64), np.empty(0, dtype=object),
+                   np.empty(0), np.empty(0, dtype=object))
+
+    @classmethod
+    def from_mask(
+        cls,
+        event_ids: np.ndarray,
+        mask: np.ndarray,
+        anomaly_type: str,
+        confidences: np.ndarray,
+        metric: str,
+        **columns: np.ndarray
+    ) -> 'AnomalyBatch':
+        """Build a batch from the rows selected by a boolean mask
+
+        ``confidences`` and any extra ``columns`` are full-length arrays
+        aligned with ``event_ids``; scalars are broadcast.
+        """
+        ids = event_ids[mask]
+        n = len(ids)
+
+        extra = {}
+        for name, column in columns.items():
+            column = np.asarray(column, dtype=np.float64)
+            extra[name] = column[mask] if column.ndim else np.full(n, float(column))
+
+        return cls(
+            ids,
+            np.full(n, anomaly_type, dtype=object),
+            np.asarray(confidences, dtype=np.float64)[mask],
+            np.full(n, metric, dtype=object),
+            **extra
+        )
+
+    @classmethod
+    def concat(cls, batches: List['AnomalyBatch']) -> 'AnomalyBatch':
+        batches = [b for b in batches if len(b)]
+        if not batches:
+            return cls.empty()
+        if len(batches) == 1:
+            return batches[0]
+
+        return cls(*(np.concatenate([getattr(b, col) for b in batches]) for col in cls.COLUMNS))
+
+    def __len__(self) -> int:
+        return len(self.event_ids)
+
+    def take(self, indices: np.ndarray) -> 'AnomalyBatch':
+        return AnomalyBatch(*(getattr(self, col)[indices] for col in self.COLUMNS))
+
+    def deduplicate(self) -> 'AnomalyBatch':
+        """Keep the highest-confidence anomaly per traffic event
+
+        Ties go to the anomaly that was detected first. The result is
+        ordered by event id.
+        """
+        if len(self) == 0:
+            return self
+
+        order = np.lexsort((np.arange(len(self)), -self.confidences, self.event_ids))
+        sorted_ids = self.event_ids[order]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = sorted_ids[1:] != sorted_ids[:-1]
+
+        return self.take(order[first])
+
+    def type_counts(self) -> Dict[str, int]:
+        """Number of anomalies per detection method"""
+        types, counts = np.unique(self.types.astype(str), return_counts=True)
+        return {str(t): int(c) for t, c in zip(types, counts)}
+
+    def summary(self, top: int = 10) -> Dict[str, Any]:
+        """Total, counts per method and the ``top`` most confident anomalies (as records)"""
+        order = np.argsort(-self.confidences, kind='stable')[:top]
+        return {
+            'total': len(self),
+            'by_type': self.type_counts(),
+            'top': self.take(order).to_records()
+        }
+
+    def _describe(self, i: int) -> str:
+        anomaly_type = self.types[i]
+        metric = self.metrics[i]
+
+        if anomaly_type == 'zscore':
+            return f'{metric} value {self.values[i]:g} is {self.scores[i]:.2f} standard deviations from mean'
+        if anomaly_type == 'iqr':
+            return f'{metric} value {self.values[i]:g} is outside IQR bounds [{self.lower[i]:.2f}, {self.upper[i]:.2f}]'
+        if anomaly_type == 'baseline':
+            return (f'{metric} value {self.values[i]:g} is {self.scores[i]:.2f} standard deviations from its '
+                    f'location/hour-of-week baseline, outside [{self.lower[i]:.2f}, {self.upper[i]:.2f}]')
+        if anomaly_type == 'ewma':
+            return (f'{metric} value {self.values[i]:g} is {self.scores[i]:.2f} standard deviations from its '
+                    f'location\'s recent (EWMA) mean, outside [{self.lower[i]:.2f}, {self.upper[i]:.2f}]')
+        if anomaly_type == 'isolation_forest':
+            return f'Anomaly detected using Isolation Forest on features: {metric.replace(",", ", ")}'
+        if anomaly_type == 'lof':
+            return f'Local outlier detected on features: {metric.replace(",", ", ")}'
+
+        return f'{anomaly_type} anomaly on {metric.replace(",", ", ")}'
+
+    def iter_rows(self) -> Iterator[Tuple[int, str, float, List[str], str]]:
+        """Yield (traffic_event_id, anomaly_type, confidence_score, affected_metrics, description)"""
+        for i in range(len(self)):
+            yield (
+                int(self.event_ids[i]),
+                str(self.types[i]),
+                float(self.confidences[i]),
+                self.metrics[i].split(','),
+                self._describe(i)
+            )
+
+    def to_records(self) -> List[Dict[str, Any]]:
+        """Convert to the dict-per-anomaly shape returned by the API"""
+        return [
+            {
+                'traffic_event_id': event_id,
+                'anomaly_type': anomaly_type,
+                'confidence_score': confidence,
+                'affected_metrics': affected_metrics,
+                'description': description
+            }
+            for event_id, anomaly_type, confidence, affected_metrics, description in self.iter_rows()
+        ]
@@ -0,0 +1,167 @@
+import os
+import numpy as np
+import pandas as pd
+from typing import Optional, List, Dict, Any, Tuple
+
+from services.db import Database, ConcurrentRunError
+from services.sketches import QuantileSketch
+from services.stats import RunningStats
+
+HOURS_PER_WEEK = 168
+
+# Watermark of the last traffic event folded into the baselines
+BASELINE_STATE = 'baselines'
+
+
+def hour_of_week(timestamps, tz: str) -> np.ndarray:
+    """Hour of week (0 = Monday 00:00) in ``tz`` for datetimes or epoch seconds"""
+    if pd.api.types.is_numeric_dtype(timestamps):
+        index = pd.to_datetime(np.asarray(timestamps), unit='s', utc=True)
+    else:
+        index = pd.DatetimeIndex(pd.to_datetime(timestamps, utc=True))
+
+    local = index.tz_convert(tz)
+    return (local.dayofweek * 24 + local.hour).to_numpy(dtype=np.int64)
+
+
+class BaselineStore:
+    """Per-(location, hour of week, metric) baselines backed by traffic_baselines
+
+    Each baseline keeps running Welford statistics plus a small quantile
+    sketch for the quartiles. refresh() folds in the traffic events past
+    the baseline watermark, loading only the baselines those events touch,
+    so maintenance cost is proportional to new data only; lookups are a
+    hash join of event keys against the loaded table. At most
+    BASELINE_REFRESH_MAX_CHUNKS chunks are folded per call, so a large
+    backlog (e.g. the first run after deploy or a backfill) is worked off
+    over several runs while detection uses the last persisted baselines.
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+        self.timezone = os.getenv('BASELINE_TIMEZONE', 'UTC')
+        self.min_count = int(os.getenv('BASELINE_MIN_COUNT', '30'))
+        self.sketch_k = int(os.getenv('BASELINE_SKETCH_K', '64'))
+        self.max_chunks = int(os.getenv('BASELINE_REFRESH_MAX_CHUNKS', '20'))
+        self._table: Optional[Dict[str, pd.DataFrame]] = None
+        self._table_watermark: Optional[int] = None
+
+    def keys(self, location_ids: np.ndarray, timestamps) -> np.ndarray:
+        """Encode (location_id, hour_of_week) as a single int64 key"""
+        return np.asarray(location_ids, dtype=np.int64) * HOURS_PER_WEEK + hour_of_week(timestamps, self.timezone)
+
+    def ensure_current(self) -> None:
+        """Reload the lookup table if any process refreshed the baselines since it was loaded"""
+        watermark = self.db.get_watermark(BASELINE_STATE)
+        if self._table is None or watermark != self._table_watermark:
+            self.load()
+            self._table_watermark = watermark
+
+    def load(self) -> None:
+        """(Re)load the baseline table into per-metric lookup frames"""
+        frame = pd.DataFrame(
+            [row[:8] for row in self.db.fetch_baselines(include_sketches=False)],
+            columns=['location_id', 'hour_of_week', 'metric', 'count', 'mean', 'm2', 'q1', 'q3']
+        )
+        frame['key'] = frame['location_id'].astype(np.int64) * HOURS_PER_WEEK + frame['hour_of_week'].astype(np.int64)
+        frame['std'] = np.sqrt(frame['m2'] / (frame['count'] - 1).clip(lower=1))
+
+        self._table = {
+            metric: group.set_index('key')[['count', 'mean', 'std', 'q1', 'q3']].astype(np.float64)
+            for metric, group in frame.groupby('metric')
+        }
+
+    def lookup(self, metric: str, keys: np.ndarray) -> pd.DataFrame:
+        """Baseline rows aligned with ``keys`` (NaN where no baseline exists)"""
+        if self._table is None:
+            self.load()
+
+        table = self._table.get(metric)
+        if table is None:
+            return pd.DataFrame(np.nan, index=range(len(keys)), columns=['count', 'mean', 'std', 'q1', 'q3'])
+
+        return table.reindex(keys)
+
+    def refresh(self, metrics: List[str], chunk_size: int = 50000) -> Dict[str, Any]:
+        """Fold traffic events past the watermark into the stored baselines
+
+        New events are summarized on their own first; only when there are
+        any are the stored baselines of the locations they touch loaded
+        and merged with them, so an idle run costs one empty read. Events
+        are folded in id order, at most ``max_chunks`` chunks per call (0 =
+        no limit); ``behind`` tells whether more events are waiting. Only
+        events up to the settled id are folded (see
+        Database.fetch_settled_event_id), so none committed late is skipped.
+        """
+        watermark = self.db.get_watermark(BASELINE_STATE)
+        settled = self.db.fetch_settled_event_id()
+
+        new: Dict[Tuple[int, str], Tuple[RunningStats, QuantileSketch]] = {}
+        last_event_id = watermark
+        events_folded = 0
+        behind = False
+
+        chunks = self.db.iter_traffic_events(metrics, chunk_size=chunk_size, after_id=watermark, until_id=settled)
+        try:
+            for i, chunk in enumerate(chunks):
+                if self.max_chunks and i >= self.max_chunks:
+                    behind = True
+                    break
+
+                keys = self.keys(chunk['location_id'], chunk['timestamp'])
+
+                # Sort once per chunk, then slice each key's contiguous run
+                order = np.argsort(keys, kind='stable')
+                unique_keys, starts = np.unique(keys[order], return_index=True)
+                ends = np.append(starts[1:], len(order))
+
+                for metric in metrics:
+                    values = chunk[metric][order]
+                    for key, lo, hi in zip(unique_keys.tolist(), starts, ends):
+                        stats, sketch = new.setdefault(
+                            (key, metric), (RunningStats(), QuantileSketch(self.sketch_k))
+                        )
+                        stats.update(values[lo:hi])
+                        sketch.update(values[lo:hi])
+
+                events_folded += len(chunk['id'])
+                last_event_id = int(chunk['id'][-1])
+        finally:
+            chunks.close()
+
+        if events_folded == 0:
+            return {'events_folded': 0, 'baselines_updated': 0, 'watermark': watermark, 'behind': False}
+
+        # Merge into the stored baselines of the touched keys; others are not rewritten
+        locations = sorted({key // HOURS_PER_WEEK for key, _ in new})
+        for location_id, how, metric, count, mean, m2, _, _, sketch in self.db.fetch_baselines(location_ids=locations):
+            update = new.get((location_id * HOURS_PER_WEEK + how, metric))
+            if update is None:
+                continue
+            stats = RunningStats(count, mean, m2)
+            stats.merge(update[0])
+            stored_sketch = QuantileSketch.from_bytes(sketch) if sketch else QuantileSketch(self.sketch_k)
+            stored_sketch.merge(update[1])
+            new[(location_id * HOURS_PER_WEEK + how, metric)] = (stats, stored_sketch)
+
+        rows = []
+        for (key, metric), (stats, sketch) in new.items():
+            rows.append((
+                key // HOURS_PER_WEEK, key % HOURS_PER_WEEK, metric,
+                stats.count, stats.mean, stats.m2, stats.std,
+                sketch.quantile(0.25), sketch.quantile(0.75), sketch.to_bytes()
+            ))
+
+        try:
+            self.db.commit_baselines(BASELINE_STATE, watermark, last_event_id, rows)
+        except ConcurrentRunError:
+            # Another run folded the same events; its baselines are current
+            return {'events_folded': 0, 'baselines_updated': 0, 'watermark': watermark, 'skipped': True, 'behind': True}
+
+        self._table = None
+        return {
+            'events_folded': events_folded,
+            'baselines_updated': len(rows),
+            'watermark': last_event_id,
+            'behind': behind
+        }
@@ -0,0 +1,105 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+
+
+def cache_key(*parts: Any) -> str:
+    """Stable SHA-256 key for JSON-serializable parts"""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after ``ttl_seconds``
+
+    At most ``max_entries`` entries are kept; the least recently used is
+    evicted first. With ``path`` set the cache is persisted as JSON (values
+    must be JSON-serializable): it is loaded on creation, skipping expired
+    entries, and rewritten atomically on every put.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 3600.0, path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+
+        self._entries: 'OrderedDict[str, Tuple[Any, float]]' = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+        if self.path:
+            self._load()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None or entry[1] < time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self._stats['misses'] += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry[0]
+
+    def put(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (value, time.time() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+            snapshot = list(self._entries.items()) if self.path else None
+
+        if snapshot is not None:
+            self._save(snapshot)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+        if self.path:
+            self._save([])
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'persistent': bool(self.path),
+                **self._stats
+            }
+
+    def _load(self) -> None:
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        now = time.time()
+        for key, value, expires_at in data:
+            if expires_at > now:
+                self._entries[key] = (value, expires_at)
+
+    def _save(self, snapshot) -> None:
+        # Write under a temporary name and rename, so readers never see a partial file
+        directory = os.path.dirname(os.path.abspath(self.path))
+        tmp = os.path.join(directory, f'.tmp-{uuid.uuid4().hex}')
+
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(tmp, 'w') as f:
+                json.dump([[key, value, expires_at] for key, (value, expires_at) in snapshot], f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"Warning: could not persist cache to {self.path}: {e}")
@@ -1,9 +1,52 @@
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
 import os
-from typing import Optional, List, Dict, Any
+import time
+import uuid
+from datetime import date, datetime
+from typing import Optional, List, Dict, Any, Iterator, Tuple
+import numpy as np
 import pandas as pd
 
+from services.anomalies import AnomalyBatch
+from services.metrics import timed
+from services.pool import ConnectionPool, get_pool
+from services.stats import RunningStats
+
+
+# In-memory types of the traffic_events columns fetch_traffic_events loads
+# (ids are SERIAL, so int32 holds them; timestamps become int64 epoch seconds)
+TRAFFIC_EVENT_DTYPES = {
+    'id': np.int32,
+    'timestamp': np.int64,
+    'location_id': 'category',
+    'vehicle_count': np.float32,
+    'avg_speed': np.float32,
+    'min_speed': np.float32,
+    'max_speed': np.float32,
+    'traffic_density_score': np.float32
+}
+
+TRAFFIC_EVENT_COLUMNS = list(TRAFFIC_EVENT_DTYPES)
+
+# anomalies columns returned by fetch_anomalies / iter_anomalies
+ANOMALY_COLUMNS = (
+    "id, detected_at, traffic_event_id, anomaly_type, confidence_score, "
+    "affected_metrics, description, is_resolved"
+)
+
+
+def frame_bytes_per_row(columns: List[str]) -> int:
+    """Bytes per row of a fetch_traffic_events frame with these columns (a categorical takes its int32 codes)"""
+    return sum(
+        4 if TRAFFIC_EVENT_DTYPES[column] == 'category' else np.dtype(TRAFFIC_EVENT_DTYPES[column]).itemsize
+        for column in columns
+    )
+
+
+class ConcurrentRunError(Exception):
+    """Raised when another incremental run advanced the watermark first"""
+
 
 class Database:
     def __init__(self):
@@ -14,79 +57,745 @@ class Database:
             'user': os.getenv('DB_USER', 'postgres'),
             'password': os.getenv('DB_PASSWORD', 'postgres')
         }
+        self.insert_page_size = int(os.getenv('DB_INSERT_PAGE_SIZE', '5000'))
+        self.settle_timeout = float(os.getenv('EVENT_SETTLE_TIMEOUT_SECONDS', '5'))
+        self._settled_event_id = 0
 
-    def get_connection(self):
-        return psycopg2.connect(**self.connection_params)
+    @property
+    def pool(self) -> ConnectionPool:
+        return get_pool(self.connection_params)
 
-    def fetch_traffic_events(self, start: Optional[str] = None, end: Optional[str] = None) -> pd.DataFrame:
-        """Fetch traffic events as pandas DataFrame"""
-        conn = self.get_connection()
-        try:
-            query = """
-                SELECT
-                    id, timestamp, location_id, vehicle_count,
-                    avg_speed, min_speed, max_speed,
-                    traffic_density_score
-                FROM traffic_events
-            """
+    def connection(self):
+        """Check out a pooled connection (use as a context manager)"""
+        return self.pool.connection()
+
+    def _traffic_events_query(
+        self,
+        select: str,
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+        after_id: Optional[int] = None,
+        limit: Optional[int] = None,
+        ordered: bool = True,
+        until_id: Optional[int] = None
+    ) -> Tuple[str, List[Any]]:
+        """Build the filtered traffic_events query shared by the fetch paths
+
+        Without ``ordered`` (and ``limit``), which aggregates do not need,
+        the rows are left unsorted.
+        """
+        query = f"SELECT {select} FROM traffic_events"
+
+        conditions = []
+        params = []
+
+        if start:
+            conditions.append("timestamp >= %s")
+            params.append(start)
+
+        if end:
+            conditions.append("timestamp <= %s")
+            params.append(end)
+
+        if after_id is not None:
+            conditions.append("id > %s")
+            params.append(after_id)
+
+        if until_id is not None:
+            conditions.append("id <= %s")
+            params.append(until_id)
 
-            conditions = []
-            params = []
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
 
-            if start:
-                conditions.append("timestamp >= %s")
-                params.append(start)
+        if ordered or limit:
+            query += " ORDER BY id" if after_id is not None else " ORDER BY timestamp"
 
-            if end:
-                conditions.append("timestamp <= %s")
-                params.append(end)
+        if limit:
+            query += " LIMIT %s"
+            params.append(limit)
 
-            if conditions:
-                query += " WHERE " + " AND ".join(conditions)
+        return query, params
 
-            query += " ORDER BY timestamp"
+    def fetch_traffic_events(
+        self,
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+        after_id: Optional[int] = None,
+        limit: Optional[int] = None,
+        columns: Optional[List[str]] = None,
+        chunk_size: int = 50000,
+        until_id: Optional[int] = None
+    ) -> pd.DataFrame:
+        """Fetch traffic events as pandas DataFrame
 
-            df = pd.read_sql_query(query, conn, params=params if params else None)
+        Only ``columns`` (default: all of TRAFFIC_EVENT_COLUMNS) are read,
+        plus ``id``, with the compact types in TRAFFIC_EVENT_DTYPES: float32
+        metrics (NULL as NaN), int32 ids, a categorical ``location_id`` and
+        int64 epoch-second timestamps. Rows come through a server-side
+        cursor and are converted ``chunk_size`` at a time, so the result is
+        never held as Python objects all at once.
+
+        With ``after_id`` only events with a greater id are returned, ordered
+        by id so that the last row can be used as the next watermark;
+        watermark consumers pass ``until_id`` (see fetch_settled_event_id)
+        so that no lower id can still appear behind it.
+        """
+        columns = ['id'] + [c for c in (columns or TRAFFIC_EVENT_COLUMNS) if c != 'id']
+        unknown = [c for c in columns if c not in TRAFFIC_EVENT_DTYPES]
+        if unknown:
+            raise ValueError(f'Unknown traffic_events columns: {", ".join(unknown)}')
+
+        select = ", ".join(
+            # Floor, so an event keeps its hour even when it is a fraction of a second before the next one
+            "FLOOR(EXTRACT(EPOCH FROM timestamp))::bigint" if column == 'timestamp' else column
+            for column in columns
+        )
+        query, params = self._traffic_events_query(select, start, end, after_id, limit, until_id=until_id)
+        # Categoricals are read as int32 values and encoded once at the end
+        storage = {
+            column: np.int32 if TRAFFIC_EVENT_DTYPES[column] == 'category' else TRAFFIC_EVENT_DTYPES[column]
+            for column in columns
+        }
+        parts: Dict[str, List[np.ndarray]] = {column: [] for column in columns}
+
+        with timed('db.fetch_traffic_events') as stage:
+            with self.connection() as conn:
+                cursor = conn.cursor(name=f'traffic_events_fetch_{uuid.uuid4().hex}')
+                cursor.itersize = chunk_size
+                cursor.execute(query, params)
+
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+
+                    block = np.array(rows, dtype=np.float64)
+                    for i, column in enumerate(columns):
+                        parts[column].append(block[:, i].astype(storage[column]))
+
+                cursor.close()
+
+            data = {}
+            for column in columns:
+                # Release each column's chunks as soon as they are joined
+                chunks = parts.pop(column)
+                values = np.concatenate(chunks) if chunks else np.empty(0, dtype=storage[column])
+                data[column] = pd.Categorical(values) if TRAFFIC_EVENT_DTYPES[column] == 'category' else values
+
+            df = pd.DataFrame(data)
+            stage.rows = len(df)
             return df
 
-        finally:
-            conn.close()
+    def count_traffic_events(
+        self,
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+        after_id: Optional[int] = None,
+        limit: Optional[int] = None,
+        until_id: Optional[int] = None
+    ) -> int:
+        """Number of rows fetch_traffic_events would return for the same filter"""
+        query, params = self._traffic_events_query("1", start, end, after_id, limit, ordered=False, until_id=until_id)
+
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT count(*) FROM ({query}) AS events", params)
+            count = cursor.fetchone()[0]
+            conn.commit()
+            return int(count)
+
+    def fetch_window_version(self, start: Optional[str] = None, end: Optional[str] = None) -> Tuple[Any, ...]:
+        """Cheap version of the traffic events in [start, end], for keying cached results
+
+        An open-ended window is versioned by the highest event id (an
+        index-only lookup per partition). A bounded one is versioned by the
+        event count and latest event time of the hourly rollups covering it
+        (a primary key range scan), which also change when late events land
+        in the window; only the whole hours at its edges are over-covered,
+        which can invalidate a cached result early but never serve a stale one.
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+
+            max_id = None
+            if end is None:
+                cursor.execute("SELECT COALESCE(MAX(id), 0) FROM traffic_events")
+                max_id = int(cursor.fetchone()[0])
+
+            rollup = None
+            if start is not None or end is not None:
+                conditions = []
+                params: List[Any] = []
+                if start is not None:
+                    conditions.append("hour_start >= traffic_hour(%s::timestamptz)")
+                    params.append(start)
+                if end is not None:
+                    conditions.append("hour_start <= traffic_hour(%s::timestamptz)")
+                    params.append(end)
 
-    def insert_anomalies(self, anomalies: List[Dict[str, Any]]) -> int:
+                cursor.execute(
+                    "SELECT COALESCE(SUM(event_count), 0), MAX(last_event_at) FROM traffic_hourly_rollups"
+                    " WHERE " + " AND ".join(conditions),
+                    params
+                )
+                count, last_event_at = cursor.fetchone()
+                rollup = (int(count), last_event_at.isoformat() if last_event_at else None)
+
+            conn.commit()
+            return max_id, rollup
+
+    def iter_traffic_events(
+        self,
+        metrics: List[str],
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+        chunk_size: int = 50000,
+        after_id: Optional[int] = None,
+        until_id: Optional[int] = None
+    ) -> Iterator[Dict[str, np.ndarray]]:
+        """Stream traffic events in fixed-size chunks of NumPy arrays
+
+        Rows are read through a named (server-side) cursor so only one chunk
+        is held client-side at a time. Each chunk maps ``id``,
+        ``location_id`` (int64), ``timestamp`` (epoch seconds) and the
+        requested metrics (float64, NULL as NaN) to equal-length arrays.
+        ``after_id`` and ``until_id`` behave as in fetch_traffic_events.
+        """
+        columns = ['id', 'location_id', 'timestamp'] + metrics
+        query, params = self._traffic_events_query(
+            "id, location_id, EXTRACT(EPOCH FROM timestamp), " + ", ".join(metrics),
+            start, end, after_id, until_id=until_id
+        )
+
+        with self.connection() as conn:
+            cursor = conn.cursor(name=f'traffic_events_stream_{uuid.uuid4().hex}')
+            cursor.itersize = chunk_size
+            cursor.execute(query, params)
+
+            while True:
+                # Timed per chunk, so the caller's work between chunks is not counted
+                with timed('db.iter_traffic_events') as stage:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+
+                    block = np.array(rows, dtype=np.float64)
+                    chunk = {name: block[:, i] for i, name in enumerate(columns)}
+                    chunk['id'] = chunk['id'].astype(np.int64)
+                    chunk['location_id'] = chunk['location_id'].astype(np.int64)
+                    stage.rows = len(rows)
+                yield chunk
+
+            cursor.close()
+
+    def insert_anomalies(self, anomalies: AnomalyBatch) -> int:
         """Insert detected anomalies into the database"""
-        if not anomalies:
+        if not len(anomalies):
             return 0
 
-        conn = self.get_connection()
-        try:
+        with timed('db.insert_anomalies') as stage, self.connection() as conn:
+            stage.rows = len(anomalies)
             cursor = conn.cursor()
+            self._insert_anomalies(cursor, anomalies)
+            conn.commit()
+            return len(anomalies)
 
-            query = """
-                INSERT INTO anomalies (
-                    traffic_event_id, anomaly_type, confidence_score,
-                    affected_metrics, description
-                ) VALUES (%s, %s, %s, %s, %s)
-            """
+    def _insert_anomalies(self, cursor, anomalies: AnomalyBatch) -> None:
+        """Upsert anomalies with multi-row INSERTs
+
+        Rows are keyed on (traffic_event_id, anomaly_type), so re-running
+        analysis over the same or an overlapping window updates the existing
+        anomaly instead of adding a duplicate, and rows whose score and
+        description are unchanged are not rewritten at all.
+        """
+        query = """
+            INSERT INTO anomalies (
+                traffic_event_id, anomaly_type, confidence_score,
+                affected_metrics, description
+            ) VALUES %s
+            ON CONFLICT (traffic_event_id, anomaly_type) DO UPDATE SET
+                confidence_score = EXCLUDED.confidence_score,
+                affected_metrics = EXCLUDED.affected_metrics,
+                description = EXCLUDED.description
+            WHERE (anomalies.confidence_score, anomalies.description)
+                IS DISTINCT FROM (EXCLUDED.confidence_score, EXCLUDED.description)
+        """
+
+        rows = (
+            (event_id, anomaly_type, confidence, psycopg2.extras.Json(affected_metrics), description)
+            for event_id, anomaly_type, confidence, affected_metrics, description in anomalies.iter_rows()
+        )
+
+        execute_values(cursor, query, rows, page_size=self.insert_page_size)
+
+    def _anomalies_query(
+        self,
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+        anomaly_type: Optional[str] = None,
+        after: Optional[Tuple[datetime, int]] = None,
+        limit: Optional[int] = None
+    ) -> Tuple[str, List[Any]]:
+        """Build the anomalies query shared by the paging and streaming paths
+
+        Rows come in (detected_at, id) order; ``after`` is the key of the
+        last row already seen, so pages are read off the index (keyset
+        pagination) instead of skipping over an OFFSET.
+        """
+        query = f"SELECT {ANOMALY_COLUMNS} FROM anomalies"
 
-            for anomaly in anomalies:
-                cursor.execute(query, (
-                    anomaly['traffic_event_id'],
-                    anomaly['anomaly_type'],
-                    anomaly['confidence_score'],
-                    psycopg2.extras.Json(anomaly['affected_metrics']),
-                    anomaly['description']
-                ))
+        conditions = []
+        params: List[Any] = []
 
+        if start:
+            conditions.append("detected_at >= %s")
+            params.append(start)
+
+        if end:
+            conditions.append("detected_at <= %s")
+            params.append(end)
+
+        if anomaly_type:
+            conditions.append("anomaly_type = %s")
+            params.append(anomaly_type)
+
+        if after is not None:
+            conditions.append("(detected_at, id) > (%s, %s)")
+            params.extend(after)
+
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+
+        query += " ORDER BY detected_at, id"
+
+        if limit:
+            query += " LIMIT %s"
+            params.append(limit)
+
+        return query, params
+
+    def fetch_anomalies(
+        self,
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+        anomaly_type: Optional[str] = None,
+        after: Optional[Tuple[datetime, int]] = None,
+        limit: int = 100
+    ) -> List[Dict[str, Any]]:
+        """One page of stored anomalies, in (detected_at, id) order after the key ``after``"""
+        query, params = self._anomalies_query(start, end, anomaly_type, after, limit)
+
+        with timed('db.fetch_anomalies') as stage, self.connection() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
             conn.commit()
-            return len(anomalies)
+            stage.rows = len(rows)
+            return rows
+
+    def iter_anomalies(
+        self,
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+        anomaly_type: Optional[str] = None,
+        chunk_size: int = 5000
+    ) -> Iterator[List[Dict[str, Any]]]:
+        """Stream stored anomalies in (detected_at, id) order, ``chunk_size`` rows at a time
+
+        Rows are read through a named (server-side) cursor, so only one
+        chunk is held client-side at a time.
+        """
+        query, params = self._anomalies_query(start, end, anomaly_type)
+
+        with self.connection() as conn:
+            cursor = conn.cursor(name=f'anomalies_stream_{uuid.uuid4().hex}', cursor_factory=RealDictCursor)
+            cursor.itersize = chunk_size
+            cursor.execute(query, params)
+
+            while True:
+                with timed('db.iter_anomalies') as stage:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    stage.rows = len(rows)
+                yield rows
+
+            cursor.close()
+
+    def get_watermark(self, name: str) -> int:
+        """Return the last processed traffic event id for an incremental consumer"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
 
-        finally:
-            conn.close()
+            cursor.execute("""
+                INSERT INTO analysis_watermarks (name) VALUES (%s)
+                ON CONFLICT (name) DO NOTHING
+            """, (name,))
+            cursor.execute(
+                "SELECT last_event_id FROM analysis_watermarks WHERE name = %s",
+                (name,)
+            )
+
+            result = cursor.fetchone()
+            conn.commit()
+            return int(result[0]) if result else 0
+
+    def fetch_settled_event_id(self, timeout: Optional[float] = None) -> int:
+        """Highest traffic event id below which no insert can still commit
+
+        Ids are drawn at INSERT but become visible at COMMIT, so a watermark
+        advanced to the highest visible id would skip a lower id whose
+        transaction commits later (concurrent ingests, batch inserts). This
+        reads the id sequence together with the snapshot's xmax and waits
+        until every transaction below that xmax has ended, polling for up
+        to ``timeout`` seconds (EVENT_SETTLE_TIMEOUT_SECONDS by default);
+        ingest transactions are short, so that is normally immediate. On
+        timeout (a long-running writer) the last settled id is returned.
+        The one gap left is an insert that has drawn its id but not yet
+        written its row, which is within a single statement.
+        """
+        timeout = self.settle_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT COALESCE(pg_sequence_last_value('traffic_events_id_seq'), 0),
+                    pg_snapshot_xmax(pg_current_snapshot())::text
+            """)
+            last_id, xmax = cursor.fetchone()
+            conn.commit()
+
+            while True:
+                cursor.execute("SELECT pg_snapshot_xmin(pg_current_snapshot()) >= %s::xid8", (xmax,))
+                settled = cursor.fetchone()[0]
+                conn.commit()
+
+                if settled:
+                    self._settled_event_id = max(self._settled_event_id, int(last_id))
+                    return self._settled_event_id
+                if time.monotonic() >= deadline:
+                    return self._settled_event_id
+                time.sleep(0.05)
+
+    def ensure_traffic_events_partitions(self, from_day: date, to_day: date) -> List[str]:
+        """Create the missing daily traffic_events partitions for [from_day, to_day]; returns their names"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT ensure_traffic_events_partitions(%s, %s)", (from_day, to_day))
+            created = [row[0] for row in cursor.fetchall()]
+            conn.commit()
+            return created
+
+    def fetch_default_partition_days(self) -> List[date]:
+        """UTC days of the events held in the default traffic_events partition"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT DISTINCT (timestamp AT TIME ZONE 'UTC')::date AS day
+                FROM traffic_events_default
+                ORDER BY day
+            """)
+            days = [row[0] for row in cursor.fetchall()]
+            conn.commit()
+            return days
+
+    def drop_traffic_events_partitions(self, before_day: date) -> List[str]:
+        """Drop the daily traffic_events partitions of days before ``before_day``; returns their names"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT drop_traffic_events_partitions(%s)", (before_day,))
+            dropped = [row[0] for row in cursor.fetchall()]
+            conn.commit()
+            return dropped
+
+    def fetch_settled_analysis_windows(
+        self,
+        schedule: str,
+        since: datetime,
+        max_attempts: int,
+        claim_timeout: float
+    ) -> List[Tuple[datetime, datetime]]:
+        """Windows of a schedule starting at or after ``since`` that need no run
+
+        Those are succeeded windows, failed ones out of attempts and ones
+        claimed by a run that has not yet timed out.
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT window_start, window_end FROM analysis_windows
+                WHERE schedule = %s AND window_start >= %s
+                  AND (
+                      status = 'succeeded'
+                      OR (status = 'failed' AND attempts >= %s)
+                      OR (status = 'running' AND started_at >= CURRENT_TIMESTAMP - %s * INTERVAL '1 second')
+                  )
+            """, (schedule, since, max_attempts, claim_timeout))
+            windows = [(row[0], row[1]) for row in cursor.fetchall()]
+            conn.commit()
+            return windows
+
+    def claim_analysis_window(
+        self,
+        schedule: str,
+        start: datetime,
+        end: datetime,
+        max_attempts: int,
+        claim_timeout: float
+    ) -> bool:
+        """Mark a window as running unless it is done or claimed elsewhere; returns whether it was claimed
+
+        Failed windows with attempts left, and running ones whose claim is
+        older than ``claim_timeout`` seconds (their run died), are reclaimed.
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO analysis_windows (schedule, window_start, window_end, status)
+                VALUES (%s, %s, %s, 'running')
+                ON CONFLICT (schedule, window_start, window_end) DO UPDATE
+                SET status = 'running', started_at = CURRENT_TIMESTAMP, finished_at = NULL, error = NULL
+                WHERE (analysis_windows.status = 'failed' AND analysis_windows.attempts < %s)
+                   OR (analysis_windows.status = 'running'
+                       AND analysis_windows.started_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 second')
+                RETURNING 1
+            """, (schedule, start, end, max_attempts, claim_timeout))
+            claimed = cursor.fetchone() is not None
+            conn.commit()
+            return claimed
+
+    def finish_analysis_window(
+        self,
+        schedule: str,
+        start: datetime,
+        end: datetime,
+        status: str,
+        job_id: Optional[str] = None,
+        anomalies_detected: Optional[int] = None,
+        error: Optional[str] = None,
+        attempted: bool = True
+    ) -> None:
+        """Record the outcome of a claimed window
+
+        Without ``attempted`` (the job never ran, e.g. the queue was full)
+        the claim is released without using up an attempt.
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE analysis_windows
+                SET status = %s, job_id = %s, anomalies_detected = %s, error = %s,
+                    attempts = attempts + %s, finished_at = CURRENT_TIMESTAMP
+                WHERE schedule = %s AND window_start = %s AND window_end = %s
+            """, (status, job_id, anomalies_detected, error, int(attempted), schedule, start, end))
+            conn.commit()
+
+    def fetch_analysis_window_counts(self, schedule: str) -> Dict[str, int]:
+        """Number of recorded windows of a schedule per status"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT status, COUNT(*) FROM analysis_windows WHERE schedule = %s GROUP BY status",
+                (schedule,)
+            )
+            counts = {status: int(count) for status, count in cursor.fetchall()}
+            conn.commit()
+            return counts
+
+    def fetch_metric_stats(self, name: str) -> Dict[str, RunningStats]:
+        """Fetch the running per-metric statistics of an incremental consumer"""
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT metric, count, mean, m2 FROM metric_statistics WHERE name = %s",
+                (name,)
+            )
+
+            return {
+                metric: RunningStats(count, mean, m2)
+                for metric, count, mean, m2 in cursor.fetchall()
+            }
+
+    def _advance_watermark(
+        self,
+        conn,
+        cursor,
+        name: str,
+        previous_event_id: int,
+        last_event_id: int
+    ) -> None:
+        """Compare-and-swap a watermark inside the caller's transaction"""
+        cursor.execute("""
+            UPDATE analysis_watermarks
+            SET last_event_id = %s, updated_at = CURRENT_TIMESTAMP
+            WHERE name = %s AND last_event_id = %s
+        """, (last_event_id, name, previous_event_id))
+
+        if cursor.rowcount != 1:
+            conn.rollback()
+            raise ConcurrentRunError(
+                f'Watermark "{name}" was advanced by a concurrent run'
+            )
+
+    def commit_incremental_run(
+        self,
+        name: str,
+        previous_event_id: int,
+        last_event_id: int,
+        stats: Dict[str, RunningStats],
+        anomalies: AnomalyBatch
+    ) -> None:
+        """Atomically store anomalies, running statistics and the new watermark
+
+        The watermark is advanced with a compare-and-swap on
+        ``previous_event_id``; if another run got there first nothing is
+        written and ConcurrentRunError is raised.
+        """
+        with timed('db.commit_incremental_run') as stage, self.connection() as conn:
+            stage.rows = len(anomalies)
+            cursor = conn.cursor()
+
+            self._advance_watermark(conn, cursor, name, previous_event_id, last_event_id)
+
+            for metric, metric_stats in stats.items():
+                cursor.execute("""
+                    INSERT INTO metric_statistics (name, metric, count, mean, m2)
+                    VALUES (%s, %s, %s, %s, %s)
+                    ON CONFLICT (name, metric) DO UPDATE SET
+                        count = EXCLUDED.count,
+                        mean = EXCLUDED.mean,
+                        m2 = EXCLUDED.m2,
+                        updated_at = CURRENT_TIMESTAMP
+                """, (name, metric, metric_stats.count, metric_stats.mean, metric_stats.m2))
+
+            self._insert_anomalies(cursor, anomalies)
+
+            conn.commit()
+
+    def fetch_baselines(
+        self,
+        include_sketches: bool = True,
+        location_ids: Optional[List[int]] = None
+    ) -> List[Tuple[int, int, str, int, float, float, float, float, Optional[bytes]]]:
+        """Fetch (location_id, hour_of_week, metric, count, mean, m2, q1, q3, sketch) rows
+
+        ``sketch`` is None unless ``include_sketches`` is set. With
+        ``location_ids`` only the baselines of those locations are read.
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT location_id, hour_of_week, metric, count, mean, m2, q1, q3,
+                    {'sketch' if include_sketches else 'NULL'}
+                FROM traffic_baselines
+                {'WHERE location_id = ANY(%s)' if location_ids is not None else ''}
+            """, (location_ids,) if location_ids is not None else None)
+
+            return [
+                row[:8] + (bytes(row[8]) if row[8] is not None else None,)
+                for row in cursor.fetchall()
+            ]
+
+    def commit_baselines(
+        self,
+        name: str,
+        previous_event_id: int,
+        last_event_id: int,
+        rows: List[Tuple[int, int, str, int, float, float, float, float, float, bytes]]
+    ) -> None:
+        """Upsert baseline rows and advance their watermark in one transaction
+
+        ``rows`` are (location_id, hour_of_week, metric, count, mean, m2,
+        std, q1, q3, sketch). Uses the same compare-and-swap as
+        commit_incremental_run.
+        """
+        with timed('db.commit_baselines') as stage, self.connection() as conn:
+            stage.rows = len(rows)
+            cursor = conn.cursor()
+
+            self._advance_watermark(conn, cursor, name, previous_event_id, last_event_id)
+
+            execute_values(cursor, """
+                INSERT INTO traffic_baselines (
+                    location_id, hour_of_week, metric, count, mean, m2,
+                    std, q1, q3, sketch
+                ) VALUES %s
+                ON CONFLICT (location_id, hour_of_week, metric) DO UPDATE SET
+                    count = EXCLUDED.count,
+                    mean = EXCLUDED.mean,
+                    m2 = EXCLUDED.m2,
+                    std = EXCLUDED.std,
+                    q1 = EXCLUDED.q1,
+                    q3 = EXCLUDED.q3,
+                    sketch = EXCLUDED.sketch,
+                    updated_at = CURRENT_TIMESTAMP
+            """, [
+                row[:9] + (psycopg2.Binary(row[9]),) for row in rows
+            ], page_size=self.insert_page_size)
+
+            conn.commit()
+
+    def fetch_metric_sketches(
+        self,
+        include_sketches: bool = True,
+        location_ids: Optional[List[int]] = None
+    ) -> List[Tuple[int, str, int, float, float, Optional[bytes]]]:
+        """Fetch (location_id, metric, count, q1, q3, sketch) rows
+
+        ``sketch`` is None unless ``include_sketches`` is set. With
+        ``location_ids`` only the sketches of those locations are read.
+        """
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT location_id, metric, count, q1, q3,
+                    {'sketch' if include_sketches else 'NULL'}
+                FROM metric_sketches
+                {'WHERE location_id = ANY(%s)' if location_ids is not None else ''}
+            """, (location_ids,) if location_ids is not None else None)
+
+            return [
+                row[:5] + (bytes(row[5]) if row[5] is not None else None,)
+                for row in cursor.fetchall()
+            ]
+
+    def commit_metric_sketches(
+        self,
+        name: str,
+        previous_event_id: int,
+        last_event_id: int,
+        rows: List[Tuple[int, str, int, float, float, bytes]]
+    ) -> None:
+        """Upsert (location_id, metric, count, q1, q3, sketch) rows and advance their watermark
+
+        Uses the same compare-and-swap as commit_incremental_run.
+        """
+        with timed('db.commit_metric_sketches') as stage, self.connection() as conn:
+            stage.rows = len(rows)
+            cursor = conn.cursor()
+
+            self._advance_watermark(conn, cursor, name, previous_event_id, last_event_id)
+
+            execute_values(cursor, """
+                INSERT INTO metric_sketches (location_id, metric, count, q1, q3, sketch)
+                VALUES %s
+                ON CONFLICT (location_id, metric) DO UPDATE SET
+                    count = EXCLUDED.count,
+                    q1 = EXCLUDED.q1,
+                    q3 = EXCLUDED.q3,
+                    sketch = EXCLUDED.sketch,
+                    updated_at = CURRENT_TIMESTAMP
+            """, [
+                row[:5] + (psycopg2.Binary(row[5]),) for row in rows
+            ], page_size=self.insert_page_size)
+
+            conn.commit()
 
     def insert_trend_suggestion(self, suggestion: Dict[str, Any]) -> int:
         """Insert trend suggestion into the database"""
-        conn = self.get_connection()
-        try:
+        with timed('db.insert_trend_suggestion'), self.connection() as conn:
             cursor = conn.cursor()
 
             query = """
@@ -109,6 +818,3 @@ class Database:
             result = cursor.fetchone()
             conn.commit()
             return result[0] if result else 0
-
-        finally:
-            conn.close()
@@ -0,0 +1,264 @@
+import asyncio
+import logging
+import multiprocessing
+import time
+import uuid
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional, Dict, Any, Callable, Awaitable
+
+logger = logging.getLogger(__name__)
+
+
+class JobNotFoundError(Exception):
+    """Raised for unknown (or already pruned) job ids"""
+
+
+class JobStateError(Exception):
+    """Raised when a job cannot transition to the requested state"""
+
+
+class JobQueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at ``max_queued``"""
+
+
+class Job:
+    """Book-keeping for one submitted analysis"""
+
+    def __init__(self, params: Dict[str, Any], key: Optional[str] = None):
+        self.id = uuid.uuid4().hex
+        self.params = params
+        self.key = key
+        self.status = 'queued'
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[BaseException] = None
+        # Set while the on_result hook runs, and what it raised after the job itself succeeded
+        self.hook_pending = False
+        self.hook_error: Optional[BaseException] = None
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in ('succeeded', 'failed', 'cancelled')
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {
+            'job_id': self.id,
+            'status': self.status,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
+
+        if self.status == 'succeeded':
+            data['result'] = self.result
+            if self.hook_pending:
+                data['hook_pending'] = True
+            if self.hook_error is not None:
+                data['hook_error'] = str(self.hook_error)
+        elif self.status == 'failed':
+            data['error'] = str(self.error)
+
+        return data
+
+
+class JobManager:
+    """Run blocking analysis work off the event loop
+
+    ``func`` is called with the job parameters in a process pool (default)
+    or a thread pool, with at most ``max_workers`` jobs running at a time;
+    further jobs wait in the queue. ``on_result`` is an optional coroutine
+    run on the event loop once the job has succeeded (``hook_pending`` is
+    set meanwhile and waiters resume after it); an exception it raises is
+    kept as ``hook_error`` and does not fail the job, since the work itself
+    is done. ``on_finish`` is called with every job once it is done,
+    whatever its final status.
+
+    Jobs submitted with the same ``key`` while one is still queued or
+    running share that job (single flight). With ``max_queued`` set, a
+    submission that would make the queue longer than that raises
+    JobQueueFullError instead.
+
+    Queued jobs can be cancelled. A running job cannot be interrupted
+    safely (it may already be writing anomalies), so cancelling it raises
+    JobStateError. Finished jobs are kept for ``retention_seconds``.
+    """
+
+    def __init__(
+        self,
+        func: Callable[[Dict[str, Any]], Dict[str, Any]],
+        max_workers: int = 2,
+        executor: str = 'process',
+        retention_seconds: float = 3600.0,
+        on_result: Optional[Callable[[Job], Awaitable[None]]] = None,
+        on_finish: Optional[Callable[[Job], None]] = None,
+        max_queued: Optional[int] = None
+    ):
+        if executor not in ('process', 'thread'):
+            raise ValueError(f'Unknown executor type: {executor}')
+
+        self.func = func
+        self.max_workers = max_workers
+        self.executor_type = executor
+        self.retention_seconds = retention_seconds
+        self.on_result = on_result
+        self.on_finish = on_finish
+        self.max_queued = max_queued
+
+        self.jobs: Dict[str, Job] = {}
+        self._inflight: Dict[str, Job] = {}
+        self._executor: Optional[Executor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._stats = {'coalesced': 0, 'rejected': 0, 'hook_errors': 0}
+
+    def _get_executor(self) -> Executor:
+        # Created lazily so importing the app does not start worker processes
+        if self._executor is None:
+            if self.executor_type == 'process':
+                # spawn: forking a process that runs the event loop and pool
+                # threads can deadlock the child on inherited locks
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    def submit(self, params: Dict[str, Any], key: Optional[str] = None) -> Job:
+        """Queue a job and return immediately, or return the unfinished job with the same ``key``"""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_workers)
+
+        self._prune()
+
+        if key is not None and key in self._inflight:
+            self._stats['coalesced'] += 1
+            return self._inflight[key]
+
+        if self.max_queued is not None:
+            queued = sum(1 for job in self.jobs.values() if job.status == 'queued')
+            if queued >= self.max_queued:
+                self._stats['rejected'] += 1
+                raise JobQueueFullError(f'{queued} jobs are already queued; retry later')
+
+        job = Job(params, key)
+        self.jobs[job.id] = job
+        if key is not None:
+            self._inflight[key] = job
+        job.task = asyncio.create_task(self._run(job))
+        return job
+
+    def add_finished(self, params: Dict[str, Any], result: Dict[str, Any]) -> Job:
+        """Record a succeeded job whose result is already known (e.g. from a cache)"""
+        self._prune()
+
+        job = Job(params)
+        job.status = 'succeeded'
+        job.started_at = job.finished_at = job.created_at
+        job.result = result
+        self.jobs[job.id] = job
+        return job
+
+    async def _run(self, job: Job) -> None:
+        try:
+            async with self._slots:
+                job.status = 'running'
+                job.started_at = time.time()
+
+                loop = asyncio.get_running_loop()
+                job.result = await loop.run_in_executor(self._get_executor(), self.func, job.params)
+
+            # The work is done (anomalies may already be written), whatever the hook does
+            job.status = 'succeeded'
+
+            if self.on_result is not None:
+                job.hook_pending = True
+                try:
+                    await self.on_result(job)
+                except Exception as e:
+                    job.hook_error = e
+                    self._stats['hook_errors'] += 1
+                    logger.exception('Result hook failed for job %s', job.id)
+                finally:
+                    job.hook_pending = False
+
+        except asyncio.CancelledError:
+            job.status = 'cancelled'
+
+        except Exception as e:
+            job.error = e
+            job.status = 'failed'
+
+        finally:
+            job.finished_at = time.time()
+            if job.key is not None and self._inflight.get(job.key) is job:
+                del self._inflight[job.key]
+            if self.on_finish is not None:
+                try:
+                    self.on_finish(job)
+                except Exception:
+                    logger.exception('Finish hook failed for job %s', job.id)
+
+    def get(self, job_id: str) -> Job:
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise JobNotFoundError(f'Job {job_id} not found')
+        return job
+
+    async def wait(self, job_id: str, timeout: Optional[float] = None) -> Job:
+        """Wait until the job (including its result hook) is done or ``timeout`` seconds have passed"""
+        job = self.get(job_id)
+
+        # A succeeded job's task may still be running the on_result hook
+        if job.task is not None and not job.task.done():
+            try:
+                await asyncio.wait_for(asyncio.shield(job.task), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+        return job
+
+    def cancel(self, job_id: str) -> Job:
+        job = self.get(job_id)
+
+        if job.done:
+            raise JobStateError(f'Job {job_id} already {job.status}')
+        if job.status == 'running':
+            raise JobStateError(f'Job {job_id} is already running and cannot be cancelled')
+
+        job.task.cancel()
+        job.status = 'cancelled'
+        return job
+
+    def stats(self) -> Dict[str, Any]:
+        counts: Dict[str, int] = {}
+        for job in self.jobs.values():
+            counts[job.status] = counts.get(job.status, 0) + 1
+
+        return {
+            'executor': self.executor_type,
+            'max_workers': self.max_workers,
+            'max_queued': self.max_queued,
+            'jobs': counts,
+            **self._stats
+        }
+
+    def _prune(self) -> None:
+        cutoff = time.time() - self.retention_seconds
+        expired = [
+            job_id for job_id, job in self.jobs.items()
+            if job.done and job.finished_at is not None and job.finished_at < cutoff
+        ]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    def shutdown(self) -> None:
+        for job in self.jobs.values():
+            if job.task is not None and not job.done:
+                job.task.cancel()
+
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
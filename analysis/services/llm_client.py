@@ -1,69 +1,133 @@
+import asyncio
 import httpx
 import json
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Callable
 from datetime import datetime
 import os
 
+from services.cache import TTLCache, cache_key
 from services.db import Database
+from services.metrics import timed
 
 
-class OllamaClient:
-    """Client for interacting with Ollama LLM service"""
+async def store_suggestion(db: Database, suggestion: Dict[str, Any]) -> None:
+    """Persist a suggestion and set its ``id``
+
+    trend_suggestions requires both period bounds. Callers fill open bounds
+    from the events analyzed; a suggestion whose period is still open is
+    returned unsaved, with ``id`` None and ``unbounded`` set.
+    """
+    if suggestion['time_period_start'] is None or suggestion['time_period_end'] is None:
+        suggestion['id'] = None
+        suggestion['unbounded'] = True
+        return
+
+    suggestion['id'] = await asyncio.to_thread(db.insert_trend_suggestion, suggestion)
 
-    def __init__(self, url: str, model: str):
+
+class OllamaClient:
+    """Client for interacting with Ollama LLM service
+
+    One pooled HTTP client with keep-alive is reused for every call.
+    Generated text is cached by model, options and prompt, so identical
+    prompts (common, since the prompt only holds per-type counts) are not
+    generated again while the entry is fresh, and concurrent identical
+    requests share one generation. With ``on_token`` the completion is
+    requested in Ollama's streaming mode and each token is passed on as it
+    arrives; cached or shared completions arrive as a single token.
+    """
+
+    def __init__(self, url: str, model: str, db: Optional[Database] = None):
         self.url = url.rstrip('/')
         self.model = model
         self.timeout = int(os.getenv('OLLAMA_TIMEOUT', '30'))
-        self.db = Database()
+        self.max_connections = int(os.getenv('OLLAMA_MAX_CONNECTIONS', '4'))
+        self.keepalive_seconds = float(os.getenv('OLLAMA_KEEPALIVE_SECONDS', '60'))
+        self.db = db or Database()
+        self.options = {
+            "temperature": 0.7,
+            "top_p": 0.9
+        }
+
+        self.cache = TTLCache(
+            max_entries=int(os.getenv('OLLAMA_CACHE_MAX_ENTRIES', '256')),
+            ttl_seconds=float(os.getenv('OLLAMA_CACHE_TTL_SECONDS', '3600')),
+            path=os.getenv('OLLAMA_CACHE_PATH') or None
+        )
+
+        self._client: Optional[httpx.AsyncClient] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # Created lazily so it binds to the running event loop
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                    keepalive_expiry=self.keepalive_seconds
+                )
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'model': self.model,
+            'inflight': len(self._inflight),
+            'cache': self.cache.stats()
+        }
 
     async def generate_trend_suggestions(
         self,
-        anomalies: List[Dict[str, Any]],
+        summary: Dict[str, Any],
         start: Optional[datetime] = None,
-        end: Optional[datetime] = None
+        end: Optional[datetime] = None,
+        on_token: Optional[Callable[[str], None]] = None
     ) -> List[Dict[str, Any]]:
-        """Generate human-readable trend suggestions from anomalies"""
+        """Generate human-readable trend suggestions from an anomaly summary
+
+        ``summary`` is AnomalyBatch.summary(): the prompt only needs the
+        counts, and the most confident anomalies become the related ones.
+        The final text is persisted once the completion is done, also when
+        it was streamed token by token through ``on_token`` (see
+        store_suggestion for open-ended periods). Errors from Ollama or the
+        database are raised to the caller.
+        """
 
-        if not anomalies:
+        if not summary['total']:
             return []
 
-        # Prepare prompt
-        prompt = self._build_prompt(anomalies, start, end)
+        related = [a['traffic_event_id'] for a in summary['top'][:10]]  # Limit to 10
 
-        try:
-            # Call Ollama API
-            suggestion_text = await self._call_ollama(prompt)
+        # Prepare prompt
+        prompt = self._build_prompt(summary, start, end)
 
-            # Store suggestion in database
-            suggestion = {
-                'time_period_start': start.isoformat() if start else None,
-                'time_period_end': end.isoformat() if end else None,
-                'suggestion_type': 'anomaly_summary',
-                'confidence_level': 0.8,
-                'description': suggestion_text,
-                'related_anomalies': [a['traffic_event_id'] for a in anomalies[:10]]  # Limit to 10
-            }
+        # Call Ollama API; failures propagate so the suggestion request is marked failed
+        suggestion_text = await self._call_ollama(prompt, on_token)
 
-            suggestion_id = self.db.insert_trend_suggestion(suggestion)
-            suggestion['id'] = suggestion_id
+        # Store suggestion in database
+        suggestion = {
+            'time_period_start': start.isoformat() if start else None,
+            'time_period_end': end.isoformat() if end else None,
+            'suggestion_type': 'anomaly_summary',
+            'confidence_level': 0.8,
+            'description': suggestion_text,
+            'related_anomalies': related
+        }
 
-            return [suggestion]
+        await store_suggestion(self.db, suggestion)
 
-        except Exception as e:
-            print(f"Error generating trend suggestions: {e}")
-            # Return a fallback suggestion
-            return [{
-                'time_period_start': start.isoformat() if start else None,
-                'time_period_end': end.isoformat() if end else None,
-                'suggestion_type': 'anomaly_summary',
-                'confidence_level': 0.5,
-                'description': f'Detected {len(anomalies)} anomalies in traffic patterns. Manual review recommended.',
-                'related_anomalies': [a['traffic_event_id'] for a in anomalies[:10]]
-            }]
+        return [suggestion]
 
     def _build_prompt(
         self,
-        anomalies: List[Dict[str, Any]],
+        summary: Dict[str, Any],
         start: Optional[datetime],
         end: Optional[datetime]
     ) -> str:
@@ -75,24 +139,16 @@ class OllamaClient:
         elif start:
             period = f"since {start.strftime('%Y-%m-%d %H:%M')}"
 
-        # Group anomalies by type
-        by_type = {}
-        for anomaly in anomalies:
-            atype = anomaly['anomaly_type']
-            if atype not in by_type:
-                by_type[atype] = []
-            by_type[atype].append(anomaly)
-
         anomaly_summary = "\n".join([
-            f"- {len(items)} anomalies detected using {atype} method"
-            for atype, items in by_type.items()
+            f"- {count} anomalies detected using {atype} method"
+            for atype, count in summary['by_type'].items()
         ])
 
         prompt = f"""Analyze the following traffic anomalies {period} and provide actionable insights:
 
 {anomaly_summary}
 
-Total anomalies detected: {len(anomalies)}
+Total anomalies detected: {summary['total']}
 
 Based on these anomalies, provide 3-5 bullet-point suggestions for traffic management. Focus on:
 1. Potential causes of the anomalies
@@ -104,7 +160,43 @@ Keep each bullet point concise (1-2 sentences).
 
         return prompt
 
-    async def _call_ollama(self, prompt: str) -> str:
+    async def _call_ollama(self, prompt: str, on_token: Optional[Callable[[str], None]] = None) -> str:
+        """Return the cached generation for the prompt, or call Ollama"""
+        key = cache_key(self.model, self.options, prompt)
+
+        cached = self.cache.get(key)
+        if cached is None:
+            # Share an in-progress generation of the same prompt
+            inflight = self._inflight.get(key)
+            if inflight is not None:
+                cached = await asyncio.shield(inflight)
+
+        if cached is not None:
+            if on_token is not None:
+                on_token(cached)
+            return cached
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+
+        try:
+            with timed('llm.generate'):
+                text = await self._generate(prompt, on_token)
+            self.cache.put(key, text)
+            future.set_result(text)
+            return text
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception retrieved when nobody else was waiting
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def _generate(self, prompt: str, on_token: Optional[Callable[[str], None]] = None) -> str:
         """Make API call to Ollama"""
 
         endpoint = f"{self.url}/api/generate"
@@ -112,36 +204,57 @@ Keep each bullet point concise (1-2 sentences).
         payload = {
             "model": self.model,
             "prompt": prompt,
-            "stream": False,
-            "options": {
-                "temperature": 0.7,
-                "top_p": 0.9
-            }
+            "stream": on_token is not None,
+            "options": self.options
         }
 
-        async with httpx.AsyncClient(timeout=self.timeout) as client:
-            response = await client.post(endpoint, json=payload)
+        if on_token is None:
+            response = await self._get_client().post(endpoint, json=payload)
             response.raise_for_status()
 
             result = response.json()
             return result.get('response', 'No suggestions generated')
 
+        # Streaming mode: one JSON object per line, each with the next token
+        parts = []
+        async with self._get_client().stream('POST', endpoint, json=payload) as response:
+            response.raise_for_status()
+
+            async for line in response.aiter_lines():
+                if not line.strip():
+                    continue
+
+                chunk = json.loads(line)
+                if chunk.get('error'):
+                    raise RuntimeError(chunk['error'])
+
+                token = chunk.get('response', '')
+                if token:
+                    parts.append(token)
+                    on_token(token)
+
+                if chunk.get('done'):
+                    break
+
+        return ''.join(parts) or 'No suggestions generated'
+
 
 class MockLLMClient:
     """Mock LLM client for testing"""
 
-    def __init__(self):
-        self.db = Database()
+    def __init__(self, db: Optional[Database] = None):
+        self.db = db or Database()
 
     async def generate_trend_suggestions(
         self,
-        anomalies: List[Dict[str, Any]],
+        summary: Dict[str, Any],
         start: Optional[datetime] = None,
-        end: Optional[datetime] = None
+        end: Optional[datetime] = None,
+        on_token: Optional[Callable[[str], None]] = None
     ) -> List[Dict[str, Any]]:
         """Generate mock trend suggestions"""
 
-        suggestions_text = f"""Based on the analysis of {len(anomalies)} traffic anomalies:
+        suggestions_text = f"""Based on the analysis of {summary['total']} traffic anomalies:
 
 • Unusual traffic patterns detected - consider investigating potential incidents or events
 • Speed variations suggest possible congestion or road conditions requiring attention
@@ -150,16 +263,18 @@ class MockLLMClient:
 • Review footage or sensor data for the affected time periods
 """
 
+        if on_token is not None:
+            on_token(suggestions_text)
+
         suggestion = {
             'time_period_start': start.isoformat() if start else None,
             'time_period_end': end.isoformat() if end else None,
             'suggestion_type': 'anomaly_summary',
             'confidence_level': 0.8,
             'description': suggestions_text,
-            'related_anomalies': [a['traffic_event_id'] for a in anomalies[:10]]
+            'related_anomalies': [a['traffic_event_id'] for a in summary['top'][:10]]
         }
 
-        suggestion_id = self.db.insert_trend_suggestion(suggestion)
-        suggestion['id'] = suggestion_id
+        await store_suggestion(self.db, suggestion)
 
         return [suggestion]
@@ -0,0 +1,282 @@
+import contextvars
+import cProfile
+import io
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Optional, List, Dict, Any, Tuple, Callable, Iterator
+
+# Histogram bucket upper bounds in seconds (plus +Inf)
+STAGE_BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300]
+
+PROFILERS = ['tracemalloc', 'cprofile']
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names: Tuple[str, ...], values: LabelValues, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(self.label_names, labels)} {value:g}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: List[float] = STAGE_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.buckets = buckets
+        self._values: Dict[LabelValues, Tuple[List[int], float, int]] = {}  # counts per bucket, sum, count
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        with self._lock:
+            counts, total, count = self._values.get(labels) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[labels] = (counts, total + value, count + 1)
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._values.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    le = 'le="%g"' % bound
+                    lines.append(f'{self.name}_bucket{_labels(self.label_names, labels, le)} {bucket_count}')
+                le = 'le="+Inf"'
+                lines.append(f'{self.name}_bucket{_labels(self.label_names, labels, le)} {count}')
+                lines.append(f'{self.name}_sum{_labels(self.label_names, labels)} {total:g}')
+                lines.append(f'{self.name}_count{_labels(self.label_names, labels)} {count}')
+        return lines
+
+
+class MetricsRegistry:
+    """Process-wide metrics rendered in the Prometheus text format
+
+    Pipeline stages are recorded as a duration histogram plus row and
+    error counters per stage. Collectors are callables returning
+    ``(name, type, help, [(labels dict, value), ...])`` tuples, evaluated
+    at render time for gauges read from other components (pool, jobs, ...).
+    """
+
+    def __init__(self, prefix: str = 'patternscope'):
+        self.prefix = prefix
+        self.stage_seconds = Histogram(f'{prefix}_stage_seconds', 'Time spent per pipeline stage', ('stage',))
+        self.stage_rows = Counter(f'{prefix}_stage_rows_total', 'Rows handled per pipeline stage', ('stage',))
+        self.stage_errors = Counter(f'{prefix}_stage_errors_total', 'Failed calls per pipeline stage', ('stage',))
+        self.metrics: List[Any] = [self.stage_seconds, self.stage_rows, self.stage_errors]
+        self._collectors: List[Callable[[], List[Tuple[str, str, str, List[Tuple[Dict[str, Any], float]]]]]] = []
+
+    def counter(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Counter:
+        metric = Counter(f'{self.prefix}_{name}', help, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: List[float] = STAGE_BUCKETS) -> Histogram:
+        metric = Histogram(f'{self.prefix}_{name}', help, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], List[Tuple[str, str, str, List[Tuple[Dict[str, Any], float]]]]]) -> None:
+        self._collectors.append(collector)
+
+    def observe_stage(self, stage: str, seconds: float, rows: int = 0, errors: int = 0) -> None:
+        """Record time, rows and errors of one stage"""
+        self.stage_seconds.observe(seconds, stage)
+        if rows:
+            self.stage_rows.inc(stage, amount=rows)
+        if errors:
+            self.stage_errors.inc(stage, amount=errors)
+
+    def observe_timings(self, timings: Dict[str, Any]) -> None:
+        """Record the stage summary of a run (see Timings.to_dict), e.g. from a worker process
+
+        A stage called several times in the run (one per chunk, say) is
+        observed once with its total time.
+        """
+        for stage, entry in timings.get('stages', {}).items():
+            self.observe_stage(stage, entry['seconds'], entry['rows'], entry['errors'])
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+
+        for collector in self._collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                print(f"Warning: metrics collector failed: {e}")
+                continue
+
+            for name, kind, help, samples in families:
+                full_name = f'{self.prefix}_{name}'
+                lines.append(f'# HELP {full_name} {help}')
+                lines.append(f'# TYPE {full_name} {kind}')
+                for labels, value in samples:
+                    label_text = _labels(tuple(labels), tuple(str(v) for v in labels.values()))
+                    lines.append(f'{full_name}{label_text} {float(value):g}')
+
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+class Stage:
+    """Handle yielded by timed(); set ``rows`` to count the rows handled"""
+
+    def __init__(self):
+        self.rows = 0
+
+
+class Timings:
+    """Per-run stage summary: total seconds, calls, rows and errors per stage"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float, rows: int, failed: bool) -> None:
+        with self._lock:
+            entry = self.stages.setdefault(stage, {'seconds': 0.0, 'calls': 0, 'rows': 0, 'errors': 0})
+            entry['seconds'] += seconds
+            entry['calls'] += 1
+            entry['rows'] += rows
+            entry['errors'] += int(failed)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'total_seconds': round(time.perf_counter() - self.started, 6),
+                'stages': {
+                    stage: {**entry, 'seconds': round(entry['seconds'], 6)}
+                    for stage, entry in self.stages.items()
+                }
+            }
+
+
+_current_timings: contextvars.ContextVar[Optional[Timings]] = contextvars.ContextVar('timings', default=None)
+
+
+@contextmanager
+def collect_timings() -> Iterator[Timings]:
+    """Collect the stages timed inside the block into a Timings summary
+
+    While a collection is active, stages are recorded only there; the
+    caller hands the summary to MetricsRegistry.observe_timings, possibly
+    in another process. Outside of one they go straight to the registry.
+    """
+    timings = Timings()
+    token = _current_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _current_timings.reset(token)
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[Stage]:
+    """Time a pipeline stage, counting rows and failures"""
+    handle = Stage()
+    started = time.perf_counter()
+    failed = False
+
+    try:
+        yield handle
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        timings = _current_timings.get()
+        if timings is not None:
+            timings.record(stage, seconds, handle.rows, failed)
+        else:
+            registry.observe_stage(stage, seconds, handle.rows, int(failed))
+
+
+@contextmanager
+def profiled(kind: Optional[str], limit: int = 25) -> Iterator[Dict[str, Any]]:
+    """Profile the block with tracemalloc or cProfile; the report is filled into the yielded dict"""
+    report: Dict[str, Any] = {}
+    if kind is None:
+        yield report
+        return
+    if kind not in PROFILERS:
+        raise ValueError(f'profile must be one of: {", ".join(PROFILERS)}')
+
+    report['profiler'] = kind
+
+    if kind == 'tracemalloc':
+        already_tracing = tracemalloc.is_tracing()
+        if not already_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        try:
+            yield report
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            if not already_tracing:
+                tracemalloc.stop()
+
+            report['current_bytes'] = current
+            report['peak_bytes'] = peak
+            report['top_allocations'] = [
+                {
+                    'location': f'{stat.traceback[0].filename}:{stat.traceback[0].lineno}',
+                    'size_bytes': stat.size,
+                    'count': stat.count
+                }
+                for stat in snapshot.statistics('lineno')[:limit]
+            ]
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield report
+    finally:
+        profiler.disable()
+        stats = pstats.Stats(profiler, stream=io.StringIO()).sort_stats('cumulative')
+
+        report['top_functions'] = [
+            {
+                'function': f'{filename}:{lineno}({name})',
+                'calls': primitive_calls,
+                'total_seconds': round(total_time, 6),
+                'cumulative_seconds': round(cumulative_time, 6)
+            }
+            for (filename, lineno, name), (primitive_calls, _, total_time, cumulative_time, _)
+            in sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+        ]
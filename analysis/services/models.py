@@ -0,0 +1,288 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional, List, Dict, Any, Callable, Tuple
+
+import joblib
+import numpy as np
+import sklearn
+
+from services.metrics import Timings
+
+logger = logging.getLogger(__name__)
+
+
+class CachedModel:
+    """A fitted model plus the metadata it was trained with"""
+
+    def __init__(self, model: Any, meta: Dict[str, Any]):
+        self.model = model
+        self.meta = meta
+
+    @property
+    def version(self) -> int:
+        return self.meta['version']
+
+
+class ModelRegistry:
+    """Fitted detector models cached per (kind, location_id, feature set)
+
+    Each key gets a directory under ``root`` holding numbered versions
+    (``v000001.joblib`` plus a ``.json`` metadata file); the newest
+    ``keep_versions`` are retained. Keys are evicted least-recently-used
+    once more than ``max_models`` exist on disk, and the most recently used
+    ``max_loaded`` models stay deserialized in memory.
+
+    Callers score against the cached model and use refit_reason() to decide
+    whether to refit in the background via schedule_refit(). A failed refit
+    is logged and counted in stats(); report_refits() hands finished refits
+    to a run's timings as the ``models.refit`` stage, so failures also
+    reach the metrics registry of the parent process.
+    """
+
+    def __init__(
+        self,
+        root: Optional[str] = None,
+        max_models: Optional[int] = None,
+        max_loaded: Optional[int] = None,
+        keep_versions: Optional[int] = None,
+        max_age_seconds: Optional[float] = None,
+        drift_threshold: Optional[float] = None
+    ):
+        self.root = root or os.getenv('MODEL_CACHE_DIR', 'model_cache')
+        self.max_models = max_models or int(os.getenv('MODEL_CACHE_MAX_MODELS', '256'))
+        self.max_loaded = max_loaded or int(os.getenv('MODEL_CACHE_MAX_LOADED', '32'))
+        self.keep_versions = keep_versions or int(os.getenv('MODEL_CACHE_KEEP_VERSIONS', '3'))
+        self.max_age_seconds = max_age_seconds or float(os.getenv('MODEL_MAX_AGE_SECONDS', '86400'))
+        self.drift_threshold = drift_threshold or float(os.getenv('MODEL_DRIFT_THRESHOLD', '0.5'))
+
+        self._loaded: 'OrderedDict[str, CachedModel]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._refitting = set()
+        self._refit_executor = ThreadPoolExecutor(max_workers=1)
+        # (seconds, rows, failed) of refits finished since the last report_refits()
+        self._finished_refits: List[Tuple[float, int, bool]] = []
+        self._stats = {'refits': 0, 'refit_failures': 0, 'last_refit_error': None}
+
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def key(kind: str, location_id: Optional[int], features: List[str]) -> str:
+        location = 'all' if location_id is None else str(int(location_id))
+        feature_hash = hashlib.sha1(','.join(features).encode()).hexdigest()[:12]
+        return f'{kind}-loc{location}-{feature_hash}'
+
+    def _versions(self, key: str) -> List[int]:
+        directory = os.path.join(self.root, key)
+        if not os.path.isdir(directory):
+            return []
+
+        return sorted(
+            int(name[1:-5]) for name in os.listdir(directory)
+            if name.startswith('v') and name.endswith('.json')
+        )
+
+    def get(self, kind: str, location_id: Optional[int], features: List[str]) -> Optional[CachedModel]:
+        """Latest cached model for the key, or None"""
+        key = self.key(kind, location_id, features)
+
+        with self._lock:
+            cached = self._loaded.get(key)
+            if cached is not None:
+                self._loaded.move_to_end(key)
+
+        if cached is None:
+            cached = self._load(key)
+            if cached is None:
+                return None
+
+        self._touch(key)
+        return cached
+
+    def _load(self, key: str) -> Optional[CachedModel]:
+        versions = self._versions(key)
+        if not versions:
+            return None
+
+        path = os.path.join(self.root, key, f'v{versions[-1]:06d}')
+        try:
+            with open(path + '.json') as f:
+                meta = json.load(f)
+
+            # Pickled estimators are only safe to reuse with the same scikit-learn
+            if meta.get('sklearn_version') != sklearn.__version__:
+                return None
+
+            cached = CachedModel(joblib.load(path + '.joblib'), meta)
+        except (OSError, ValueError, EOFError):
+            return None
+
+        self._remember(key, cached)
+        return cached
+
+    def _remember(self, key: str, cached: CachedModel) -> None:
+        with self._lock:
+            self._loaded[key] = cached
+            self._loaded.move_to_end(key)
+            while len(self._loaded) > self.max_loaded:
+                self._loaded.popitem(last=False)
+
+    def _touch(self, key: str) -> None:
+        try:
+            os.utime(os.path.join(self.root, key))
+        except OSError:
+            pass
+
+    def put(
+        self,
+        kind: str,
+        location_id: Optional[int],
+        features: List[str],
+        model: Any,
+        X: np.ndarray
+    ) -> CachedModel:
+        """Store a newly fitted model as the next version of its key"""
+        key = self.key(kind, location_id, features)
+        directory = os.path.join(self.root, key)
+        os.makedirs(directory, exist_ok=True)
+
+        versions = self._versions(key)
+        version = versions[-1] + 1 if versions else 1
+
+        meta = {
+            'version': version,
+            'kind': kind,
+            'location_id': None if location_id is None else int(location_id),
+            'features': features,
+            'trained_at': time.time(),
+            'n_samples': int(len(X)),
+            'feature_means': np.nanmean(X, axis=0).tolist(),
+            'feature_stds': np.nanstd(X, axis=0).tolist(),
+            'sklearn_version': sklearn.__version__
+        }
+
+        # Write under temporary names and rename, so readers never see partial files
+        path = os.path.join(directory, f'v{version:06d}')
+        tmp = os.path.join(directory, f'.tmp-{uuid.uuid4().hex}')
+        joblib.dump(model, tmp + '.joblib')
+        with open(tmp + '.json', 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp + '.joblib', path + '.joblib')
+        os.replace(tmp + '.json', path + '.json')
+
+        cached = CachedModel(model, meta)
+        self._remember(key, cached)
+        self._prune(key)
+        return cached
+
+    def _prune(self, key: str) -> None:
+        # Old versions of this key
+        for version in self._versions(key)[:-self.keep_versions]:
+            for suffix in ('.joblib', '.json'):
+                try:
+                    os.remove(os.path.join(self.root, key, f'v{version:06d}{suffix}'))
+                except OSError:
+                    pass
+
+        # Least recently used keys beyond the cache size
+        keys = [
+            name for name in os.listdir(self.root)
+            if os.path.isdir(os.path.join(self.root, name))
+        ]
+        if len(keys) <= self.max_models:
+            return
+
+        keys.sort(key=lambda name: os.path.getmtime(os.path.join(self.root, name)))
+        for name in keys[:len(keys) - self.max_models]:
+            shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+            with self._lock:
+                self._loaded.pop(name, None)
+
+    def refit_reason(self, cached: CachedModel, X: np.ndarray) -> Optional[str]:
+        """Why a cached model should be refitted on ``X`` ('stale', 'drift') or None"""
+        if time.time() - cached.meta['trained_at'] > self.max_age_seconds:
+            return 'stale'
+
+        means = np.asarray(cached.meta['feature_means'])
+        stds = np.asarray(cached.meta['feature_stds'])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            shift = np.abs(np.nanmean(X, axis=0) - means) / np.where(stds > 0, stds, np.nan)
+
+        if np.nanmax(shift, initial=0.0) > self.drift_threshold:
+            return 'drift'
+
+        return None
+
+    def schedule_refit(
+        self,
+        kind: str,
+        location_id: Optional[int],
+        features: List[str],
+        X: np.ndarray,
+        fit: Callable[[np.ndarray], Any]
+    ) -> bool:
+        """Refit in the background unless a refit for the key is already queued"""
+        key = self.key(kind, location_id, features)
+
+        with self._lock:
+            if key in self._refitting:
+                return False
+            self._refitting.add(key)
+
+        def refit() -> float:
+            started = time.perf_counter()
+            try:
+                self.put(kind, location_id, features, fit(X), X)
+                return time.perf_counter() - started
+            except Exception as e:
+                e.seconds = time.perf_counter() - started
+                raise
+            finally:
+                with self._lock:
+                    self._refitting.discard(key)
+
+        future = self._refit_executor.submit(refit)
+        future.add_done_callback(lambda future: self._refit_done(key, len(X), future))
+        return True
+
+    def _refit_done(self, key: str, rows: int, future: Future) -> None:
+        if future.cancelled():
+            return
+
+        error = future.exception()
+        seconds = future.result() if error is None else getattr(error, 'seconds', 0.0)
+
+        with self._lock:
+            self._finished_refits.append((seconds, rows, error is not None))
+            self._stats['refits'] += 1
+            if error is not None:
+                self._stats['refit_failures'] += 1
+                self._stats['last_refit_error'] = f'{key}: {error}'
+
+        if error is not None:
+            # The previous version keeps being served until a refit succeeds
+            logger.error('Model refit failed for %s', key, exc_info=error)
+
+    def report_refits(self, timings: Timings) -> None:
+        """Record the refits finished since the last call as ``models.refit`` stages of ``timings``"""
+        with self._lock:
+            finished, self._finished_refits = self._finished_refits, []
+
+        for seconds, rows, failed in finished:
+            timings.record('models.refit', seconds, rows, failed)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'root': self.root,
+                'loaded': len(self._loaded),
+                'refitting': len(self._refitting),
+                **self._stats
+            }
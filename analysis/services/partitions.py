@@ -0,0 +1,88 @@
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Optional, List, Dict, Any
+
+from services.db import Database
+
+
+class PartitionMaintainer:
+    """Keep the daily traffic_events partitions ahead of ingest
+
+    A background thread creates the partitions for today (UTC) and the
+    next TRAFFIC_PARTITION_DAYS_AHEAD days every ``interval`` seconds, so
+    live events never land in the default partition, and gives any events
+    that did land there a partition of their own. With
+    TRAFFIC_RETENTION_DAYS set, partitions older than that are dropped;
+    their hourly rollups stay behind for the dashboards.
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+        self.days_ahead = int(os.getenv('TRAFFIC_PARTITION_DAYS_AHEAD', '7'))
+        self.retention_days = int(os.getenv('TRAFFIC_RETENTION_DAYS', '0'))
+        self.interval = float(os.getenv('TRAFFIC_PARTITION_INTERVAL_SECONDS', '3600'))
+
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+        self._stats = {
+            'runs': 0,
+            'errors': 0,
+            'last_error': None,
+            'last_run_at': None,
+            'created': [],
+            'dropped': []
+        }
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='partition-maintainer', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.maintain()
+            except Exception as e:
+                self._stats['errors'] += 1
+                self._stats['last_error'] = str(e)
+                print(f"Partition maintenance error: {e}")
+            self._stop.wait(self.interval)
+
+    def maintain(self) -> Dict[str, List[str]]:
+        """Create upcoming partitions and drop expired ones; returns the partitions touched"""
+        today = datetime.now(timezone.utc).date()
+
+        created = self.db.ensure_traffic_events_partitions(today, today + timedelta(days=self.days_ahead))
+        # Late or historical events that arrived before their day had a partition
+        for day in self.db.fetch_default_partition_days():
+            created += self.db.ensure_traffic_events_partitions(day, day)
+
+        dropped = []
+        if self.retention_days > 0:
+            dropped = self.db.drop_traffic_events_partitions(today - timedelta(days=self.retention_days))
+
+        self._stats['runs'] += 1
+        self._stats['last_run_at'] = datetime.now(timezone.utc).isoformat()
+        # Only the most recent changes are kept for the stats endpoint
+        self._stats['created'] = (self._stats['created'] + created)[-30:]
+        self._stats['dropped'] = (self._stats['dropped'] + dropped)[-30:]
+
+        return {'created': created, 'dropped': dropped}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'running': self._thread is not None and self._thread.is_alive(),
+            'days_ahead': self.days_ahead,
+            'retention_days': self.retention_days,
+            **self._stats
+        }
@@ -0,0 +1,262 @@
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, Iterator
+
+import psycopg2
+import psycopg2.extensions
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no connection became available within the pool timeout"""
+
+
+class ConnectionPool:
+    """Thread-safe PostgreSQL connection pool
+
+    Connections are opened lazily up to ``max_size`` and kept open between
+    uses. A connection that sat idle longer than ``health_check_interval``
+    seconds is pinged before being handed out; connections that fail the
+    ping or raise a connection-level error while in use are discarded and
+    replaced. Checkout blocks for up to ``timeout`` seconds when the pool is
+    exhausted.
+    """
+
+    def __init__(
+        self,
+        connection_params: Dict[str, Any],
+        min_size: int = 1,
+        max_size: int = 10,
+        timeout: float = 30.0,
+        health_check_interval: float = 30.0,
+        connect_retries: int = 3
+    ):
+        self.connection_params = connection_params
+        self.min_size = min_size
+        self.max_size = max(max_size, min_size, 1)
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.connect_retries = connect_retries
+
+        self._idle = deque()  # (connection, returned_at)
+        self._size = 0
+        self._cond = threading.Condition()
+        self._closed = False
+
+        self._stats = {
+            'checkouts': 0,
+            'waits': 0,
+            'wait_seconds': 0.0,
+            'timeouts': 0,
+            'connects': 0,
+            'connect_failures': 0,
+            'health_check_failures': 0,
+            'discarded': 0
+        }
+
+    def warm(self) -> None:
+        """Open connections until the pool holds ``min_size``"""
+        while True:
+            with self._cond:
+                if self._closed or self._size >= self.min_size:
+                    return
+                self._size += 1
+
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+
+    def _connect(self):
+        delay = 0.5
+        for attempt in range(self.connect_retries):
+            try:
+                conn = psycopg2.connect(**self.connection_params)
+                with self._cond:
+                    self._stats['connects'] += 1
+                return conn
+            except psycopg2.OperationalError:
+                with self._cond:
+                    self._stats['connect_failures'] += 1
+                if attempt == self.connect_retries - 1:
+                    raise
+                time.sleep(delay)
+                delay *= 2
+
+    def _is_healthy(self, conn) -> bool:
+        if conn.closed:
+            return False
+
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        """Check out a connection, opening or replacing one if necessary"""
+        deadline = time.monotonic() + self.timeout
+        waited = False
+        wait_started = time.monotonic()
+
+        while True:
+            with self._cond:
+                while not self._idle and self._size >= self.max_size:
+                    if self._closed:
+                        raise PoolTimeoutError('Connection pool is closed')
+
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['timeouts'] += 1
+                        raise PoolTimeoutError(
+                            f'No database connection available within {self.timeout}s '
+                            f'(pool max size {self.max_size})'
+                        )
+
+                    waited = True
+                    self._cond.wait(remaining)
+
+                if waited:
+                    self._stats['waits'] += 1
+                    self._stats['wait_seconds'] += time.monotonic() - wait_started
+                    waited = False
+
+                if self._idle:
+                    conn, returned_at = self._idle.pop()
+                    needs_check = time.monotonic() - returned_at > self.health_check_interval
+                else:
+                    conn = None
+                    self._size += 1
+
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            elif (needs_check or conn.closed) and not self._is_healthy(conn):
+                with self._cond:
+                    self._stats['health_check_failures'] += 1
+                self._discard(conn)
+                continue
+
+            with self._cond:
+                self._stats['checkouts'] += 1
+            return conn
+
+    def putconn(self, conn, discard: bool = False) -> None:
+        """Return a connection; broken or discarded connections are closed"""
+        if not discard and not conn.closed:
+            try:
+                # Never hand out a connection with an open transaction
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+
+        if discard or conn.closed or self._closed:
+            self._discard(conn)
+            return
+
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def _discard(self, conn) -> None:
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+        with self._cond:
+            self._size -= 1
+            self._stats['discarded'] += 1
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        """Check out a connection for the duration of a ``with`` block
+
+        Uncommitted work is rolled back when the block exits. Connections
+        that hit a connection-level error are dropped so the next checkout
+        reconnects.
+        """
+        conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self.putconn(conn, discard=broken or bool(conn.closed))
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool utilization counters"""
+        with self._cond:
+            idle = len(self._idle)
+            return {
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'size': self._size,
+                'in_use': self._size - idle,
+                'idle': idle,
+                'utilization': (self._size - idle) / self.max_size,
+                **self._stats
+            }
+
+    def close(self) -> None:
+        """Close idle connections and refuse new checkouts"""
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+
+        for conn, _ in idle:
+            try:
+                conn.close()
+            except psycopg2.Error:
+                pass
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_pid: Optional[int] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(connection_params: Dict[str, Any]) -> ConnectionPool:
+    """Return the process-wide pool, creating it on first use
+
+    Connections cannot be shared across fork(), so a child process gets its
+    own pool instead of inheriting the parent's sockets.
+    """
+    global _pool, _pool_pid
+
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ConnectionPool(
+                connection_params,
+                min_size=int(os.getenv('DB_POOL_MIN_SIZE', '1')),
+                max_size=int(os.getenv('DB_POOL_MAX_SIZE', '10')),
+                timeout=float(os.getenv('DB_POOL_TIMEOUT', '30')),
+                health_check_interval=float(os.getenv('DB_POOL_HEALTH_CHECK_INTERVAL', '30')),
+                connect_retries=int(os.getenv('DB_CONNECT_RETRIES', '3'))
+            )
+            _pool_pid = os.getpid()
+
+        return _pool
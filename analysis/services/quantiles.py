@@ -0,0 +1,162 @@
+import os
+import numpy as np
+from typing import Optional, List, Dict, Any, Tuple
+
+from services.db import Database, ConcurrentRunError
+from services.sketches import QuantileSketch
+
+# Watermark of the last traffic event folded into the metric sketches
+QUANTILE_STATE = 'quantiles'
+
+
+class QuantileStore:
+    """Per-(location, metric) quantile sketches backed by metric_sketches
+
+    Used by the IQR detector instead of sorting the window column on every
+    run. refresh() folds traffic events past the watermark into the
+    stored sketches, so maintenance cost is proportional to new data, and
+    quartile lookups only read the stored q1/q3 columns. At most
+    IQR_REFRESH_MAX_CHUNKS chunks are folded per call, so a large backlog
+    (e.g. the first run after deploy) is worked off over several runs
+    while detection uses the last persisted sketches. Sketches with the
+    same ``k`` merge losslessly, so partial sketches built on different
+    workers or shards can be combined with merge().
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+        self.min_count = int(os.getenv('IQR_MIN_COUNT', '30'))
+        self.sketch_k = int(os.getenv('IQR_SKETCH_K', '200'))
+        self.max_chunks = int(os.getenv('IQR_REFRESH_MAX_CHUNKS', '20'))
+        self._table: Optional[Dict[str, Dict[int, Tuple[int, float, float]]]] = None
+        self._table_watermark: Optional[int] = None
+
+    def ensure_current(self) -> None:
+        """Reload the quartiles if any process refreshed the sketches since they were loaded"""
+        watermark = self.db.get_watermark(QUANTILE_STATE)
+        if self._table is None or watermark != self._table_watermark:
+            self.load()
+            self._table_watermark = watermark
+
+    def load(self) -> None:
+        """(Re)load the stored quartiles per metric and location"""
+        table: Dict[str, Dict[int, Tuple[int, float, float]]] = {}
+        for location_id, metric, count, q1, q3, _ in self.db.fetch_metric_sketches(include_sketches=False):
+            table.setdefault(metric, {})[location_id] = (count, q1, q3)
+        self._table = table
+
+    def quartiles(self, metric: str, location_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(Q1, Q3) arrays aligned with ``location_ids``
+
+        NaN where the location has fewer than IQR_MIN_COUNT sketched values.
+        """
+        if self._table is None:
+            self.load()
+
+        location_ids = np.asarray(location_ids, dtype=np.int64)
+        q1 = np.full(len(location_ids), np.nan)
+        q3 = np.full(len(location_ids), np.nan)
+
+        unique_locations, inverse = np.unique(location_ids, return_inverse=True)
+        per_location = self._table.get(metric, {})
+
+        for i, location_id in enumerate(unique_locations.tolist()):
+            entry = per_location.get(location_id)
+            if entry is None or entry[0] < self.min_count:
+                continue
+            rows = inverse == i
+            q1[rows], q3[rows] = entry[1], entry[2]
+
+        return q1, q3
+
+    def build(self, chunk: Dict[str, np.ndarray], metrics: List[str]) -> Dict[Tuple[int, str], QuantileSketch]:
+        """Sketch one chunk of events per (location_id, metric)"""
+        sketches = {}
+        locations = chunk['location_id']
+
+        # Sort once, then slice each location's contiguous run
+        order = np.argsort(locations, kind='stable')
+        unique_locations, starts = np.unique(locations[order], return_index=True)
+        ends = np.append(starts[1:], len(order))
+
+        for metric in metrics:
+            values = chunk[metric][order]
+            for location_id, lo, hi in zip(unique_locations.tolist(), starts, ends):
+                sketch = QuantileSketch(self.sketch_k)
+                sketch.update(values[lo:hi])
+                sketches[(location_id, metric)] = sketch
+
+        return sketches
+
+    @staticmethod
+    def merge(
+        target: Dict[Tuple[int, str], QuantileSketch],
+        other: Dict[Tuple[int, str], QuantileSketch]
+    ) -> Dict[Tuple[int, str], QuantileSketch]:
+        """Fold ``other`` into ``target`` key by key"""
+        for key, sketch in other.items():
+            if key in target:
+                target[key].merge(sketch)
+            else:
+                target[key] = sketch
+        return target
+
+    def refresh(self, metrics: List[str], chunk_size: int = 50000) -> Dict[str, Any]:
+        """Fold traffic events past the watermark into the stored sketches
+
+        Events are folded in id order, at most ``max_chunks`` chunks per
+        call (0 = no limit); the watermark advances to the last event
+        folded and ``behind`` tells whether more events are waiting. Only
+        events up to the settled id are folded (see
+        Database.fetch_settled_event_id), so none committed late is skipped.
+        """
+        watermark = self.db.get_watermark(QUANTILE_STATE)
+        settled = self.db.fetch_settled_event_id()
+
+        new: Dict[Tuple[int, str], QuantileSketch] = {}
+        last_event_id = watermark
+        events_folded = 0
+        behind = False
+
+        chunks = self.db.iter_traffic_events(metrics, chunk_size=chunk_size, after_id=watermark, until_id=settled)
+        try:
+            for i, chunk in enumerate(chunks):
+                if self.max_chunks and i >= self.max_chunks:
+                    behind = True
+                    break
+                self.merge(new, self.build(chunk, metrics))
+                events_folded += len(chunk['id'])
+                last_event_id = int(chunk['id'][-1])
+        finally:
+            chunks.close()
+
+        if events_folded == 0:
+            return {'events_folded': 0, 'sketches_updated': 0, 'watermark': watermark, 'behind': False}
+
+        # Merge into the stored sketches of the touched locations; others are not read or rewritten
+        locations = sorted({location_id for location_id, _ in new})
+        stored = {
+            (location_id, metric): QuantileSketch.from_bytes(sketch)
+            for location_id, metric, _, _, _, sketch in self.db.fetch_metric_sketches(location_ids=locations)
+            if sketch and (location_id, metric) in new
+        }
+        self.merge(stored, new)
+
+        rows = [
+            (location_id, metric, sketch.count, sketch.quantile(0.25), sketch.quantile(0.75), sketch.to_bytes())
+            for (location_id, metric), sketch in stored.items()
+        ]
+
+        try:
+            self.db.commit_metric_sketches(QUANTILE_STATE, watermark, last_event_id, rows)
+        except ConcurrentRunError:
+            # Another run folded the same events; its sketches are current
+            return {'events_folded': 0, 'sketches_updated': 0, 'watermark': watermark, 'skipped': True, 'behind': True}
+
+        self._table = None
+        return {
+            'events_folded': events_folded,
+            'sketches_updated': len(rows),
+            'watermark': last_event_id,
+            'behind': behind
+        }
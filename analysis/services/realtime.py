@@ -0,0 +1,263 @@
+import os
+import select
+import threading
+import time
+from typing import Optional, List, Dict, Any, Tuple
+
+import numpy as np
+import psycopg2
+import psycopg2.extensions
+
+from services.anomalies import AnomalyBatch
+from services.db import Database, ConcurrentRunError
+
+# Channel the traffic_events trigger notifies (see 007_traffic_events_notify.sql)
+NOTIFY_CHANNEL = 'traffic_events'
+
+# Watermark of the last traffic event scored by the realtime consumer
+REALTIME_STATE = 'realtime'
+
+
+class OnlineScorer:
+    """Per-(location, metric) exponentially weighted mean and variance
+
+    Each event is scored against the state *before* it is folded in, so a
+    spike is compared with the recent history of its own location. The
+    state is O(1) per (location, metric) and updating it is O(1) per value.
+    """
+
+    def __init__(self, metrics: List[str], alpha: float, threshold: float, warmup: int):
+        self.metrics = metrics
+        self.alpha = alpha
+        self.threshold = threshold
+        self.warmup = warmup
+        # (location_id, metric) -> [count, mean, variance]
+        self.state: Dict[Tuple[int, str], List[float]] = {}
+
+    def score(self, chunk: Dict[str, np.ndarray], score_after_id: int = 0) -> AnomalyBatch:
+        """Fold a chunk into the state, flagging events with id > ``score_after_id``
+
+        Events at or below ``score_after_id`` only warm up the state.
+        """
+        event_ids = chunk['id']
+        locations = chunk['location_id'].tolist()
+        scored = event_ids > score_after_id
+        alpha = self.alpha
+
+        batches = []
+        for metric in self.metrics:
+            values = chunk[metric]
+            n = len(values)
+            means = np.full(n, np.nan)
+            stds = np.full(n, np.nan)
+
+            for i, (location_id, value) in enumerate(zip(locations, values.tolist())):
+                if value != value:  # NaN
+                    continue
+
+                state = self.state.get((location_id, metric))
+                if state is None:
+                    self.state[(location_id, metric)] = [1, value, 0.0]
+                    continue
+
+                count, mean, variance = state
+                if count >= self.warmup and variance > 0:
+                    std = variance ** 0.5
+                    means[i] = mean
+                    stds[i] = std
+                    # Fold outliers in clipped to the band, so one spike does
+                    # not inflate the variance and mask the next
+                    value = min(max(value, mean - self.threshold * std), mean + self.threshold * std)
+
+                # Incremental EWMA mean / variance update
+                diff = value - mean
+                increment = alpha * diff
+                state[0] = count + 1
+                state[1] = mean + increment
+                state[2] = (1 - alpha) * (variance + diff * increment)
+
+            with np.errstate(invalid='ignore'):
+                z_scores = np.abs(values - means) / stds
+                anomaly_mask = scored & (z_scores > self.threshold)
+
+            if anomaly_mask.any():
+                batches.append(AnomalyBatch.from_mask(
+                    event_ids, anomaly_mask, 'ewma',
+                    np.minimum(z_scores / (2 * self.threshold), 1.0), metric,
+                    values=values, scores=z_scores,
+                    lower=means - self.threshold * stds, upper=means + self.threshold * stds
+                ))
+
+        return AnomalyBatch.concat(batches).deduplicate()
+
+
+class RealtimeConsumer:
+    """Score traffic events as they are ingested
+
+    A background thread LISTENs on the traffic_events channel, and on each
+    notification (or every ``poll_interval`` seconds, in case one was
+    missed) reads the events past its watermark, scores them with an
+    OnlineScorer and commits the anomalies together with the new watermark.
+    The watermark compare-and-swap means several service instances can run
+    consumers without writing the same events twice.
+
+    On start the scorer is warmed on the ``warmup_events`` events before
+    the watermark; with no watermark yet, scoring starts at the newest
+    event rather than replaying the whole table.
+    """
+
+    def __init__(self, db: Database, metrics: List[str]):
+        self.db = db
+        self.batch_size = int(os.getenv('REALTIME_BATCH_SIZE', '5000'))
+        self.poll_interval = float(os.getenv('REALTIME_POLL_INTERVAL', '5'))
+        self.warmup_events = int(os.getenv('REALTIME_WARMUP_EVENTS', '10000'))
+        self.scorer = OnlineScorer(
+            metrics,
+            alpha=float(os.getenv('REALTIME_EWMA_ALPHA', '0.05')),
+            threshold=float(os.getenv('REALTIME_ZSCORE_THRESHOLD', '4.0')),
+            warmup=int(os.getenv('REALTIME_MIN_COUNT', '20'))
+        )
+
+        self.watermark: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+        self._stats = {
+            'notifications': 0,
+            'batches': 0,
+            'events_scored': 0,
+            'anomalies_detected': 0,
+            'conflicts': 0,
+            'errors': 0,
+            'last_error': None,
+            'last_batch_ms': None,
+            'max_batch_ms': 0.0,
+            'last_event_lag_seconds': None
+        }
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='realtime-consumer', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _listen(self):
+        # LISTEN needs a dedicated session, so this connection is not pooled
+        conn = psycopg2.connect(**self.db.connection_params)
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        conn.cursor().execute(f'LISTEN {NOTIFY_CHANNEL}')
+        return conn
+
+    def _run(self) -> None:
+        delay = 1.0
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = self._listen()
+                if self.watermark is None:
+                    self._warm_up()
+                self.process()
+                delay = 1.0
+
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], self.poll_interval) != ([], [], []):
+                        conn.poll()
+                        self._stats['notifications'] += len(conn.notifies)
+                        conn.notifies.clear()
+                    self.process()
+
+            except Exception as e:
+                self._stats['errors'] += 1
+                self._stats['last_error'] = str(e)
+                print(f"Realtime consumer error, retrying in {delay:.0f}s: {e}")
+                self._stop.wait(delay)
+                delay = min(delay * 2, 60.0)
+
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def _warm_up(self) -> None:
+        watermark = self.db.get_watermark(REALTIME_STATE)
+
+        if watermark == 0:
+            # First start: begin at the newest event instead of replaying history
+            newest = self.db.fetch_settled_event_id()
+            if newest > 0:
+                try:
+                    self.db.commit_incremental_run(REALTIME_STATE, 0, newest, {}, AnomalyBatch.empty())
+                except ConcurrentRunError:
+                    pass
+                watermark = self.db.get_watermark(REALTIME_STATE)
+
+        for chunk in self.db.iter_traffic_events(
+            self.scorer.metrics, chunk_size=self.batch_size,
+            after_id=max(watermark - self.warmup_events, 0)
+        ):
+            mask = chunk['id'] <= watermark
+            if not mask.any():
+                break
+            self.scorer.score({name: column[mask] for name, column in chunk.items()}, watermark)
+
+        self.watermark = watermark
+
+    def process(self) -> int:
+        """Score and store everything past the watermark; returns events scored
+
+        Only events up to the settled id are read (see
+        Database.fetch_settled_event_id), so an event whose transaction
+        commits after a higher id was scored is not skipped.
+        """
+        scored = 0
+
+        while True:
+            conflict = False
+            settled = self.db.fetch_settled_event_id()
+            started = time.perf_counter()
+
+            # One chunk per commit keeps each transaction (and its latency) bounded
+            for chunk in self.db.iter_traffic_events(
+                self.scorer.metrics, chunk_size=self.batch_size, after_id=self.watermark, until_id=settled
+            ):
+                previous = self.watermark
+                last_event_id = int(chunk['id'][-1])
+                anomalies = self.scorer.score(chunk, previous)
+
+                try:
+                    self.db.commit_incremental_run(REALTIME_STATE, previous, last_event_id, {}, anomalies)
+                except ConcurrentRunError:
+                    # Another consumer stored these events; continue from its watermark
+                    self._stats['conflicts'] += 1
+                    self.watermark = self.db.get_watermark(REALTIME_STATE)
+                    conflict = True
+                    break
+
+                self.watermark = last_event_id
+                scored += len(chunk['id'])
+
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                started = time.perf_counter()
+                self._stats['batches'] += 1
+                self._stats['events_scored'] += len(chunk['id'])
+                self._stats['anomalies_detected'] += len(anomalies)
+                self._stats['last_batch_ms'] = round(elapsed_ms, 2)
+                self._stats['max_batch_ms'] = round(max(self._stats['max_batch_ms'], elapsed_ms), 2)
+                self._stats['last_event_lag_seconds'] = round(time.time() - float(chunk['timestamp'][-1]), 3)
+
+            if not conflict:
+                return scored
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'running': self._thread is not None and self._thread.is_alive(),
+            'watermark': self.watermark,
+            'tracked_series': len(self.scorer.state),
+            **self._stats
+        }
@@ -0,0 +1,58 @@
+import os
+from typing import Optional, Dict, Any
+
+from services.cache import TTLCache, cache_key
+from services.db import Database
+
+
+class AnalysisResultCache:
+    """Results of recent /run-analysis windows, keyed by the data they saw
+
+    The key covers the window, the methods and the run mode plus a cheap
+    data version of the window (see Database.fetch_window_version: the
+    highest event id for open-ended windows, the hourly rollup counts for
+    bounded ones), so an event landing in the window changes the key and
+    the stale result is never served again; it simply ages out. Events
+    dropped with expired partitions keep their rollups and do not change
+    it. The TTL bounds how long a result may outlive that and the global
+    baselines and models it was scored against.
+
+    Incremental runs consume a checkpoint and profiled or timed runs
+    measure the run itself, so those are never cached.
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+        self.enabled = os.getenv('ANALYSIS_CACHE_ENABLED', 'true').lower() == 'true'
+        self.cache = TTLCache(
+            max_entries=int(os.getenv('ANALYSIS_CACHE_MAX_ENTRIES', '32')),
+            ttl_seconds=float(os.getenv('ANALYSIS_CACHE_TTL_SECONDS', '300'))
+        )
+
+    def cacheable(self, params: Dict[str, Any]) -> bool:
+        return (
+            self.enabled
+            and not params['incremental']
+            and not params['timings']
+            and params['profile'] is None
+        )
+
+    def key(self, params: Dict[str, Any]) -> str:
+        """Cache key of a run over the window's current data (queries the database)"""
+        start = params['start'].isoformat() if params['start'] else None
+        end = params['end'].isoformat() if params['end'] else None
+        version = self.db.fetch_window_version(start, end)
+
+        return cache_key(
+            'analysis', start, end, sorted(set(params['methods'])),
+            params['streaming'], params['partition_by'], params['details'], version
+        )
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self.cache.get(key)
+
+    def put(self, key: str, result: Dict[str, Any]) -> None:
+        self.cache.put(key, result)
+
+    def stats(self) -> Dict[str, Any]:
+        return {'enabled': self.enabled, **self.cache.stats()}
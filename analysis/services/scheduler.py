@@ -0,0 +1,220 @@
+import asyncio
+import math
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Optional, List, Dict, Any, Tuple
+
+from services.db import Database
+from services.jobs import JobManager, JobQueueFullError
+
+Window = Tuple[datetime, datetime]
+
+
+class WindowScheduler:
+    """Run analysis over fixed windows on a cadence and catch up missed ones
+
+    Windows are ANALYSIS_WINDOW_SECONDS long and start every
+    ANALYSIS_WINDOW_STEP_SECONDS (aligned to the Unix epoch, UTC): tumbling
+    when the two are equal, sliding when the step is shorter. A window is
+    due once it ended ANALYSIS_WINDOW_DELAY_SECONDS ago, leaving time for
+    late events. Every ``interval`` seconds all due windows since
+    ANALYSIS_SCHEDULER_START (or the last ANALYSIS_SCHEDULER_LOOKBACK_SECONDS)
+    that are not recorded as done in analysis_windows are scheduled as
+    tasks that claim them and submit them to the job manager, at most
+    ``concurrency`` at a time across ticks and oldest first, so a backlog
+    after an outage is worked off in parallel without re-analyzing finished
+    windows. A tick does not wait for its windows, so new windows keep
+    being picked up while a backlog runs.
+    """
+
+    def __init__(self, db: Database, job_manager: JobManager):
+        self.db = db
+        self.job_manager = job_manager
+        self.name = os.getenv('ANALYSIS_SCHEDULE_NAME', 'default')
+        self.window = timedelta(seconds=float(os.getenv('ANALYSIS_WINDOW_SECONDS', '3600')))
+        self.step = timedelta(seconds=float(os.getenv('ANALYSIS_WINDOW_STEP_SECONDS', '0')) or self.window.total_seconds())
+        self.delay = timedelta(seconds=float(os.getenv('ANALYSIS_WINDOW_DELAY_SECONDS', '60')))
+        self.methods = [
+            method.strip()
+            for method in os.getenv('ANALYSIS_WINDOW_METHODS', 'zscore,iqr,isolation_forest').split(',')
+            if method.strip()
+        ]
+        self.lookback = timedelta(seconds=float(os.getenv('ANALYSIS_SCHEDULER_LOOKBACK_SECONDS', '86400')))
+        start = os.getenv('ANALYSIS_SCHEDULER_START')
+        self.start_at = datetime.fromisoformat(start) if start else None
+        if self.start_at is not None and self.start_at.tzinfo is None:
+            self.start_at = self.start_at.replace(tzinfo=timezone.utc)
+        self.concurrency = int(os.getenv('ANALYSIS_SCHEDULER_CONCURRENCY', '2'))
+        self.interval = float(os.getenv('ANALYSIS_SCHEDULER_INTERVAL_SECONDS', '60'))
+        self.max_attempts = int(os.getenv('ANALYSIS_SCHEDULER_MAX_ATTEMPTS', '3'))
+        self.claim_timeout = float(os.getenv('ANALYSIS_SCHEDULER_CLAIM_TIMEOUT_SECONDS', '3600'))
+
+        if self.window.total_seconds() <= 0 or self.step.total_seconds() <= 0:
+            raise ValueError('ANALYSIS_WINDOW_SECONDS and ANALYSIS_WINDOW_STEP_SECONDS must be positive')
+
+        self._task: Optional[asyncio.Task] = None
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._windows: Dict[Window, asyncio.Task] = {}  # scheduled, waiting for a slot or running
+        self._in_flight: Dict[Window, str] = {}  # window -> job id
+
+        self._stats = {
+            'ticks': 0,
+            'errors': 0,
+            'last_error': None,
+            'last_tick_at': None,
+            'pending': 0,
+            'submitted': 0,
+            'succeeded': 0,
+            'failed': 0,
+            'released': 0
+        }
+
+    def start(self) -> None:
+        if self._task is not None and not self._task.done():
+            return
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+        for task in self._windows.values():
+            task.cancel()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._stats['errors'] += 1
+                self._stats['last_error'] = str(e)
+                print(f"Analysis scheduler error: {e}")
+            await asyncio.sleep(self.interval)
+
+    def due_windows(self, now: datetime) -> List[Window]:
+        """All windows in the scheduler's range that have ended (plus the delay) by ``now``, oldest first"""
+        earliest = self.start_at or now - self.lookback
+        step = self.step.total_seconds()
+
+        start = datetime.fromtimestamp(math.ceil(earliest.timestamp() / step) * step, timezone.utc)
+        horizon = now - self.delay
+
+        windows = []
+        while start + self.window <= horizon:
+            windows.append((start, start + self.window))
+            start += self.step
+        return windows
+
+    async def tick(self) -> List[Window]:
+        """Schedule every due window not yet done or scheduled; returns the windows scheduled"""
+        now = datetime.now(timezone.utc)
+        due = self.due_windows(now)
+
+        if due:
+            settled = await asyncio.to_thread(
+                self.db.fetch_settled_analysis_windows,
+                self.name, due[0][0], self.max_attempts, self.claim_timeout
+            )
+            done = set(settled)
+            pending = [window for window in due if window not in done and window not in self._windows]
+        else:
+            pending = []
+
+        self._stats['ticks'] += 1
+        self._stats['last_tick_at'] = now.isoformat()
+        self._stats['pending'] = len(pending) + len(self._windows)
+
+        # Tasks take the shared slots in creation order, so the oldest windows run first
+        for window in pending:
+            task = asyncio.create_task(self._run_window(window))
+            self._windows[window] = task
+            task.add_done_callback(lambda _, window=window: self._windows.pop(window, None))
+        return pending
+
+    async def wait_idle(self) -> None:
+        """Wait until every scheduled window has finished"""
+        while self._windows:
+            await asyncio.gather(*self._windows.values(), return_exceptions=True)
+
+    async def _run_window(self, window: Window) -> None:
+        try:
+            await self._process_window(window)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # The claim times out and the window is retried on a later tick
+            self._stats['errors'] += 1
+            self._stats['last_error'] = str(e)
+            print(f"Analysis scheduler error on window {window[0].isoformat()}: {e}")
+
+    async def _process_window(self, window: Window) -> None:
+        start, end = window
+
+        async with self._slots:
+            claimed = await asyncio.to_thread(
+                self.db.claim_analysis_window,
+                self.name, start, end, self.max_attempts, self.claim_timeout
+            )
+            if not claimed:
+                return
+
+            try:
+                job = self.job_manager.submit({
+                    'start': start,
+                    # Windows are half-open; analysis windows include their end
+                    'end': end - timedelta(microseconds=1),
+                    'methods': self.methods,
+                    'incremental': False,
+                    'streaming': False,
+                    'partition_by': None,
+                    'details': 'summary',
+                    'timings': False,
+                    'profile': None
+                })
+            except JobQueueFullError as e:
+                self._stats['released'] += 1
+                await asyncio.to_thread(
+                    self.db.finish_analysis_window,
+                    self.name, start, end, 'failed', error=str(e), attempted=False
+                )
+                return
+
+            self._stats['submitted'] += 1
+            self._in_flight[window] = job.id
+            try:
+                job = await self.job_manager.wait(job.id)
+            finally:
+                del self._in_flight[window]
+
+            if job.status == 'succeeded':
+                self._stats['succeeded'] += 1
+                await asyncio.to_thread(
+                    self.db.finish_analysis_window,
+                    self.name, start, end, 'succeeded',
+                    job_id=job.id, anomalies_detected=job.result.get('anomalies_detected')
+                )
+            else:
+                self._stats['failed'] += 1
+                await asyncio.to_thread(
+                    self.db.finish_analysis_window,
+                    self.name, start, end, 'failed',
+                    job_id=job.id, error=str(job.error) if job.error else job.status
+                )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'running': self._task is not None and not self._task.done(),
+            'schedule': self.name,
+            'window_seconds': self.window.total_seconds(),
+            'step_seconds': self.step.total_seconds(),
+            'delay_seconds': self.delay.total_seconds(),
+            'methods': self.methods,
+            'concurrency': self.concurrency,
+            'scheduled': len(self._windows),
+            'in_flight': [
+                {'start': start.isoformat(), 'end': end.isoformat(), 'job_id': job_id}
+                for (start, end), job_id in self._in_flight.items()
+            ],
+            **self._stats
+        }
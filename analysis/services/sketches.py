@@ -0,0 +1,113 @@
+import numpy as np
+from typing import List, Optional
+
+
+class QuantileSketch:
+    """Mergeable KLL-style quantile sketch
+
+    Items live in a stack of compactors; an item on level h stands for 2**h
+    inputs. When a level outgrows its capacity it is sorted and every other
+    item (random offset) is promoted to the next level. Memory stays
+    O(k log(n/k)) and rank error is roughly O(1/k), independent of how
+    many values were added. Two sketches with the same ``k`` can be merged
+    losslessly with respect to those guarantees.
+    """
+
+    def __init__(self, k: int = 400, seed: Optional[int] = None):
+        self.k = k
+        self.count = 0
+        self.levels: List[np.ndarray] = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self.levels) - level - 1
+        return max(2, int(np.ceil(self.k * (2 / 3) ** depth)))
+
+    def update(self, values: np.ndarray) -> None:
+        """Add a batch of values (NaNs are ignored)"""
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+
+        if values.size == 0:
+            return
+
+        self.count += values.size
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+
+    def merge(self, other: 'QuantileSketch') -> None:
+        """Fold another sketch into this one"""
+        if other.count == 0:
+            return
+
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+
+        self.count += other.count
+        self._compress()
+
+    def _compress(self) -> None:
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+
+            if len(items) > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+
+                items = np.sort(items)
+                # Keep one item back when the level has an odd size
+                keep = items[-1:] if len(items) % 2 else items[:0]
+                paired = items[:len(items) - len(keep)]
+
+                offset = int(self._rng.integers(2))
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], paired[offset::2]])
+                self.levels[level] = keep
+
+            level += 1
+
+    def quantile(self, q: float) -> float:
+        """Approximate q-quantile of everything added so far"""
+        if self.count == 0:
+            return float('nan')
+
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([
+            np.full(len(level_items), 2 ** level, dtype=np.float64)
+            for level, level_items in enumerate(self.levels)
+        ])
+
+        order = np.argsort(items, kind='stable')
+        cumulative = np.cumsum(weights[order])
+        rank = q * cumulative[-1]
+        index = min(int(np.searchsorted(cumulative, rank, side='left')), len(order) - 1)
+        return float(items[order[index]])
+
+    def __len__(self) -> int:
+        """Number of retained items (not the number of values added)"""
+        return sum(len(level_items) for level_items in self.levels)
+
+    def to_bytes(self) -> bytes:
+        """Serialize as float64s: k, count, level count, level sizes, items"""
+        header = [self.k, self.count, len(self.levels)] + [len(items) for items in self.levels]
+        return np.concatenate([np.asarray(header, dtype=np.float64)] + self.levels).tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'QuantileSketch':
+        values = np.frombuffer(data, dtype=np.float64)
+        k, count, num_levels = (int(v) for v in values[:3])
+        sizes = values[3:3 + num_levels].astype(np.int64)
+
+        sketch = cls(k)
+        sketch.count = count
+        sketch.levels = []
+
+        offset = 3 + num_levels
+        for size in sizes:
+            sketch.levels.append(values[offset:offset + size].copy())
+            offset += size
+
+        return sketch
@@ -0,0 +1,53 @@
+import numpy as np
+from typing import Dict, Any
+
+
+class RunningStats:
+    """Running count/mean/variance (Welford) that can be updated batch-wise"""
+
+    def __init__(self, count: int = 0, mean: float = 0.0, m2: float = 0.0):
+        self.count = int(count)
+        self.mean = float(mean)
+        self.m2 = float(m2)
+
+    def update(self, values: np.ndarray) -> None:
+        """Fold a batch of values into the running statistics"""
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+
+        if values.size == 0:
+            return
+
+        batch_mean = float(values.mean())
+        batch_m2 = float(((values - batch_mean) ** 2).sum())
+        self.merge(RunningStats(values.size, batch_mean, batch_m2))
+
+    def merge(self, other: 'RunningStats') -> None:
+        """Combine with another set of statistics (Chan et al. parallel update)"""
+        if other.count == 0:
+            return
+
+        if self.count == 0:
+            self.count, self.mean, self.m2 = other.count, other.mean, other.m2
+            return
+
+        total = self.count + other.count
+        delta = other.mean - self.mean
+
+        self.mean += delta * other.count / total
+        self.m2 += other.m2 + delta ** 2 * self.count * other.count / total
+        self.count = total
+
+    @property
+    def variance(self) -> float:
+        """Sample variance (ddof=1), matching pandas' Series.std"""
+        if self.count < 2:
+            return 0.0
+        return self.m2 / (self.count - 1)
+
+    @property
+    def std(self) -> float:
+        return float(np.sqrt(self.variance))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'count': self.count, 'mean': self.mean, 'm2': self.m2}
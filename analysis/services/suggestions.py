@@ -0,0 +1,241 @@
+import asyncio
+import logging
+import time
+import uuid
+from datetime import datetime
+from typing import Optional, List, Dict, Any, Tuple, AsyncIterator
+
+logger = logging.getLogger(__name__)
+
+
+class SuggestionNotFoundError(Exception):
+    """Raised for unknown (or already pruned) suggestion request ids"""
+
+
+# Most confident anomalies kept per request (see AnomalyBatch.summary)
+TOP_ANOMALIES = 10
+
+
+class SuggestionRequest:
+    """One pending trend-suggestion generation, possibly covering several analysis windows"""
+
+    def __init__(self, summary: Dict[str, Any], start: Optional[datetime], end: Optional[datetime]):
+        self.id = uuid.uuid4().hex
+        self.start = start
+        self.end = end
+        self.total = 0
+        self.by_type: Dict[str, int] = {}
+        self.top: Dict[Tuple[int, str], Dict[str, Any]] = {}
+        self.windows = 0
+        self.status = 'queued'
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.suggestions: Optional[List[Dict[str, Any]]] = None
+        self.error: Optional[BaseException] = None
+        self.task: Optional[asyncio.Task] = None
+
+        # Generated text so far, and the queues of clients streaming it
+        self.tokens: List[str] = []
+        self._listeners: List[asyncio.Queue] = []
+
+        self.add(summary, start, end)
+
+    @property
+    def done(self) -> bool:
+        return self.status in ('succeeded', 'failed', 'cancelled')
+
+    def overlaps(self, start: Optional[datetime], end: Optional[datetime]) -> bool:
+        """Whether [start, end] intersects this request's window (None is unbounded)"""
+        try:
+            if self.end is not None and start is not None and start > self.end:
+                return False
+            if end is not None and self.start is not None and end < self.start:
+                return False
+        except TypeError:
+            # Naive and timezone-aware datetimes cannot be compared
+            return False
+        return True
+
+    def add(self, summary: Dict[str, Any], start: Optional[datetime], end: Optional[datetime]) -> None:
+        """Widen the window to cover [start, end] and merge in an anomaly summary
+
+        Counts are added up, so anomalies in the overlap of two merged
+        windows are counted twice; the most confident anomalies are merged
+        without duplicates.
+        """
+        if self.windows:
+            self.start = None if start is None or self.start is None else min(self.start, start)
+            self.end = None if end is None or self.end is None else max(self.end, end)
+
+        self.total += summary['total']
+        for anomaly_type, count in summary['by_type'].items():
+            self.by_type[anomaly_type] = self.by_type.get(anomaly_type, 0) + count
+        for anomaly in summary['top']:
+            self.top[(anomaly['traffic_event_id'], anomaly['anomaly_type'])] = anomaly
+        self.windows += 1
+
+    def summary(self) -> Dict[str, Any]:
+        """The merged anomaly summary, shaped like AnomalyBatch.summary()"""
+        top = sorted(self.top.values(), key=lambda anomaly: anomaly['confidence_score'], reverse=True)
+        return {'total': self.total, 'by_type': self.by_type, 'top': top[:TOP_ANOMALIES]}
+
+    def publish(self, token: str) -> None:
+        """Record a generated token and pass it to every streaming client"""
+        self.tokens.append(token)
+        for queue in self._listeners:
+            queue.put_nowait(token)
+
+    def finish(self) -> None:
+        """Tell streaming clients that no more tokens will arrive"""
+        for queue in self._listeners:
+            queue.put_nowait(None)
+
+    async def stream(self) -> AsyncIterator[str]:
+        """Yield the tokens generated so far, then new ones until the request is done"""
+        queue: asyncio.Queue = asyncio.Queue()
+        for token in self.tokens:
+            queue.put_nowait(token)
+
+        self._listeners.append(queue)
+        try:
+            while not (self.done and queue.empty()):
+                token = await queue.get()
+                if token is None:
+                    break
+                yield token
+        finally:
+            self._listeners.remove(queue)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {
+            'suggestion_request_id': self.id,
+            'status': self.status,
+            'href': f'/suggestions/{self.id}',
+            'period': {
+                'start': self.start.isoformat() if self.start else None,
+                'end': self.end.isoformat() if self.end else None
+            },
+            'windows': self.windows,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at
+        }
+
+        if self.status == 'succeeded':
+            data['suggestions'] = self.suggestions
+        elif self.status == 'failed':
+            data['error'] = str(self.error)
+
+        return data
+
+
+class SuggestionQueue:
+    """Generate trend suggestions in the background
+
+    submit() returns a reference immediately; at most ``max_concurrency``
+    generations run at a time. A request whose window overlaps one that is
+    still queued is merged into it (union of windows, summed anomaly counts), so a
+    burst of overlapping analyses costs one LLM generation. Tokens are
+    published on the request as they are generated (see
+    SuggestionRequest.stream) and the LLM client persists the final text.
+    Finished requests are kept for ``retention_seconds``.
+    """
+
+    def __init__(self, llm_client: Any, max_concurrency: int = 1, retention_seconds: float = 3600.0):
+        self.llm_client = llm_client
+        self.max_concurrency = max_concurrency
+        self.retention_seconds = retention_seconds
+
+        self.requests: Dict[str, SuggestionRequest] = {}
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._coalesced = 0
+
+    def submit(
+        self,
+        summary: Dict[str, Any],
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None
+    ) -> SuggestionRequest:
+        """Queue a generation, or merge it into an overlapping queued one"""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_concurrency)
+
+        self._prune()
+
+        for request in self.requests.values():
+            if request.status == 'queued' and request.overlaps(start, end):
+                request.add(summary, start, end)
+                self._coalesced += 1
+                return request
+
+        request = SuggestionRequest(summary, start, end)
+        self.requests[request.id] = request
+        request.task = asyncio.create_task(self._run(request))
+        return request
+
+    async def _run(self, request: SuggestionRequest) -> None:
+        try:
+            async with self._slots:
+                # From here on the request no longer accepts merges
+                request.status = 'running'
+                request.suggestions = await self.llm_client.generate_trend_suggestions(
+                    summary=request.summary(),
+                    start=request.start,
+                    end=request.end,
+                    on_token=request.publish
+                )
+            request.status = 'succeeded'
+
+        except asyncio.CancelledError:
+            request.status = 'cancelled'
+
+        except Exception as e:
+            logger.exception('Generating trend suggestions failed for request %s', request.id)
+            request.error = e
+            request.status = 'failed'
+
+        finally:
+            request.finished_at = time.time()
+            request.finish()
+
+    def get(self, request_id: str) -> SuggestionRequest:
+        request = self.requests.get(request_id)
+        if request is None:
+            raise SuggestionNotFoundError(f'Suggestion request {request_id} not found')
+        return request
+
+    async def wait(self, request_id: str, timeout: Optional[float] = None) -> SuggestionRequest:
+        """Wait until the request is done or ``timeout`` seconds have passed"""
+        request = self.get(request_id)
+
+        if not request.done:
+            try:
+                await asyncio.wait_for(asyncio.shield(request.task), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+        return request
+
+    def stats(self) -> Dict[str, Any]:
+        counts: Dict[str, int] = {}
+        for request in self.requests.values():
+            counts[request.status] = counts.get(request.status, 0) + 1
+
+        return {
+            'max_concurrency': self.max_concurrency,
+            'coalesced': self._coalesced,
+            'requests': counts
+        }
+
+    def _prune(self) -> None:
+        cutoff = time.time() - self.retention_seconds
+        expired = [
+            request_id for request_id, request in self.requests.items()
+            if request.done and request.finished_at is not None and request.finished_at < cutoff
+        ]
+        for request_id in expired:
+            del self.requests[request_id]
+
+    def shutdown(self) -> None:
+        for request in self.requests.values():
+            if request.task is not None and not request.done:
+                request.task.cancel()
@@ -0,0 +1,73 @@
+// Hourly traffic aggregates for a time window, read from traffic_hourly_rollups
+// (see db/migrations/009_traffic_events_partitions.sql) instead of the raw events.
+
+// Columns of each bucket, as stored in traffic_hourly_rollups
+const BUCKET_COLUMNS = `
+  hour_start, location_id, event_count, vehicle_count, speed_count,
+  speed_sum, speed_min, speed_max, first_event_at, last_event_at
+`;
+
+// Start of the first whole hour at or after a time
+const ceilHour = (param: string) => `traffic_hour(${param}::timestamptz + interval '1 hour' - interval '1 microsecond')`;
+
+export interface HourlyBuckets {
+  query: string;
+  values: any[];
+}
+
+// Per-hour, per-location buckets covering [start, end] exactly: hours that lie
+// wholly inside the window come from the rollups, while events in the partial
+// hours at either edge (at most two hours of them) are aggregated from
+// traffic_events in the same shape. Either bound may be omitted.
+export function hourlyBuckets(start?: string, end?: string): HourlyBuckets {
+  const values: any[] = [];
+  const rollupConditions: string[] = [];
+  const edges: string[] = [];
+
+  let startParam: string | undefined;
+  let endParam: string | undefined;
+
+  if (start) {
+    values.push(start);
+    startParam = `$${values.length}`;
+  }
+
+  if (end) {
+    values.push(end);
+    endParam = `$${values.length}`;
+  }
+
+  if (startParam) {
+    rollupConditions.push(`hour_start >= ${ceilHour(startParam)}`);
+    edges.push(`(timestamp >= ${startParam} AND timestamp < ${ceilHour(startParam)}${endParam ? ` AND timestamp <= ${endParam}` : ''})`);
+  }
+
+  if (endParam) {
+    // An hour counts as whole when it ends at or before the (inclusive) end
+    rollupConditions.push(`hour_start < traffic_hour(${endParam}::timestamptz)`);
+    const lower = startParam
+      ? `GREATEST(traffic_hour(${endParam}::timestamptz), ${ceilHour(startParam)})`
+      : `traffic_hour(${endParam}::timestamptz)`;
+    edges.push(`(timestamp >= ${lower} AND timestamp <= ${endParam})`);
+  }
+
+  let query = `SELECT ${BUCKET_COLUMNS} FROM traffic_hourly_rollups`;
+
+  if (rollupConditions.length > 0) {
+    query += ` WHERE ${rollupConditions.join(' AND ')}`;
+  }
+
+  if (edges.length > 0) {
+    query += `
+      UNION ALL
+      SELECT
+        traffic_hour(timestamp), location_id, COUNT(*), SUM(vehicle_count), COUNT(avg_speed),
+        COALESCE(SUM(avg_speed), 0), MIN(avg_speed), MAX(avg_speed), MIN(timestamp), MAX(timestamp)
+      FROM traffic_events
+      WHERE ${edges.join(' OR ')}
+      GROUP BY 1, 2
+    `;
+  }
+
+  return { query, values };
+}
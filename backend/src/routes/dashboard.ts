@@ -1,5 +1,6 @@
 import { FastifyPluginAsync } from 'fastify';
 import { pool } from '../db';
+import { hourlyBuckets } from '../rollups';
 
 export const dashboardRoutes: FastifyPluginAsync = async (server) => {
   // GET /dashboard/summary - Get dashboard summary
@@ -22,21 +23,19 @@ export const dashboardRoutes: FastifyPluginAsync = async (server) => {
         values.push(end);
       }
 
-      const whereClause = conditions.length > 0 ? `WHERE ${conditions.join(' AND ')}` : '';
-
-      // Get traffic summary
+      // Get traffic summary (from the hourly rollups)
+      const buckets = hourlyBuckets(start, end);
       const trafficQuery = `
         SELECT
-          COUNT(*) as event_count,
+          COALESCE(SUM(event_count), 0) as event_count,
           SUM(vehicle_count) as total_vehicles,
-          AVG(avg_speed) as average_speed,
-          MIN(avg_speed) as min_speed,
-          MAX(avg_speed) as max_speed
-        FROM traffic_events
-        ${whereClause}
+          SUM(speed_sum) / NULLIF(SUM(speed_count), 0) as average_speed,
+          MIN(speed_min) as min_speed,
+          MAX(speed_max) as max_speed
+        FROM (${buckets.query}) AS buckets
       `;
 
-      const trafficResult = await pool.query(trafficQuery, values);
+      const trafficResult = await pool.query(trafficQuery, buckets.values);
 
       // Get anomaly count
       const anomalyConditions = conditions.map(c => c.replace('timestamp', 'detected_at'));
@@ -74,34 +73,20 @@ export const dashboardRoutes: FastifyPluginAsync = async (server) => {
     const { start, end } = request.query;
 
     try {
-      const values: any[] = [];
-      const conditions: string[] = [];
-
-      if (start) {
-        conditions.push(`timestamp >= $${values.length + 1}`);
-        values.push(start);
-      }
-
-      if (end) {
-        conditions.push(`timestamp <= $${values.length + 1}`);
-        values.push(end);
-      }
-
-      const whereClause = conditions.length > 0 ? `WHERE ${conditions.join(' AND ')}` : '';
+      const buckets = hourlyBuckets(start, end);
 
       const query = `
         SELECT
-          DATE_TRUNC('hour', timestamp) as time_bucket,
+          hour_start as time_bucket,
           SUM(vehicle_count) as vehicle_count,
-          AVG(avg_speed) as avg_speed,
-          COUNT(*) as event_count
-        FROM traffic_events
-        ${whereClause}
+          SUM(speed_sum) / NULLIF(SUM(speed_count), 0) as avg_speed,
+          SUM(event_count) as event_count
+        FROM (${buckets.query}) AS buckets
         GROUP BY time_bucket
         ORDER BY time_bucket
       `;
 
-      const result = await pool.query(query, values);
+      const result = await pool.query(query, buckets.values);
 
       return {
         timeseries: result.rows
@@ -1,5 +1,6 @@
 import { FastifyPluginAsync } from 'fastify';
 import { pool } from '../db';
+import { hourlyBuckets } from '../rollups';
 
 interface TrafficEvent {
   timestamp: string;
@@ -14,6 +15,14 @@ interface TrafficEvent {
   raw_features?: Record<string, any>;
 }
 
+interface BatchResult {
+  index: number;
+  success: boolean;
+  id?: number;
+  error?: string;
+  retryable?: boolean;
+}
+
 const trafficEventSchema = {
   body: {
     type: 'object',
@@ -33,6 +42,125 @@ const trafficEventSchema = {
   }
 };
 
+const EVENT_COLUMNS = [
+  'timestamp', 'location_id', 'vehicle_count', 'avg_speed', 'min_speed', 'max_speed',
+  'color_counts', 'inter_arrival_stats', 'traffic_density_score', 'raw_features'
+];
+
+const NUMBER_FIELDS = ['location_id', 'vehicle_count', 'avg_speed', 'min_speed', 'max_speed', 'traffic_density_score'];
+const OBJECT_FIELDS = ['color_counts', 'inter_arrival_stats', 'raw_features'];
+
+const MAX_BATCH_EVENTS = parseInt(process.env.INGEST_MAX_BATCH_EVENTS || '10000', 10);
+const BATCH_BODY_LIMIT = parseInt(process.env.INGEST_BATCH_BODY_LIMIT || String(16 * 1024 * 1024), 10);
+
+// Rows per INSERT statement, keeping the bind parameters well under Postgres' 65535 limit
+const INSERT_CHUNK_ROWS = 1000;
+
+// Marks an NDJSON line that is not valid JSON, so it is reported per event
+class UnparseableLine {
+  constructor(public readonly message: string) {}
+}
+
+function eventValues(event: TrafficEvent): any[] {
+  return [
+    event.timestamp,
+    event.location_id,
+    event.vehicle_count,
+    event.avg_speed || null,
+    event.min_speed || null,
+    event.max_speed || null,
+    event.color_counts ? JSON.stringify(event.color_counts) : null,
+    event.inter_arrival_stats ? JSON.stringify(event.inter_arrival_stats) : null,
+    event.traffic_density_score || null,
+    event.raw_features ? JSON.stringify(event.raw_features) : null
+  ];
+}
+
+// Same rules as trafficEventSchema, checked per event so one bad event does not reject the batch
+function validateEvent(event: unknown): string | null {
+  if (event instanceof UnparseableLine) {
+    return event.message;
+  }
+  if (typeof event !== 'object' || event === null || Array.isArray(event)) {
+    return 'event must be an object';
+  }
+
+  const fields = event as Record<string, unknown>;
+  for (const field of ['timestamp', 'location_id', 'vehicle_count']) {
+    if (fields[field] === undefined || fields[field] === null) {
+      return `missing required property '${field}'`;
+    }
+  }
+
+  if (typeof fields.timestamp !== 'string' || Number.isNaN(Date.parse(fields.timestamp))) {
+    return "'timestamp' must be a date-time string";
+  }
+  for (const field of NUMBER_FIELDS) {
+    if (fields[field] !== undefined && fields[field] !== null && typeof fields[field] !== 'number') {
+      return `'${field}' must be a number`;
+    }
+  }
+  for (const field of OBJECT_FIELDS) {
+    const value = fields[field];
+    if (value !== undefined && value !== null && (typeof value !== 'object' || Array.isArray(value))) {
+      return `'${field}' must be an object`;
+    }
+  }
+
+  return null;
+}
+
+function parseNdjson(body: string): unknown[] {
+  const events: unknown[] = [];
+  for (const line of body.split('\n')) {
+    if (!line.trim()) {
+      continue;
+    }
+    try {
+      events.push(JSON.parse(line));
+    } catch (error) {
+      events.push(new UnparseableLine(`invalid JSON: ${error instanceof Error ? error.message : error}`));
+    }
+  }
+  return events;
+}
+
+function errorMessage(error: unknown): string {
+  return error instanceof Error ? error.message : 'Unknown error';
+}
+
+// SQLSTATE classes 22 (data exception) and 23 (integrity constraint) are caused by the row itself
+function isDataError(error: unknown): boolean {
+  const code = (error as { code?: unknown })?.code;
+  return typeof code === 'string' && (code.startsWith('22') || code.startsWith('23'));
+}
+
+function failResult(result: BatchResult, error: string, retryable: boolean): void {
+  result.success = false;
+  result.error = error;
+  result.retryable = retryable;
+}
+
+// One multi-row INSERT; ids come back in VALUES order
+async function insertEvents(events: TrafficEvent[]): Promise<number[]> {
+  const values: any[] = [];
+  const rows = events.map((event) => {
+    const placeholders = eventValues(event).map((value) => {
+      values.push(value);
+      return `$${values.length}`;
+    });
+    return `(${placeholders.join(', ')})`;
+  });
+
+  const result = await pool.query(
+    `INSERT INTO traffic_events (${EVENT_COLUMNS.join(', ')}) VALUES ${rows.join(', ')} RETURNING id`,
+    values
+  );
+
+  // Serial ids are assigned in row order; sort rather than rely on RETURNING order
+  return result.rows.map((row) => Number(row.id)).sort((a, b) => a - b);
+}
+
 export const trafficRoutes: FastifyPluginAsync = async (server) => {
   // POST /ingest/traffic - Ingest traffic events
   server.post<{ Body: TrafficEvent }>(
@@ -42,33 +170,12 @@ export const trafficRoutes: FastifyPluginAsync = async (server) => {
       const event = request.body;
 
       try {
-        const query = `
-          INSERT INTO traffic_events (
-            timestamp, location_id, vehicle_count, avg_speed, min_speed, max_speed,
-            color_counts, inter_arrival_stats, traffic_density_score, raw_features
-          ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
-          RETURNING id
-        `;
-
-        const values = [
-          event.timestamp,
-          event.location_id,
-          event.vehicle_count,
-          event.avg_speed || null,
-          event.min_speed || null,
-          event.max_speed || null,
-          event.color_counts ? JSON.stringify(event.color_counts) : null,
-          event.inter_arrival_stats ? JSON.stringify(event.inter_arrival_stats) : null,
-          event.traffic_density_score || null,
-          event.raw_features ? JSON.stringify(event.raw_features) : null
-        ];
-
-        const result = await pool.query(query, values);
+        const [id] = await insertEvents([event]);
 
         reply.code(201);
         return {
           success: true,
-          id: result.rows[0].id
+          id
         };
       } catch (error) {
         server.log.error(error);
@@ -81,6 +188,95 @@ export const trafficRoutes: FastifyPluginAsync = async (server) => {
     }
   );
 
+  // NDJSON bodies for the batch endpoint: one event per line
+  server.addContentTypeParser(
+    ['application/x-ndjson', 'application/ndjson'],
+    { parseAs: 'string', bodyLimit: BATCH_BODY_LIMIT },
+    (request, body, done) => {
+      done(null, parseNdjson(body as string));
+    }
+  );
+
+  // POST /ingest/traffic/batch - Ingest many traffic events in one request
+  server.post<{ Body: unknown }>(
+    '/ingest/traffic/batch',
+    { bodyLimit: BATCH_BODY_LIMIT },
+    async (request, reply) => {
+      const body = request.body as any;
+      const events: unknown[] | null = Array.isArray(body)
+        ? body
+        : Array.isArray(body?.events) ? body.events : null;
+
+      if (events === null) {
+        reply.code(400);
+        return {
+          success: false,
+          error: 'Body must be a JSON array of events, {"events": [...]} or NDJSON'
+        };
+      }
+
+      if (events.length > MAX_BATCH_EVENTS) {
+        reply.code(413);
+        return {
+          success: false,
+          error: `Batch of ${events.length} events exceeds the limit of ${MAX_BATCH_EVENTS}`
+        };
+      }
+
+      const results: BatchResult[] = events.map((event, index) => {
+        const error = validateEvent(event);
+        return error ? { index, success: false, error, retryable: false } : { index, success: true };
+      });
+      const valid = results.filter((result) => result.success);
+
+      let unavailable = false;
+      for (let offset = 0; offset < valid.length; offset += INSERT_CHUNK_ROWS) {
+        const chunk = valid.slice(offset, offset + INSERT_CHUNK_ROWS);
+
+        if (unavailable) {
+          chunk.forEach((result) => failResult(result, 'Not attempted after a database error', true));
+          continue;
+        }
+
+        try {
+          const ids = await insertEvents(chunk.map((result) => events[result.index] as TrafficEvent));
+          chunk.forEach((result, i) => { result.id = ids[i]; });
+        } catch (error) {
+          if (!isDataError(error)) {
+            // The database itself failed: the client may retry these events as-is
+            server.log.error(error);
+            unavailable = true;
+            chunk.forEach((result) => failResult(result, errorMessage(error), true));
+            continue;
+          }
+
+          // One rejected row fails the whole statement; insert the chunk row by
+          // row so only the offending events are reported
+          for (const result of chunk) {
+            try {
+              [result.id] = await insertEvents([events[result.index] as TrafficEvent]);
+            } catch (rowError) {
+              failResult(result, errorMessage(rowError), !isDataError(rowError));
+            }
+          }
+        }
+      }
+
+      const inserted = results.filter((result) => result.success).length;
+      const failed = results.length - inserted;
+
+      // 201 when every event was stored, 207 when only some were, otherwise
+      // 503 if the database failed (retry the batch) or 400 if every event was rejected
+      reply.code(failed === 0 ? 201 : inserted > 0 ? 207 : unavailable ? 503 : 400);
+      return {
+        success: failed === 0,
+        inserted,
+        failed,
+        results
+      };
+    }
+  );
+
   // GET /metrics/traffic - Get aggregated traffic metrics
   server.get<{
     Querystring: { start?: string; end?: string }
@@ -88,51 +284,33 @@ export const trafficRoutes: FastifyPluginAsync = async (server) => {
     const { start, end } = request.query;
 
     try {
-      let query = `
+      // Whole hours come from the rollups, so cost does not grow with retention
+      const buckets = hourlyBuckets(start, end);
+
+      const query = `
         SELECT
-          COUNT(*) as event_count,
+          COALESCE(SUM(event_count), 0) as event_count,
           SUM(vehicle_count) as total_vehicles,
-          AVG(avg_speed) as average_speed,
-          MIN(timestamp) as period_start,
-          MAX(timestamp) as period_end
-        FROM traffic_events
+          SUM(speed_sum) / NULLIF(SUM(speed_count), 0) as average_speed,
+          MIN(first_event_at) as period_start,
+          MAX(last_event_at) as period_end
+        FROM (${buckets.query}) AS buckets
       `;
 
-      const values: any[] = [];
-      const conditions: string[] = [];
-
-      if (start) {
-        conditions.push(`timestamp >= $${values.length + 1}`);
-        values.push(start);
-      }
-
-      if (end) {
-        conditions.push(`timestamp <= $${values.length + 1}`);
-        values.push(end);
-      }
-
-      if (conditions.length > 0) {
-        query += ` WHERE ${conditions.join(' AND ')}`;
-      }
-
-      const result = await pool.query(query, values);
+      const result = await pool.query(query, buckets.values);
 
       // Get timeseries data
-      let timeseriesQuery = `
+      const timeseriesQuery = `
         SELECT
-          DATE_TRUNC('hour', timestamp) as time_bucket,
+          hour_start as time_bucket,
           SUM(vehicle_count) as vehicle_count,
-          AVG(avg_speed) as avg_speed
-        FROM traffic_events
+          SUM(speed_sum) / NULLIF(SUM(speed_count), 0) as avg_speed
+        FROM (${buckets.query}) AS buckets
+        GROUP BY time_bucket
+        ORDER BY time_bucket
       `;
 
-      if (conditions.length > 0) {
-        timeseriesQuery += ` WHERE ${conditions.join(' AND ')}`;
-      }
-
-      timeseriesQuery += ` GROUP BY time_bucket ORDER BY time_bucket`;
-
-      const timeseriesResult = await pool.query(timeseriesQuery, values);
+      const timeseriesResult = await pool.query(timeseriesQuery, buckets.values);
 
       return {
         summary: result.rows[0],
@@ -7,6 +7,14 @@ psql -v ON_ERROR_STOP=1 --username "$POSTGRES_USER" --dbname "$POSTGRES_DB" <<-E
     \i /docker-entrypoint-initdb.d/migrations/001_init.sql
     \i /docker-entrypoint-initdb.d/migrations/002_anomalies.sql
     \i /docker-entrypoint-initdb.d/migrations/003_trend_suggestions.sql
+    \i /docker-entrypoint-initdb.d/migrations/004_analysis_state.sql
+    \i /docker-entrypoint-initdb.d/migrations/005_anomalies_unique.sql
+    \i /docker-entrypoint-initdb.d/migrations/006_traffic_baselines.sql
+    \i /docker-entrypoint-initdb.d/migrations/007_traffic_events_notify.sql
+    \i /docker-entrypoint-initdb.d/migrations/008_metric_sketches.sql
+    \i /docker-entrypoint-initdb.d/migrations/009_traffic_events_partitions.sql
+    \i /docker-entrypoint-initdb.d/migrations/010_analysis_windows.sql
+    \i /docker-entrypoint-initdb.d/migrations/011_anomalies_keyset.sql
 EOSQL
 
 echo "Database migrations completed successfully!"
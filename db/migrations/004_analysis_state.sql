@@ -0,0 +1,17 @@
+-- Create analysis_watermarks table (last traffic event processed per incremental consumer)
+CREATE TABLE IF NOT EXISTS analysis_watermarks (
+    name VARCHAR(100) PRIMARY KEY,
+    last_event_id BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Create metric_statistics table (running Welford state per consumer and metric)
+CREATE TABLE IF NOT EXISTS metric_statistics (
+    name VARCHAR(100) NOT NULL,
+    metric VARCHAR(100) NOT NULL,
+    count BIGINT NOT NULL DEFAULT 0,
+    mean DOUBLE PRECISION NOT NULL DEFAULT 0,
+    m2 DOUBLE PRECISION NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (name, metric)
+);
@@ -0,0 +1,9 @@
+-- Remove duplicate anomalies left by repeated analysis runs (keep the newest)
+DELETE FROM anomalies a
+USING anomalies b
+WHERE a.traffic_event_id = b.traffic_event_id
+  AND a.anomaly_type = b.anomaly_type
+  AND a.id < b.id;
+
+-- One anomaly per traffic event and detection method, so analysis runs can upsert
+CREATE UNIQUE INDEX IF NOT EXISTS idx_anomalies_event_type ON anomalies(traffic_event_id, anomaly_type);
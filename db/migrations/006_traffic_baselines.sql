@@ -0,0 +1,15 @@
+-- Create traffic_baselines table (running statistics per location, hour of week and metric)
+CREATE TABLE IF NOT EXISTS traffic_baselines (
+    location_id INTEGER NOT NULL,
+    hour_of_week SMALLINT NOT NULL CHECK (hour_of_week BETWEEN 0 AND 167),
+    metric VARCHAR(100) NOT NULL,
+    count BIGINT NOT NULL DEFAULT 0,
+    mean DOUBLE PRECISION NOT NULL DEFAULT 0,
+    m2 DOUBLE PRECISION NOT NULL DEFAULT 0,
+    std DOUBLE PRECISION NOT NULL DEFAULT 0,
+    q1 DOUBLE PRECISION,
+    q3 DOUBLE PRECISION,
+    sketch BYTEA,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (location_id, hour_of_week, metric)
+);
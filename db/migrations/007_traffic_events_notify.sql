@@ -0,0 +1,16 @@
+-- Notify listeners (the analysis service's realtime consumer) of new traffic events.
+-- One notification per INSERT statement carrying the highest new id, so batch ingests
+-- do not flood the channel; consumers read everything past their own watermark.
+CREATE OR REPLACE FUNCTION notify_traffic_events() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('traffic_events', (SELECT MAX(id) FROM new_rows)::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS traffic_events_notify ON traffic_events;
+CREATE TRIGGER traffic_events_notify
+    AFTER INSERT ON traffic_events
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_traffic_events();
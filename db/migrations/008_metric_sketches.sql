@@ -0,0 +1,11 @@
+-- Create metric_sketches table (mergeable quantile sketch per location and metric, used by the IQR detector)
+CREATE TABLE IF NOT EXISTS metric_sketches (
+    location_id INTEGER NOT NULL,
+    metric VARCHAR(100) NOT NULL,
+    count BIGINT NOT NULL DEFAULT 0,
+    q1 DOUBLE PRECISION,
+    q3 DOUBLE PRECISION,
+    sketch BYTEA,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (location_id, metric)
+);
@@ -0,0 +1,219 @@
+-- Partition traffic_events by day and maintain hourly per-location rollups.
+--
+-- Daily range partitions (traffic_events_YYYYMMDD) on timestamp let old data be
+-- dropped a day at a time; rows without a partition land in traffic_events_default
+-- and are moved out when their day's partition is created. The primary key must
+-- include the partition key, so it becomes (id, timestamp) and the foreign key from
+-- anomalies (which cannot reference id alone any more) is dropped.
+
+-- Bucket boundaries are UTC, whatever the session time zone
+CREATE OR REPLACE FUNCTION traffic_hour(ts TIMESTAMPTZ) RETURNS TIMESTAMPTZ AS $$
+    SELECT date_bin('1 hour', ts, TIMESTAMPTZ '2000-01-01 00:00:00+00');
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Create the daily partitions for [from_day, to_day] that do not exist yet, moving
+-- any of their rows out of the default partition. Returns the partitions created.
+--
+-- Locks: ATTACH PARTITION takes SHARE UPDATE EXCLUSIVE on traffic_events (so inserts
+-- routed to existing partitions go on) and ACCESS EXCLUSIVE on the new table and on
+-- traffic_events_default, which it scans to prove no row falls in the new range.
+-- Inserts that land in the default partition therefore wait for that scan and for
+-- the rest of the transaction, and the move holds row locks on the rows it deletes.
+-- The new table gets a CHECK matching its bounds before attaching so it is not
+-- scanned as well; the check is redundant afterwards and dropped.
+CREATE OR REPLACE FUNCTION ensure_traffic_events_partitions(from_day DATE, to_day DATE)
+RETURNS SETOF TEXT AS $$
+DECLARE
+    day DATE;
+    partition TEXT;
+    lower_bound TIMESTAMPTZ;
+    upper_bound TIMESTAMPTZ;
+BEGIN
+    FOR day IN SELECT generate_series(from_day, to_day, INTERVAL '1 day')::date LOOP
+        partition := 'traffic_events_' || to_char(day, 'YYYYMMDD');
+        CONTINUE WHEN to_regclass(partition) IS NOT NULL;
+
+        lower_bound := day::timestamp AT TIME ZONE 'UTC';
+        upper_bound := (day + 1)::timestamp AT TIME ZONE 'UTC';
+
+        EXECUTE format('CREATE TABLE %I (LIKE traffic_events INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', partition);
+        EXECUTE format(
+            'WITH moved AS (DELETE FROM traffic_events_default WHERE timestamp >= %L AND timestamp < %L RETURNING *) '
+            'INSERT INTO %I SELECT * FROM moved',
+            lower_bound, upper_bound, partition
+        );
+        EXECUTE format(
+            'ALTER TABLE %I ADD CONSTRAINT %I CHECK (timestamp >= %L AND timestamp < %L)',
+            partition, partition || '_bounds', lower_bound, upper_bound
+        );
+        EXECUTE format(
+            'ALTER TABLE traffic_events ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+            partition, lower_bound, upper_bound
+        );
+        EXECUTE format('ALTER TABLE %I DROP CONSTRAINT %I', partition, partition || '_bounds');
+
+        RETURN NEXT partition;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Drop the daily partitions of days before before_day. Returns the partitions dropped.
+-- Their hourly rollups are kept.
+CREATE OR REPLACE FUNCTION drop_traffic_events_partitions(before_day DATE)
+RETURNS SETOF TEXT AS $$
+DECLARE
+    partition TEXT;
+BEGIN
+    FOR partition IN
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = 'traffic_events'::regclass
+          AND child.relname ~ '^traffic_events_[0-9]{8}$'
+          AND to_date(substring(child.relname FROM '[0-9]{8}$'), 'YYYYMMDD') < before_day
+        ORDER BY child.relname
+    LOOP
+        EXECUTE format('DROP TABLE %I', partition);
+        RETURN NEXT partition;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    first_day DATE;
+    last_day DATE;
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'traffic_events'::regclass) = 'p' THEN
+        RETURN;
+    END IF;
+
+    ALTER TABLE anomalies DROP CONSTRAINT IF EXISTS anomalies_traffic_event_id_fkey;
+
+    ALTER TABLE traffic_events RENAME TO traffic_events_unpartitioned;
+    ALTER INDEX traffic_events_pkey RENAME TO traffic_events_unpartitioned_pkey;
+    DROP INDEX IF EXISTS idx_traffic_events_timestamp;
+    DROP INDEX IF EXISTS idx_traffic_events_location_id;
+    DROP INDEX IF EXISTS idx_traffic_events_timestamp_location;
+
+    CREATE TABLE traffic_events (
+        id INTEGER NOT NULL DEFAULT nextval('traffic_events_id_seq'),
+        timestamp TIMESTAMPTZ NOT NULL,
+        location_id INTEGER NOT NULL,
+        vehicle_count INTEGER NOT NULL,
+        avg_speed FLOAT,
+        min_speed FLOAT,
+        max_speed FLOAT,
+        color_counts JSONB,
+        inter_arrival_stats JSONB,
+        traffic_density_score FLOAT,
+        raw_features JSONB,
+        created_at TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (id, timestamp)
+    ) PARTITION BY RANGE (timestamp);
+
+    ALTER SEQUENCE traffic_events_id_seq OWNED BY traffic_events.id;
+
+    CREATE TABLE traffic_events_default PARTITION OF traffic_events DEFAULT;
+
+    CREATE INDEX idx_traffic_events_timestamp ON traffic_events(timestamp);
+    CREATE INDEX idx_traffic_events_location_id ON traffic_events(location_id);
+    CREATE INDEX idx_traffic_events_timestamp_location ON traffic_events(timestamp, location_id);
+
+    SELECT (min(timestamp) AT TIME ZONE 'UTC')::date, (max(timestamp) AT TIME ZONE 'UTC')::date
+    INTO first_day, last_day
+    FROM traffic_events_unpartitioned;
+
+    IF first_day IS NOT NULL THEN
+        PERFORM ensure_traffic_events_partitions(first_day, last_day);
+    END IF;
+    PERFORM ensure_traffic_events_partitions(CURRENT_DATE, CURRENT_DATE + 7);
+
+    INSERT INTO traffic_events (
+        id, timestamp, location_id, vehicle_count, avg_speed, min_speed, max_speed,
+        color_counts, inter_arrival_stats, traffic_density_score, raw_features, created_at
+    )
+    SELECT
+        id, timestamp, location_id, vehicle_count, avg_speed, min_speed, max_speed,
+        color_counts, inter_arrival_stats, traffic_density_score, raw_features, created_at
+    FROM traffic_events_unpartitioned;
+
+    DROP TABLE traffic_events_unpartitioned;
+END;
+$$;
+
+-- Hourly aggregates per location, maintained on insert by the trigger below. Rows
+-- are only ever added to traffic_events, so the rollups are exact; they outlive
+-- dropped partitions.
+CREATE TABLE IF NOT EXISTS traffic_hourly_rollups (
+    hour_start TIMESTAMPTZ NOT NULL,
+    location_id INTEGER NOT NULL,
+    event_count BIGINT NOT NULL,
+    vehicle_count BIGINT NOT NULL,
+    -- events with a non-NULL avg_speed, for averaging
+    speed_count BIGINT NOT NULL,
+    speed_sum DOUBLE PRECISION NOT NULL,
+    speed_min DOUBLE PRECISION,
+    speed_max DOUBLE PRECISION,
+    first_event_at TIMESTAMPTZ NOT NULL,
+    last_event_at TIMESTAMPTZ NOT NULL,
+    PRIMARY KEY (hour_start, location_id)
+);
+
+CREATE OR REPLACE FUNCTION rollup_traffic_events() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO traffic_hourly_rollups AS r (
+        hour_start, location_id, event_count, vehicle_count, speed_count,
+        speed_sum, speed_min, speed_max, first_event_at, last_event_at
+    )
+    SELECT
+        traffic_hour(timestamp), location_id, COUNT(*), SUM(vehicle_count), COUNT(avg_speed),
+        COALESCE(SUM(avg_speed), 0), MIN(avg_speed), MAX(avg_speed), MIN(timestamp), MAX(timestamp)
+    FROM new_rows
+    GROUP BY 1, 2
+    -- Lock rollup rows in a fixed order so concurrent ingests cannot deadlock
+    ORDER BY 1, 2
+    ON CONFLICT (hour_start, location_id) DO UPDATE SET
+        event_count = r.event_count + EXCLUDED.event_count,
+        vehicle_count = r.vehicle_count + EXCLUDED.vehicle_count,
+        speed_count = r.speed_count + EXCLUDED.speed_count,
+        speed_sum = r.speed_sum + EXCLUDED.speed_sum,
+        speed_min = LEAST(r.speed_min, EXCLUDED.speed_min),
+        speed_max = GREATEST(r.speed_max, EXCLUDED.speed_max),
+        first_event_at = LEAST(r.first_event_at, EXCLUDED.first_event_at),
+        last_event_at = GREATEST(r.last_event_at, EXCLUDED.last_event_at);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Backfill the rollups once, from the events that existed before the trigger
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_trigger
+        WHERE tgname = 'traffic_events_rollup' AND tgrelid = 'traffic_events'::regclass
+    ) THEN
+        TRUNCATE traffic_hourly_rollups;
+        INSERT INTO traffic_hourly_rollups
+        SELECT
+            traffic_hour(timestamp), location_id, COUNT(*), SUM(vehicle_count), COUNT(avg_speed),
+            COALESCE(SUM(avg_speed), 0), MIN(avg_speed), MAX(avg_speed), MIN(timestamp), MAX(timestamp)
+        FROM traffic_events
+        GROUP BY 1, 2;
+
+        CREATE TRIGGER traffic_events_rollup
+            AFTER INSERT ON traffic_events
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT
+            EXECUTE FUNCTION rollup_traffic_events();
+    END IF;
+END;
+$$;
+
+-- The realtime NOTIFY trigger (007) went with the unpartitioned table
+DROP TRIGGER IF EXISTS traffic_events_notify ON traffic_events;
+CREATE TRIGGER traffic_events_notify
+    AFTER INSERT ON traffic_events
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_traffic_events();
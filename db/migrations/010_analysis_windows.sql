@@ -0,0 +1,19 @@
+-- Create analysis_windows table (windows run by the analysis service's scheduler).
+-- A row is claimed as 'running' before its job is submitted, so replicas of the
+-- service never analyze the same window twice; failed windows are retried until
+-- attempts reaches the scheduler's limit.
+CREATE TABLE IF NOT EXISTS analysis_windows (
+    schedule VARCHAR(100) NOT NULL,
+    window_start TIMESTAMPTZ NOT NULL,
+    window_end TIMESTAMPTZ NOT NULL,
+    status VARCHAR(20) NOT NULL CHECK (status IN ('running', 'succeeded', 'failed')),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    job_id VARCHAR(32),
+    anomalies_detected INTEGER,
+    error TEXT,
+    started_at TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMPTZ,
+    PRIMARY KEY (schedule, window_start, window_end)
+);
+
+CREATE INDEX IF NOT EXISTS idx_analysis_windows_status ON analysis_windows(schedule, status);
@@ -0,0 +1,4 @@
+-- Keyset pagination over anomalies reads (detected_at, id) pages straight off this
+-- index; it also serves the detected_at range filters the old index was for
+CREATE INDEX IF NOT EXISTS idx_anomalies_detected_at_id ON anomalies(detected_at, id);
+DROP INDEX IF EXISTS idx_anomalies_detected_at;
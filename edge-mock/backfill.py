@@ -0,0 +1,226 @@
+"""Historical backfill of generated traffic events
+
+Generates events for an arbitrary time range with the vectorized
+TrafficDataGenerator.generate_batch and writes them straight to Postgres
+with COPY, or to a Parquet file, in chunks:
+
+    python backfill.py --start 2024-01-01 --end 2024-04-01 --events 10000000 --locations 500
+    python backfill.py --start 2024-01-01 --end 2024-01-08 --events 1000000 --parquet week.parquet
+
+Timestamps are UTC and increase across chunks, so ``traffic_events.id``
+order matches time order as it does for live ingest. Every injected
+anomaly is labelled in ``raw_features.injected_anomaly`` (and in the
+``label`` column of Parquet output) for scoring detectors against ground
+truth. Parquet output needs pyarrow, which is not installed by default.
+
+The daily traffic_events partitions for the range are created before
+loading; the hourly rollups are maintained by the insert trigger.
+"""
+import argparse
+import os
+import time
+from datetime import datetime, timezone
+from io import StringIO
+from typing import Dict, Iterator, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+from publisher import TrafficDataGenerator, ANOMALY_TYPES, WEATHER, VISIBILITY
+
+load_dotenv()
+
+COLUMNS = [
+    'timestamp', 'location_id', 'vehicle_count', 'avg_speed', 'min_speed', 'max_speed',
+    'color_counts', 'inter_arrival_stats', 'traffic_density_score', 'raw_features'
+]
+
+
+def generate_chunks(
+    generator: TrafficDataGenerator,
+    events: int,
+    start: datetime,
+    end: datetime,
+    chunk_size: int = 500000,
+    seed: Optional[int] = None
+) -> Iterator[Dict[str, np.ndarray]]:
+    """Yield batches covering consecutive slices of [start, end)
+
+    Each chunk gets an equal share of the time range and of the events, so
+    timestamps are sorted across chunks as well as within them.
+    """
+    rng = np.random.default_rng(seed)
+    chunks = max(1, -(-events // chunk_size))
+    span = (end - start) / chunks
+
+    for i in range(chunks):
+        n = events // chunks + (1 if i < events % chunks else 0)
+        yield generator.generate_batch(n, start + span * i, start + span * (i + 1), rng)
+
+
+def _color_json(generator: TrafficDataGenerator, counts: np.ndarray) -> list:
+    """JSON objects for the color count rows, leaving out zero counts like generate_event"""
+    # One lookup table of ', "color": count' fragments per color, concatenated
+    # column by column in object arrays rather than row by row in Python
+    top = int(counts.max(initial=0)) + 1
+    rows = np.full(len(counts), '', dtype=object)
+    for i, color in enumerate(generator.colors):
+        fragments = np.array([''] + [f', "{color}": {count}' for count in range(1, top)], dtype=object)
+        rows = rows + fragments[counts[:, i]]
+    return ['{' + row[2:] + '}' for row in rows.tolist()]
+
+
+def to_copy_text(generator: TrafficDataGenerator, batch: Dict[str, np.ndarray]) -> str:
+    """Render a batch in COPY's text format (tab separated, one row per line)
+
+    None of the generated values contain tabs, newlines or backslashes, so
+    no escaping is needed.
+    """
+    timestamps = np.datetime_as_string(batch['timestamp'], unit='ms')
+    colors = _color_json(generator, batch['color_counts'])
+    weather = np.array([f'"weather": "{w}", ' for w in WEATHER])[batch['weather']]
+    visibility = np.array([f'"visibility": "{v}"' for v in VISIBILITY])[batch['visibility']]
+    labels = np.array([''] + [f', "injected_anomaly": "{a}"' for a in ANOMALY_TYPES])[batch['label'] + 1]
+
+    lines = [
+        f'{ts}+00\t{loc}\t{vc}\t{avg}\t{mn}\t{mx}\t{cc}\t'
+        f'{{"mean": {im}, "std": {isd}, "min": {imin}, "max": {imax}}}\t{dens}\t{{{w}{v}{lab}}}'
+        for ts, loc, vc, avg, mn, mx, cc, im, isd, imin, imax, dens, w, v, lab in zip(
+            timestamps.tolist(), batch['location_id'].tolist(), batch['vehicle_count'].tolist(),
+            batch['avg_speed'].tolist(), batch['min_speed'].tolist(), batch['max_speed'].tolist(),
+            colors, batch['inter_arrival_mean'].tolist(), batch['inter_arrival_std'].tolist(),
+            batch['inter_arrival_min'].tolist(), batch['inter_arrival_max'].tolist(),
+            batch['traffic_density_score'].tolist(), weather.tolist(), visibility.tolist(), labels.tolist()
+        )
+    ]
+    return '\n'.join(lines) + '\n'
+
+
+def copy_to_postgres(conn, generator: TrafficDataGenerator, batch: Dict[str, np.ndarray]) -> None:
+    """COPY one batch into traffic_events and commit it"""
+    with conn.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY traffic_events ({', '.join(COLUMNS)}) FROM STDIN",
+            StringIO(to_copy_text(generator, batch))
+        )
+    conn.commit()
+
+
+def to_frame(generator: TrafficDataGenerator, batch: Dict[str, np.ndarray]):
+    """A batch as a DataFrame with flat columns and the ground-truth label"""
+    import pandas as pd
+
+    frame = pd.DataFrame({
+        'timestamp': pd.to_datetime(batch['timestamp']).tz_localize('UTC'),
+        'location_id': batch['location_id'].astype(np.int32),
+        'vehicle_count': batch['vehicle_count'].astype(np.int32),
+        'avg_speed': batch['avg_speed'],
+        'min_speed': batch['min_speed'],
+        'max_speed': batch['max_speed'],
+        'traffic_density_score': batch['traffic_density_score'],
+        'inter_arrival_mean': batch['inter_arrival_mean'],
+        'inter_arrival_std': batch['inter_arrival_std'],
+        'inter_arrival_min': batch['inter_arrival_min'],
+        'inter_arrival_max': batch['inter_arrival_max'],
+        'weather': pd.Categorical.from_codes(batch['weather'], WEATHER),
+        'visibility': pd.Categorical.from_codes(batch['visibility'], VISIBILITY),
+        'label': pd.Categorical.from_codes(batch['label'], ANOMALY_TYPES)
+    })
+    for i, color in enumerate(generator.colors):
+        frame[f'color_{color}'] = batch['color_counts'][:, i].astype(np.int32)
+    return frame
+
+
+def backfill(
+    events: int,
+    start: datetime,
+    end: datetime,
+    num_locations: int,
+    anomaly_rate: float = 0.05,
+    chunk_size: int = 500000,
+    seed: Optional[int] = None,
+    parquet_path: Optional[str] = None
+) -> Dict[str, float]:
+    """Generate ``events`` events and write them to Postgres, or to ``parquet_path``"""
+    generator = TrafficDataGenerator(num_locations, anomaly_rate)
+
+    conn = None
+    writer = None
+    if parquet_path:
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit('Parquet output needs pyarrow: pip install pyarrow')
+    else:
+        import psycopg2
+        conn = psycopg2.connect(
+            host=os.getenv('DB_HOST', 'localhost'),
+            port=os.getenv('DB_PORT', '5432'),
+            database=os.getenv('DB_NAME', 'patternscope'),
+            user=os.getenv('DB_USER', 'postgres'),
+            password=os.getenv('DB_PASSWORD', 'postgres')
+        )
+        # Daily partitions for the whole range up front, so rows do not pile up in the default partition
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT ensure_traffic_events_partitions(%s, %s)", (start.date(), end.date()))
+        conn.commit()
+
+    started = time.perf_counter()
+    written = 0
+    labelled = 0
+
+    try:
+        for batch in generate_chunks(generator, events, start, end, chunk_size, seed):
+            if parquet_path:
+                table = pa.Table.from_pandas(to_frame(generator, batch), preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(parquet_path, table.schema)
+                writer.write_table(table)
+            else:
+                copy_to_postgres(conn, generator, batch)
+
+            written += len(batch['timestamp'])
+            labelled += int((batch['label'] >= 0).sum())
+            elapsed = time.perf_counter() - started
+            print(f"{written}/{events} events ({written / elapsed:.0f}/s)", flush=True)
+    finally:
+        if writer is not None:
+            writer.close()
+        if conn is not None:
+            conn.close()
+
+    elapsed = time.perf_counter() - started
+    return {
+        'events': written,
+        'labelled_anomalies': labelled,
+        'seconds': round(elapsed, 1),
+        'events_per_second': round(written / elapsed) if elapsed > 0 else 0
+    }
+
+
+def _parse_time(value: str) -> datetime:
+    parsed = datetime.fromisoformat(value)
+    return parsed.astimezone(timezone.utc) if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Backfill generated historical traffic events')
+    parser.add_argument('--start', required=True, type=_parse_time, help='ISO date/time, UTC unless an offset is given')
+    parser.add_argument('--end', required=True, type=_parse_time)
+    parser.add_argument('--events', type=int, default=1000000)
+    parser.add_argument('--locations', type=int, default=int(os.getenv('NUM_LOCATIONS', '5')))
+    parser.add_argument('--anomaly-rate', type=float, default=0.05)
+    parser.add_argument('--chunk-size', type=int, default=500000)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--parquet', help='write to this Parquet file instead of Postgres')
+    args = parser.parse_args()
+
+    if args.end <= args.start:
+        parser.error('--end must be after --start')
+
+    summary = backfill(
+        args.events, args.start, args.end, args.locations, args.anomaly_rate,
+        args.chunk_size, args.seed, args.parquet
+    )
+    print(summary)
@@ -0,0 +1,438 @@
+"""High-rate load generator for the ingest path
+
+Sends generated traffic events to POST /ingest/traffic at a target rate
+with a pooled async HTTP client, and reports client-side latency
+percentiles, a latency histogram and error rates.
+
+    python loadgen.py --rate 2000 --duration 60 --concurrency 128 --locations 500
+    python loadgen.py --profile ramp --rate 500 --peak-rate 5000 --duration 120
+    python loadgen.py --profile burst --rate 1000 --peak-rate 8000 --period 10 --burst-seconds 2
+
+Arrivals are open-loop: events are scheduled by the rate profile whether
+or not earlier requests have completed. When every connection is busy
+and the send queue is full, scheduled events are counted as ``dropped``
+rather than silently slowing the offered rate. Latency is measured from
+the moment an event was scheduled, so queueing inside the client is
+included. Use --processes to spread the load over several cores, and
+--batch-size to send events through POST /ingest/traffic/batch: each
+worker then takes up to that many due events per request.
+"""
+import argparse
+import asyncio
+import bisect
+import json
+import math
+import multiprocessing
+import os
+import time
+from typing import Optional, List, Dict, Any
+
+import httpx
+from dotenv import load_dotenv
+
+from publisher import TrafficDataGenerator
+
+load_dotenv()
+
+PROFILES = ['constant', 'ramp', 'burst']
+
+# Connections per pooled client. httpcore's pool bookkeeping grows with the
+# number of connections times waiting requests, so large concurrency is
+# spread over several small pools instead of one big one.
+CONNECTIONS_PER_CLIENT = 8
+
+# Histogram bucket upper bounds in milliseconds (the last bucket is open-ended)
+LATENCY_BUCKETS_MS = [0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+
+def _percentile(ordered: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))]
+
+
+class RateProfile:
+    """Target events/sec as a function of seconds since the start
+
+    constant: ``rate`` throughout
+    ramp:     linear from ``rate`` to ``peak_rate`` over ``duration``
+    burst:    ``peak_rate`` for the first ``burst_seconds`` of every
+              ``period`` seconds, ``rate`` otherwise
+    """
+
+    def __init__(
+        self,
+        kind: str = 'constant',
+        rate: float = 100.0,
+        peak_rate: Optional[float] = None,
+        duration: float = 60.0,
+        period: float = 10.0,
+        burst_seconds: float = 1.0
+    ):
+        if kind not in PROFILES:
+            raise ValueError(f'Unknown rate profile: {kind}')
+
+        self.kind = kind
+        self.rate = rate
+        self.peak_rate = rate if peak_rate is None else peak_rate
+        self.duration = duration
+        self.period = period
+        self.burst_seconds = burst_seconds
+
+    def rate_at(self, t: float) -> float:
+        if self.kind == 'ramp':
+            return self.rate + (self.peak_rate - self.rate) * min(t / self.duration, 1.0)
+        if self.kind == 'burst':
+            return self.peak_rate if t % self.period < self.burst_seconds else self.rate
+        return self.rate
+
+    def scaled(self, factor: float) -> 'RateProfile':
+        """The same profile with every rate multiplied by ``factor``"""
+        return RateProfile(
+            self.kind, self.rate * factor, self.peak_rate * factor,
+            self.duration, self.period, self.burst_seconds
+        )
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram plus raw samples for exact percentiles"""
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.samples: List[float] = []
+
+    def record(self, latency_ms: float) -> None:
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS_MS, latency_ms)] += 1
+        self.samples.append(latency_ms)
+
+    def merge(self, other: 'LatencyHistogram') -> None:
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.samples.extend(other.samples)
+
+    def summary(self) -> Dict[str, Any]:
+        labels = [f'<={b:g}ms' for b in LATENCY_BUCKETS_MS] + [f'>{LATENCY_BUCKETS_MS[-1]:g}ms']
+        ordered = sorted(self.samples)
+
+        def pick(q):
+            value = _percentile(ordered, q)
+            return None if value is None else round(value, 3)
+
+        return {
+            'count': len(ordered),
+            'mean_ms': round(sum(ordered) / len(ordered), 3) if ordered else None,
+            'p50_ms': pick(50),
+            'p90_ms': pick(90),
+            'p99_ms': pick(99),
+            'p999_ms': pick(99.9),
+            'max_ms': round(ordered[-1], 3) if ordered else None,
+            'histogram': {label: count for label, count in zip(labels, self.counts) if count}
+        }
+
+
+class LoadGenerator:
+    """Drive POST /ingest/traffic (or the batch endpoint) at the rate given by a RateProfile"""
+
+    def __init__(
+        self,
+        backend_url: str,
+        profile: RateProfile,
+        duration: float,
+        concurrency: int = 64,
+        num_locations: int = 100,
+        timeout: float = 5.0,
+        report_interval: float = 5.0,
+        quiet: bool = False,
+        batch_size: int = 1
+    ):
+        self.backend_url = backend_url.rstrip('/')
+        self.profile = profile
+        self.duration = duration
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.report_interval = report_interval
+        self.quiet = quiet
+        self.batch_size = batch_size
+        self.generator = TrafficDataGenerator(num_locations)
+
+        self.histogram = LatencyHistogram()
+        self.scheduled = 0
+        self.sent = 0
+        self.succeeded = 0
+        self.dropped = 0
+        self.errors: Dict[str, int] = {}
+
+    def _error(self, kind: str) -> None:
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    async def _worker(self, client: httpx.AsyncClient, queue: asyncio.Queue) -> None:
+        if self.batch_size > 1:
+            return await self._batch_worker(client, queue)
+
+        endpoint = f"{self.backend_url}/ingest/traffic"
+
+        while True:
+            scheduled_at = await queue.get()
+            if scheduled_at is None:
+                return
+
+            event = self.generator.generate_event()
+            self.sent += 1
+            try:
+                response = await client.post(endpoint, json=event)
+                if response.status_code == 201:
+                    self.succeeded += 1
+                else:
+                    self._error(f'http_{response.status_code}')
+            except httpx.TimeoutException:
+                self._error('timeout')
+            except httpx.HTTPError as e:
+                self._error(type(e).__name__)
+            finally:
+                self.histogram.record((time.perf_counter() - scheduled_at) * 1000)
+
+    async def _batch_worker(self, client: httpx.AsyncClient, queue: asyncio.Queue) -> None:
+        endpoint = f"{self.backend_url}/ingest/traffic/batch"
+
+        while True:
+            # Block for one due event, then take whatever else is already due
+            scheduled = [await queue.get()]
+            while scheduled[-1] is not None and len(scheduled) < self.batch_size and not queue.empty():
+                scheduled.append(queue.get_nowait())
+
+            stop = scheduled[-1] is None
+            if stop:
+                scheduled.pop()
+
+            if scheduled:
+                await self._send_batch(client, endpoint, scheduled)
+            if stop:
+                return
+
+    async def _send_batch(self, client: httpx.AsyncClient, endpoint: str, scheduled: List[float]) -> None:
+        events = [self.generator.generate_event() for _ in scheduled]
+        self.sent += len(events)
+        try:
+            response = await client.post(endpoint, json=events)
+            if response.status_code in (201, 207, 400) and response.headers.get('content-type', '').startswith('application/json'):
+                for result in response.json().get('results', []):
+                    if result['success']:
+                        self.succeeded += 1
+                    else:
+                        self._error('rejected')
+            else:
+                for _ in events:
+                    self._error(f'http_{response.status_code}')
+        except httpx.TimeoutException:
+            for _ in events:
+                self._error('timeout')
+        except httpx.HTTPError as e:
+            for _ in events:
+                self._error(type(e).__name__)
+        finally:
+            now = time.perf_counter()
+            for scheduled_at in scheduled:
+                self.histogram.record((now - scheduled_at) * 1000)
+
+    async def _schedule(self, queue: asyncio.Queue, started: float) -> None:
+        """Enqueue scheduled send times in small ticks, following the rate profile"""
+        tick = 0.005
+        owed = 0.0
+        last = started
+
+        while True:
+            now = time.perf_counter()
+            elapsed = now - started
+            if elapsed >= self.duration:
+                return
+
+            owed += self.profile.rate_at(elapsed) * (now - last)
+            last = now
+
+            due = int(owed)
+            owed -= due
+            for _ in range(due):
+                self.scheduled += 1
+                try:
+                    queue.put_nowait(now)
+                except asyncio.QueueFull:
+                    self.dropped += 1
+
+            await asyncio.sleep(tick)
+
+    async def _report(self, started: float) -> None:
+        previous = 0
+        while True:
+            await asyncio.sleep(self.report_interval)
+            completed = len(self.histogram.samples)
+            recent = sorted(self.histogram.samples[previous:])
+            previous = completed
+            p99 = _percentile(recent, 99)
+
+            print(
+                f"[{time.perf_counter() - started:6.1f}s] target={self.profile.rate_at(time.perf_counter() - started):.0f}/s "
+                f"achieved={len(recent) / self.report_interval:.0f}/s completed={completed} "
+                f"errors={sum(self.errors.values())} dropped={self.dropped} "
+                f"p99={'-' if p99 is None else f'{p99:.1f}ms'}",
+                flush=True
+            )
+
+    async def run(self) -> Dict[str, Any]:
+        limits = httpx.Limits(
+            max_connections=CONNECTIONS_PER_CLIENT,
+            max_keepalive_connections=CONNECTIONS_PER_CLIENT
+        )
+        clients = [
+            httpx.AsyncClient(timeout=self.timeout, limits=limits)
+            for _ in range(math.ceil(self.concurrency / CONNECTIONS_PER_CLIENT))
+        ]
+        # Bounded so a stalled backend shows up as dropped events, not unbounded memory
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 4)
+
+        try:
+            workers = [
+                asyncio.create_task(self._worker(clients[i // CONNECTIONS_PER_CLIENT], queue))
+                for i in range(self.concurrency)
+            ]
+            started = time.perf_counter()
+            reporter = None if self.quiet else asyncio.create_task(self._report(started))
+
+            await self._schedule(queue, started)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+            elapsed = time.perf_counter() - started
+
+            if reporter is not None:
+                reporter.cancel()
+        finally:
+            for client in clients:
+                await client.aclose()
+
+        return self.result(elapsed)
+
+    def result(self, elapsed: float) -> Dict[str, Any]:
+        return {
+            'profile': self.profile.kind,
+            'batch_size': self.batch_size,
+            'elapsed_seconds': round(elapsed, 3),
+            'scheduled': self.scheduled,
+            'sent': self.sent,
+            'succeeded': self.succeeded,
+            'dropped': self.dropped,
+            'errors': self.errors,
+            'achieved_rate': round(self.succeeded / elapsed, 1) if elapsed > 0 else 0.0,
+            'error_rate': round(sum(self.errors.values()) / self.sent, 5) if self.sent else 0.0,
+            'latency': self.histogram.summary()
+        }
+
+
+def _run_process(args: Dict[str, Any]) -> Dict[str, Any]:
+    """Run one LoadGenerator in a worker process and return its raw results"""
+    generator = LoadGenerator(**args)
+    result = asyncio.run(generator.run())
+    result['_histogram'] = (generator.histogram.counts, generator.histogram.samples)
+    return result
+
+
+def run_load(
+    backend_url: str,
+    profile: RateProfile,
+    duration: float,
+    concurrency: int,
+    num_locations: int,
+    timeout: float,
+    processes: int = 1,
+    batch_size: int = 1
+) -> Dict[str, Any]:
+    """Run the load test, optionally split evenly over several processes"""
+    if processes <= 1:
+        return asyncio.run(LoadGenerator(
+            backend_url, profile, duration, concurrency, num_locations, timeout,
+            batch_size=batch_size
+        ).run())
+
+    args = {
+        'backend_url': backend_url,
+        'profile': profile.scaled(1 / processes),
+        'duration': duration,
+        'concurrency': max(1, concurrency // processes),
+        'num_locations': num_locations,
+        'timeout': timeout,
+        'quiet': True,
+        'batch_size': batch_size
+    }
+
+    print(f"Running {processes} processes...", flush=True)
+    with multiprocessing.get_context('spawn').Pool(processes) as pool:
+        results = pool.map(_run_process, [args] * processes)
+
+    histogram = LatencyHistogram()
+    merged: Dict[str, Any] = {
+        'profile': profile.kind, 'batch_size': batch_size, 'processes': processes, 'errors': {}
+    }
+    for result in results:
+        counts, samples = result.pop('_histogram')
+        part = LatencyHistogram()
+        part.counts, part.samples = counts, samples
+        histogram.merge(part)
+
+        for key in ('scheduled', 'sent', 'succeeded', 'dropped'):
+            merged[key] = merged.get(key, 0) + result[key]
+        for kind, count in result['errors'].items():
+            merged['errors'][kind] = merged['errors'].get(kind, 0) + count
+
+    elapsed = max(result['elapsed_seconds'] for result in results)
+    merged['elapsed_seconds'] = elapsed
+    merged['achieved_rate'] = round(merged['succeeded'] / elapsed, 1) if elapsed > 0 else 0.0
+    merged['error_rate'] = round(sum(merged['errors'].values()) / merged['sent'], 5) if merged['sent'] else 0.0
+    merged['latency'] = histogram.summary()
+    return merged
+
+
+def main():
+    backend_host = os.getenv('BACKEND_HOST', 'backend')
+    backend_port = os.getenv('BACKEND_PORT', '3000')
+
+    parser = argparse.ArgumentParser(description='PatternScope ingest load generator')
+    parser.add_argument('--target', default=os.getenv('LOADGEN_TARGET', f'http://{backend_host}:{backend_port}'))
+    parser.add_argument('--profile', choices=PROFILES, default=os.getenv('LOADGEN_PROFILE', 'constant'))
+    parser.add_argument('--rate', type=float, default=float(os.getenv('LOADGEN_RATE', '1000')),
+                        help='events/sec (starting rate for ramp, base rate for burst)')
+    parser.add_argument('--peak-rate', type=float, default=None,
+                        help='final rate for ramp, burst rate for burst')
+    parser.add_argument('--duration', type=float, default=float(os.getenv('LOADGEN_DURATION', '30')))
+    parser.add_argument('--period', type=float, default=10.0, help='burst period in seconds')
+    parser.add_argument('--burst-seconds', type=float, default=1.0, help='burst length within each period')
+    parser.add_argument('--concurrency', type=int, default=int(os.getenv('LOADGEN_CONCURRENCY', '64')),
+                        help='maximum in-flight requests (and pooled connections)')
+    parser.add_argument('--locations', type=int, default=int(os.getenv('NUM_LOCATIONS', '100')))
+    parser.add_argument('--timeout', type=float, default=5.0)
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=int(os.getenv('LOADGEN_BATCH_SIZE', '1')),
+                        help='events per request; above 1 uses the batch endpoint')
+    parser.add_argument('--output', help='write the JSON summary to this file')
+    args = parser.parse_args()
+
+    profile = RateProfile(
+        args.profile, args.rate, args.peak_rate, args.duration, args.period, args.burst_seconds
+    )
+
+    print(f"Load test: {args.profile} profile, {args.rate:g}/s"
+          + (f" -> {args.peak_rate:g}/s" if args.peak_rate else "")
+          + f" for {args.duration:g}s against {args.target}", flush=True)
+
+    result = run_load(
+        args.target, profile, args.duration, args.concurrency,
+        args.locations, args.timeout, args.processes, args.batch_size
+    )
+
+    print(json.dumps(result, indent=2))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
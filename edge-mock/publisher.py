@@ -3,18 +3,29 @@ import requests
 import random
 import json
 import os
-from datetime import datetime, timedelta
-from typing import Dict, Any
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, List, Optional
+import numpy as np
 from dotenv import load_dotenv
 
 load_dotenv()
 
 
+ANOMALY_TYPES = ['high_speed', 'low_speed', 'high_density', 'low_density']
+WEATHER = ['clear', 'rainy', 'cloudy']
+VISIBILITY = ['good', 'moderate', 'poor']
+
+
 class TrafficDataGenerator:
-    """Generate realistic mock traffic data"""
+    """Generate realistic mock traffic data
 
-    def __init__(self):
-        self.location_ids = [1, 2, 3, 4, 5]
+    Injected anomalies are labelled in ``raw_features['injected_anomaly']``
+    (one of ANOMALY_TYPES), so detectors can be scored against ground truth.
+    """
+
+    def __init__(self, num_locations: int = 5, anomaly_rate: float = 0.05):
+        self.location_ids = list(range(1, num_locations + 1))
+        self.anomaly_rate = anomaly_rate
         self.colors = ['white', 'black', 'silver', 'gray', 'red', 'blue', 'brown', 'green', 'yellow']
         self.color_probabilities = [0.24, 0.22, 0.16, 0.14, 0.10, 0.08, 0.03, 0.02, 0.01]
 
@@ -67,8 +78,9 @@ class TrafficDataGenerator:
         }
 
         # Occasionally inject anomalies for testing
-        if random.random() < 0.05:  # 5% chance of anomaly
-            anomaly_type = random.choice(['high_speed', 'low_speed', 'high_density', 'low_density'])
+        anomaly_type = None
+        if random.random() < self.anomaly_rate:
+            anomaly_type = random.choice(ANOMALY_TYPES)
 
             if anomaly_type == 'high_speed':
                 avg_speed *= 1.8
@@ -83,6 +95,13 @@ class TrafficDataGenerator:
                 vehicle_count = max(1, int(vehicle_count * 0.3))
                 density_score *= 0.3
 
+        raw_features = {
+            'weather': random.choice(WEATHER),
+            'visibility': random.choice(VISIBILITY)
+        }
+        if anomaly_type:
+            raw_features['injected_anomaly'] = anomaly_type
+
         return {
             'timestamp': now.isoformat(),
             'location_id': random.choice(self.location_ids),
@@ -93,23 +112,139 @@ class TrafficDataGenerator:
             'color_counts': color_counts,
             'inter_arrival_stats': inter_arrival_stats,
             'traffic_density_score': round(density_score, 3),
-            'raw_features': {
-                'weather': random.choice(['clear', 'rainy', 'cloudy']),
-                'visibility': random.choice(['good', 'moderate', 'poor'])
-            }
+            'raw_features': raw_features
+        }
+
+    def generate_batch(
+        self,
+        n: int,
+        start: datetime,
+        end: datetime,
+        rng: Optional[np.random.Generator] = None
+    ) -> Dict[str, np.ndarray]:
+        """Generate ``n`` events with timestamps spread over [start, end), as columns
+
+        Vectorized counterpart of generate_event with the same rush-hour,
+        night and normal profiles (by the hour of each timestamp) and the
+        same injected anomalies. Timestamps are sorted. Returns arrays keyed
+        by column: ``timestamp`` (datetime64[ms]), the scalar metrics,
+        ``color_counts`` (n x len(colors) ints), ``inter_arrival_mean``/
+        ``_std``/``_min``/``_max``, ``weather`` and ``visibility`` (indexes
+        into WEATHER/VISIBILITY) and ``label`` (index into ANOMALY_TYPES,
+        -1 for normal events).
+        """
+        rng = rng or np.random.default_rng()
+
+        # Aware datetimes are converted to UTC; naive ones are taken as UTC
+        start_ms, end_ms = (
+            np.datetime64((t.astimezone(timezone.utc) if t.tzinfo else t).replace(tzinfo=None), 'ms').astype(np.int64)
+            for t in (start, end)
+        )
+        timestamp = np.sort(rng.integers(start_ms, end_ms, n)).astype('datetime64[ms]')
+        hour = (timestamp.astype('datetime64[h]').astype(np.int64) % 24)
+
+        rush = ((hour >= 7) & (hour <= 9)) | ((hour >= 17) & (hour <= 19))
+        night = (hour >= 22) | (hour <= 5)
+        profile = np.where(rush, 0, np.where(night, 1, 2))
+
+        # Per-profile parameters, indexed by profile: rush hour, night, normal
+        count_low = np.array([40, 5, 20])[profile]
+        count_high = np.array([100, 20, 60])[profile]
+        speed_mean = np.array([25.0, 50.0, 40.0])[profile]
+        speed_std = np.array([8.0, 10.0, 12.0])[profile]
+        density_low = np.array([0.7, 0.1, 0.4])[profile]
+        density_high = np.array([1.0, 0.3, 0.7])[profile]
+
+        vehicle_count = rng.integers(count_low, count_high + 1)
+        avg_speed = np.maximum(5, rng.normal(speed_mean, speed_std))
+        density_score = rng.uniform(density_low, density_high)
+        min_speed = np.maximum(5, avg_speed - rng.uniform(5, 15, n))
+        max_speed = avg_speed + rng.uniform(10, 25, n)
+
+        # Colors in order, each capped by what the earlier ones left over
+        probabilities = np.array(self.color_probabilities)
+        raw_counts = (vehicle_count[:, None] * probabilities * rng.uniform(0.8, 1.2, (n, len(self.colors)))).astype(np.int64)
+        capped = np.minimum(np.cumsum(raw_counts, axis=1), vehicle_count[:, None])
+        color_counts = np.diff(capped, axis=1, prepend=0)
+
+        mean_interval = 3600 / vehicle_count
+
+        label = np.where(rng.random(n) < self.anomaly_rate, rng.integers(0, len(ANOMALY_TYPES), n), -1)
+
+        high_speed = label == ANOMALY_TYPES.index('high_speed')
+        avg_speed = np.where(high_speed, avg_speed * 1.8, avg_speed)
+        max_speed = np.where(high_speed, max_speed * 2.0, max_speed)
+
+        low_speed = label == ANOMALY_TYPES.index('low_speed')
+        avg_speed = np.where(low_speed, avg_speed * 0.3, avg_speed)
+        min_speed = np.where(low_speed, min_speed * 0.2, min_speed)
+
+        high_density = label == ANOMALY_TYPES.index('high_density')
+        vehicle_count = np.where(high_density, (vehicle_count * 2.5).astype(np.int64), vehicle_count)
+        density_score = np.where(high_density, np.minimum(1.0, density_score * 1.5), density_score)
+
+        low_density = label == ANOMALY_TYPES.index('low_density')
+        vehicle_count = np.where(low_density, np.maximum(1, (vehicle_count * 0.3).astype(np.int64)), vehicle_count)
+        density_score = np.where(low_density, density_score * 0.3, density_score)
+
+        return {
+            'timestamp': timestamp,
+            'location_id': rng.choice(np.array(self.location_ids), n),
+            'vehicle_count': vehicle_count,
+            'avg_speed': np.round(avg_speed, 2),
+            'min_speed': np.round(min_speed, 2),
+            'max_speed': np.round(max_speed, 2),
+            'color_counts': color_counts,
+            'inter_arrival_mean': mean_interval,
+            'inter_arrival_std': mean_interval * 0.4,
+            'inter_arrival_min': np.maximum(0.5, mean_interval * 0.2),
+            'inter_arrival_max': mean_interval * 2.5,
+            'traffic_density_score': np.round(density_score, 3),
+            'weather': rng.integers(0, len(WEATHER), n),
+            'visibility': rng.integers(0, len(VISIBILITY), n),
+            'label': label
         }
 
 
 class TrafficPublisher:
-    """Publish traffic events to backend API"""
+    """Publish traffic events to backend API
 
-    def __init__(self, backend_url: str, interval: int):
+    With ``batch_size`` > 1 events are buffered and sent to the batch
+    endpoint once ``batch_size`` events are waiting or the oldest has
+    waited ``max_batch_age`` seconds. The backend reports each event
+    separately; events it could not store because of a database error are
+    kept in the buffer for the next flush, rejected events are dropped.
+    After a failed flush the next one is not attempted for
+    ``max_batch_age`` seconds, so generation does not stall on retries for
+    every new event while the backend is down; meanwhile the buffer holds
+    at most ``max_buffer`` events (default ten batches) and the oldest are
+    dropped past that and counted in ``dropped``.
+    """
+
+    def __init__(
+        self,
+        backend_url: str,
+        interval: int,
+        num_locations: int = 5,
+        batch_size: int = 1,
+        max_batch_age: float = 30.0,
+        max_buffer: Optional[int] = None
+    ):
         self.backend_url = backend_url.rstrip('/')
         self.interval = interval
-        self.generator = TrafficDataGenerator()
+        self.generator = TrafficDataGenerator(num_locations)
         self.max_retries = 3
         self.retry_delay = 2
 
+        self.batch_size = batch_size
+        self.max_batch_age = max_batch_age
+        self.max_buffer = max(max_buffer or batch_size * 10, batch_size)
+        self.buffer: List[Dict[str, Any]] = []
+        self.buffer_started: float = 0.0
+        self.dropped = 0
+        self.next_flush_at: float = 0.0
+        self.overflowing = False
+
     def publish_event(self, event: Dict[str, Any]) -> bool:
         """Publish a single event to the backend"""
         endpoint = f"{self.backend_url}/ingest/traffic"
@@ -137,17 +272,105 @@ class TrafficPublisher:
 
         return False
 
+    def buffer_event(self, event: Dict[str, Any]) -> None:
+        """Add an event to the buffer, flushing it when full or too old"""
+        if not self.buffer:
+            self.buffer_started = time.monotonic()
+        self.buffer.append(event)
+
+        excess = len(self.buffer) - self.max_buffer
+        if excess > 0:
+            if not self.overflowing:
+                print(f"✗ Buffer full ({self.max_buffer} events), dropping the oldest until the backend is back")
+                self.overflowing = True
+            del self.buffer[:excess]
+            self.dropped += excess
+
+        if time.monotonic() < self.next_flush_at:
+            return
+
+        if len(self.buffer) >= self.batch_size or self.buffer_age() >= self.max_batch_age:
+            self.flush()
+
+    def buffer_age(self) -> float:
+        return time.monotonic() - self.buffer_started if self.buffer else 0.0
+
+    def flush(self) -> bool:
+        """Send the buffered events in one request to the batch endpoint"""
+        if not self.buffer:
+            return True
+
+        events = self.buffer
+        results = self.publish_batch(events)
+        if results is None:
+            # Nothing was stored; keep the events and back off before the next flush
+            self.next_flush_at = time.monotonic() + self.max_batch_age
+            return False
+
+        self.next_flush_at = 0.0
+        if self.overflowing:
+            print(f"✓ Backend is back; {self.dropped} events dropped so far")
+            self.overflowing = False
+
+        retry = []
+        for result in results:
+            if not result['success']:
+                event = events[result['index']]
+                print(f"✗ Event rejected: location={event['location_id']} - {result.get('error')}")
+                if result.get('retryable'):
+                    retry.append(event)
+
+        self.buffer = retry
+        self.buffer_started = time.monotonic()
+        return not retry
+
+    def publish_batch(self, events: List[Dict[str, Any]]) -> Optional[List[Dict[str, Any]]]:
+        """Publish events in one request; returns the per-event results, or None on failure"""
+        endpoint = f"{self.backend_url}/ingest/traffic/batch"
+
+        for attempt in range(self.max_retries):
+            try:
+                response = requests.post(
+                    endpoint,
+                    json=events,
+                    timeout=30
+                )
+
+                # 400 and 207 still carry per-event results
+                if response.status_code in (201, 207, 400) and 'results' in response.json():
+                    body = response.json()
+                    print(f"✓ Published batch: {body['inserted']} inserted, {body['failed']} failed")
+                    return body['results']
+
+                print(f"✗ Failed to publish batch of {len(events)}: {response.status_code} - {response.text[:200]}")
+
+            except (requests.exceptions.RequestException, ValueError) as e:
+                print(f"✗ Connection error (attempt {attempt + 1}/{self.max_retries}): {e}")
+
+            if attempt < self.max_retries - 1:
+                time.sleep(self.retry_delay * (attempt + 1))
+
+        return None
+
     def run(self):
         """Main loop to generate and publish events"""
         print(f"Starting traffic event publisher...")
         print(f"Backend URL: {self.backend_url}")
         print(f"Publish interval: {self.interval} seconds")
+        if self.batch_size > 1:
+            print(f"Batching: up to {self.batch_size} events or {self.max_batch_age} seconds")
         print()
 
-        while True:
-            event = self.generator.generate_event()
-            self.publish_event(event)
-            time.sleep(self.interval)
+        try:
+            while True:
+                event = self.generator.generate_event()
+                if self.batch_size > 1:
+                    self.buffer_event(event)
+                else:
+                    self.publish_event(event)
+                time.sleep(self.interval)
+        finally:
+            self.flush()
 
 
 if __name__ == '__main__':
@@ -156,8 +379,12 @@ if __name__ == '__main__':
     backend_url = f"http://{backend_host}:{backend_port}"
 
     interval = int(os.getenv('PUBLISH_INTERVAL', '10'))
+    num_locations = int(os.getenv('NUM_LOCATIONS', '5'))
+    batch_size = int(os.getenv('PUBLISH_BATCH_SIZE', '1'))
+    max_batch_age = float(os.getenv('PUBLISH_BATCH_MAX_AGE', '30'))
+    max_buffer = int(os.getenv('PUBLISH_BUFFER_MAX_EVENTS', '0')) or None
 
-    publisher = TrafficPublisher(backend_url, interval)
+    publisher = TrafficPublisher(backend_url, interval, num_locations, batch_size, max_batch_age, max_buffer)
 
     # Wait for backend to be ready
     print("Waiting for backend to be ready...")
@@ -0,0 +1,114 @@
+"""Local stand-in for the backend's ingest endpoints
+
+Accepts POST /ingest/traffic and /ingest/traffic/batch (and answers
+GET /health) without a
+database, so the load generator can be pointed at something that only
+measures the client and network path:
+
+    python stub_backend.py --port 3000 --latency-ms 2 --error-rate 0.01
+
+Keep-alive connections are supported. Responses match the backend's
+shape (201 with ``{"success": true, "id": ...}``, or per-event results
+for batches); ``--error-rate`` returns that fraction of requests as 500s
+and ``--latency-ms`` adds a fixed service delay.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+
+class StubBackend:
+    def __init__(self, latency_ms: float = 0.0, error_rate: float = 0.0):
+        self.latency = latency_ms / 1000
+        self.error_rate = error_rate
+        self.next_id = 1
+        self.requests = 0
+        self.started = time.time()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                body = await reader.readexactly(int(headers.get('content-length', '0')))
+                status, payload = await self.route(method, path, body)
+
+                data = json.dumps(payload).encode()
+                writer.write(
+                    f'HTTP/1.1 {status}\r\nContent-Type: application/json\r\n'
+                    f'Content-Length: {len(data)}\r\n\r\n'.encode() + data
+                )
+                await writer.drain()
+
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, method: str, path: str, body: bytes):
+        path = path.split('?', 1)[0]
+
+        if method == 'GET' and path == '/health':
+            return '200 OK', {'status': 'ok', 'service': 'stub-backend', 'requests': self.requests}
+
+        if method == 'POST' and path == '/ingest/traffic':
+            self.requests += 1
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            if self.error_rate and random.random() < self.error_rate:
+                return '500 Internal Server Error', {'success': False, 'error': 'injected error'}
+
+            json.loads(body)
+            event_id = self.next_id
+            self.next_id += 1
+            return '201 Created', {'success': True, 'id': event_id}
+
+        if method == 'POST' and path == '/ingest/traffic/batch':
+            self.requests += 1
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            if self.error_rate and random.random() < self.error_rate:
+                return '500 Internal Server Error', {'success': False, 'error': 'injected error'}
+
+            events = json.loads(body)
+            results = []
+            for index in range(len(events)):
+                results.append({'index': index, 'success': True, 'id': self.next_id})
+                self.next_id += 1
+            return '201 Created', {'success': True, 'inserted': len(results), 'failed': 0, 'results': results}
+
+        return '404 Not Found', {'error': 'Not found'}
+
+
+async def serve(host: str, port: int, latency_ms: float, error_rate: float) -> None:
+    backend = StubBackend(latency_ms, error_rate)
+    server = await asyncio.start_server(backend.handle, host, port, backlog=1024)
+    print(f"Stub backend listening on http://{host}:{port}", flush=True)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Stand-in backend for load tests')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=3000)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    asyncio.run(serve(args.host, args.port, args.latency_ms, args.error_rate))